@@ -19,14 +19,24 @@ from __future__ import unicode_literals
 from __future__ import print_function
 
 import os
+import posixpath
 import re
 import six
 import subprocess
 import sys
+import datetime
 import threading
 import time
+import uuid
 
 from qt4a.androiddriver.adbclient import ADBClient
+from qt4a.androiddriver.cache import DeviceCache
+from qt4a.androiddriver.logcat import (
+    LogcatBinaryParser,
+    LogcatStore,
+    LogcatSubscription,
+    threadtime_pattern,
+)
 from qt4a.androiddriver.util import (
     Deprecated,
     logger,
@@ -40,8 +50,11 @@ from qt4a.androiddriver.util import (
     enforce_utf8_decode,
     general_encode,
     time_clock,
+    format_args,
+    get_file_md5,
     get_command_path,
-    get_adb_server_port
+    get_adb_server_port,
+    get_zip_fingerprint,
 )
 
 # try:
@@ -228,6 +241,241 @@ def static_result(func):
     return _wrap_func
 
 
+class ShellSession(object):
+    """常驻的shell会话
+
+    保持一个shell:连接，命令以`( cmd ) 2>&1 </dev/null`形式写入标准输入，并在前后输出唯一标记，
+    据此拆分出每条命令的输出与退出码，避免每条命令都在设备上创建新的shell进程；
+    root会话在打开时执行一次su，后续命令都在su的shell中执行
+    """
+
+    max_open_failures = 2  # 连续打开失败次数超过该值后不再使用会话
+
+    def __init__(self, adb, root=False):
+        self._adb = adb
+        self._root = root
+        self._proc = None
+        self._lock = threading.Lock()
+        self._marker = "__QT4A_%s" % uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._open_failures = 0
+
+    @property
+    def available(self):
+        return self._open_failures < self.max_open_failures
+
+    def _write(self, data):
+        self._proc.stdin.write(data.encode("utf8"))
+
+    def _open(self):
+        proc = self._adb.run_adb_cmd("shell", "sh", sync=False)
+        if not hasattr(proc, "stdin"):
+            raise RuntimeError("Open shell session failed: %r" % (proc,))
+        self._proc = proc
+        self._write("stty -echo 2>/dev/null; PS1=; PS2=\n")
+        if self._root:
+            self._write("%s\n" % self._adb._get_su_shell_cmdline())
+            self._write("PS1=; PS2=\n")
+            output, _ = self._execute("id", 30)
+            if b"uid=0(" not in output:
+                raise RuntimeError("Open root shell session failed: %r" % output)
+        else:
+            self._execute("true", 30)
+
+    def _execute(self, cmd_line, timeout):
+        self._seq += 1
+        begin = "%s_B%d" % (self._marker, self._seq)
+        end = "%s_E%d_" % (self._marker, self._seq)
+        self._write(
+            "echo %s; ( %s\n) 2>&1 </dev/null; r=$?; echo; echo %s$r\n"
+            % (begin, cmd_line, end)
+        )
+        end_pattern = re.compile(br"%s(\d+)$" % end.encode("utf8"))
+        begin = begin.encode("utf8")
+        time0 = time.time()
+        started = False
+        lines = []
+        while True:
+            if timeout != None:
+                line = self._proc.stdout.readline(
+                    max(0, timeout - (time.time() - time0))
+                )
+            else:
+                line = self._proc.stdout.readline()
+            if not line:
+                raise RuntimeError("Shell session closed")
+            line = line.rstrip(b"\r\n")
+            if not started:
+                started = line.endswith(begin)
+                continue
+            ret = end_pattern.search(line)
+            if ret:
+                if lines and not lines[-1]:
+                    lines.pop()  # 命令结束后额外输出的换行
+                return b"\n".join(lines), int(ret.group(1))
+            lines.append(line)
+
+    def run(self, cmd_line, timeout=None):
+        """执行命令
+
+        :param timeout: 超时时间，超时后会话会被关闭，下次使用时重新创建
+        :type  timeout: float
+        :return: (输出, 退出码)，会话正被其它线程使用时返回None
+        """
+        if not self._lock.acquire(False):
+            return None
+        try:
+            if self._proc is None or self._proc.poll() != None:
+                try:
+                    self._open()
+                except Exception:
+                    self._open_failures += 1
+                    raise
+                self._open_failures = 0
+            return self._execute(cmd_line, timeout)
+        except Exception:
+            self._close()
+            raise
+        finally:
+            self._lock.release()
+
+    def _close(self):
+        if self._proc:
+            try:
+                self._proc.terminate()
+            except Exception:
+                logger.exception("close shell session failed")
+            self._proc = None
+
+    def close(self):
+        """关闭会话
+        """
+        with self._lock:
+            self._close()
+
+
+class ProcessTable(object):
+    """设备进程表缓存
+
+    按进程ID和进程名索引，查询为O(1)；多个线程同时需要刷新时只执行一次ps命令。
+    每次刷新会与上一次结果比较，进程名发生变化时通知监听者。
+    """
+
+    retry_count = 3
+
+    def __init__(self, adb):
+        self._adb = adb
+        self._cond = threading.Condition()
+        self._started = 0  # 已开始的刷新次数
+        self._finished = 0  # 最近一次成功完成的刷新序号
+        self._refreshing = False
+        self._process_list = []
+        self._pids = {}
+        self._names = {}
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """添加进程名变化的监听者
+
+        :param listener: 回调函数，参数为(pid, old_name, new_name)，在刷新线程中调用
+        :type listener:  function
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """移除监听者
+        """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _load(self):
+        for _ in range(self.retry_count):
+            try:
+                return self._adb._list_process()
+            except RuntimeError as e:
+                logger.warn("%s" % e)
+        else:
+            raise RuntimeError("获取进程列表失败")
+
+    def _update(self, process_list):
+        pids = {}
+        names = {}
+        for item in process_list:
+            pids[item["pid"]] = item
+            names.setdefault(item["proc_name"], item["pid"])
+        for pid, item in pids.items():
+            old_item = self._pids.get(pid)
+            if old_item and old_item["proc_name"] != item["proc_name"]:
+                for listener in self._listeners:
+                    try:
+                        listener(pid, old_item["proc_name"], item["proc_name"])
+                    except:
+                        logger.exception("process listener %r failed" % listener)
+        self._process_list = process_list
+        self._pids = pids
+        self._names = names
+
+    def refresh(self):
+        """刷新进程表，保证返回的结果是在调用之后获取的
+
+        :rtype: list
+        """
+        self._cond.acquire()
+        try:
+            need = self._started + 1
+            while self._finished < need:
+                if self._refreshing:
+                    # 已有刷新在进行，等待其完成后判断是否满足要求
+                    self._cond.wait()
+                    continue
+                self._refreshing = True
+                self._started += 1
+                generation = self._started
+                self._cond.release()
+                try:
+                    process_list = self._load()
+                finally:
+                    self._cond.acquire()
+                    self._refreshing = False
+                    self._cond.notify_all()
+                self._update(process_list)
+                self._finished = generation
+            return list(self._process_list)
+        finally:
+            self._cond.release()
+
+    def get(self, pid, refresh=True):
+        """根据进程ID获取进程信息
+
+        :param pid:     进程ID
+        :type pid:      int
+        :param refresh: 缓存中不存在时是否刷新进程表
+        :type refresh:  bool
+        :rtype: dict
+        """
+        item = self._pids.get(pid)
+        if item is None and refresh:
+            self.refresh()
+            item = self._pids.get(pid)
+        return item
+
+    def get_pid(self, proc_name, refresh=True):
+        """根据进程名获取进程ID，不存在时返回0
+        """
+        if refresh:
+            self.refresh()
+        return self._names.get(proc_name, 0)
+
+    def clear(self):
+        """清空缓存
+        """
+        with self._cond:
+            self._process_list = []
+            self._pids = {}
+            self._names = {}
+
+
 class ADB(object):
     """封装ADB功能
     """
@@ -236,6 +484,48 @@ class ADB(object):
     x86 = "x86"
 
     connect_timeout = 300  # 连接设备的超时时间
+    use_shell_session = True  # 同步执行的shell命令是否通过常驻shell会话执行
+    stream_install = True  # Android 5.0以上是否将APK数据直接写入pm安装，不上传到设备中
+    _apk_info_cache = {}  # APK绝对路径 => (mtime, size, APK信息)
+    logcat_max_lines = 500000  # 内存中保留的logcat最大行数，超出部分写入临时文件
+    logcat_max_age = None  # 内存中logcat日志的最长保留时间（秒）
+    logcat_compress = "gzip"  # logcat日志落盘的压缩格式，可选gzip或zstd
+    logcat_pid_check_interval = 2  # 设备端按进程ID过滤时检查进程是否重启的间隔
+    logcat_buffer_sdk = {"crash": 21, "all": 21, "security": 24, "stats": 26}
+    _process_name_pattern = re.compile(r"^(.+)\((\d+)\)$")
+    list_dir_cache_ttl = 0  # list_dir结果的缓存时间（秒），为0时不缓存
+    persist_properties = False  # 是否将只读属性按设备序列号与启动标识缓存到本地磁盘
+    _property_pattern = re.compile(r"^\[([^\]]+)\]: \[(.*?)\]\r?$", re.M | re.S)
+    # ls -l的输出格式，首次解析时按顺序匹配确定
+    _list_dir_patterns = [
+        # toybox：drwxr-x--x 4 u0_a1 u0_a1 4096 2021-01-01 10:00 name
+        (
+            "toybox",
+            re.compile(
+                r"^([-dl])(\S+)\s+\d+\s+\S+\s+\S+\s+(\d+)\s+"
+                r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d) (.*?)\r?$",
+                re.M,
+            ),
+        ),
+        # toolbox：drwxr-x--x u0_a1 u0_a1 2021-01-01 10:00 name，目录和软链没有size字段
+        (
+            "toolbox",
+            re.compile(
+                r"^([-dl])(\S+)\s+\S+\s+\S+\s+(?:(\d+)\s+)?"
+                r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d) (.*?)\r?$",
+                re.M,
+            ),
+        ),
+        # busybox：-rwxrwxrwx 1 shell shell 13652 Jun  3 10:56 /data/local/tmp/qt4a/inject
+        (
+            "busybox",
+            re.compile(
+                r"^([-dl])(\S+)\s+\d+\s+\S+\s+\S+\s+(\d+)\s+"
+                r"\w+\s+\d+\s+(\S+) (.*?)\r?$",
+                re.M,
+            ),
+        ),
+    ]
 
     def __init__(self, backend):
         self._backend = backend
@@ -245,8 +535,30 @@ class ADB(object):
         self._need_quote = None  # 执行shell命令时有些手机需要引号，有些不需要
         self._log_filter_thread_list = []  # 不打印log的线程id列表
         self._shell_prefix = None  # 有些设备上会有固定输出
-        self._logcat_callbacks = []
+        self._logcat_callbacks = {}  # 回调函数与订阅的对应关系
+        self._logcat_subscriptions = []
+        self._process_table = ProcessTable(self)
+        self._logcat_filter = None  # 设备端logcat过滤条件
+        self._logcat_stats = {"received": 0, "kept": 0, "restarts": 0}
+        self._logcat_last_time = None
+        self._logcat_binary = False  # 是否使用logcat -B二进制格式
+        self._logcat_aggregator = None  # 负责处理logcat输出的LogcatAggregator
+        self._list_dir_format = None  # ls -l的输出格式
+        self._list_dir_cache = {}  # (路径, run_as) => (缓存时间, 目录列表, 文件列表)
+        self._properties = None  # 系统属性快照
+        self._log_store = LogcatStore(
+            self.logcat_max_lines,
+            self.logcat_max_age,
+            True,
+            self.logcat_compress,
+        )
         self._newline = None  # 不同手机使用的换行会不同
+        self._boot_id = None  # 设备本次启动的唯一标识
+        self._features = None  # adbd支持的特性列表
+        self._page_size = None  # 内存页大小
+        self._decompress_cmd = None
+        self._shell_sessions = {}  # 常驻shell会话，分为普通会话与root会话
+        self._shell_session_lock = threading.Lock()
 
     @property
     def device_host(self):
@@ -272,6 +584,18 @@ class ADB(object):
         if thread.ident in self._log_filter_thread_list:
             self._log_filter_thread_list.remove(thread.ident)
 
+    def _log_adb_cmd(self, cmd, args):
+        if not threading.current_thread().ident in self._log_filter_thread_list:
+            logger.info(
+                "adb %s:%s %s %s"
+                % (
+                    self._backend.device_host,
+                    self._backend.device_name,
+                    cmd,
+                    format_args(args),
+                )
+            )
+
     def run_adb_cmd(self, cmd, *args, **kwargs):
         """执行adb命令
         """
@@ -286,16 +610,7 @@ class ADB(object):
             sync = kwargs.pop("sync")
 
         for _ in range(retry_count):
-            if not threading.current_thread().ident in self._log_filter_thread_list:
-                logger.info(
-                    "adb %s:%s %s %s"
-                    % (
-                        self._backend.device_host,
-                        self._backend.device_name,
-                        cmd,
-                        " ".join(args),
-                    )
-                )
+            self._log_adb_cmd(cmd, args)
             time0 = time_clock()
             try:
                 result = self._backend.run_adb_cmd(
@@ -322,6 +637,58 @@ class ADB(object):
                 out = out.strip()
             return out
 
+    def _get_su_shell_cmdline(self):
+        """获取启动root shell的命令行
+        """
+        if self._root_state == EnumRootState.Su2Root:
+            return "su root"
+        return "su"
+
+    def get_shell_session(self, root=False):
+        """获取常驻shell会话
+
+        :param root: 是否为root会话
+        :type  root: bool
+        :rtype: ShellSession
+        """
+        with self._shell_session_lock:
+            if root not in self._shell_sessions:
+                self._shell_sessions[root] = ShellSession(self, root)
+            return self._shell_sessions[root]
+
+    def close_shell_sessions(self):
+        """关闭所有常驻shell会话
+        """
+        with self._shell_session_lock:
+            session_list = list(self._shell_sessions.values())
+            self._shell_sessions = {}
+        for session in session_list:
+            session.close()
+
+    def _run_in_shell_session(self, cmd_line, root, kwds):
+        """尝试在常驻shell会话中执行命令
+
+        :return: (是否已执行, 输出)，未执行时需要使用普通方式执行
+        """
+        if not self.use_shell_session or not kwds.get("sync", True):
+            return False, None
+        session = self.get_shell_session(root)
+        if not session.available:
+            return False, None
+        self._log_adb_cmd("shell", (cmd_line,))
+        try:
+            result = session.run(cmd_line, kwds.get("timeout", 20))
+        except TimeoutError:
+            # 会话已被关闭，使用普通方式重新执行
+            logger.warn("Run %s in shell session timeout" % cmd_line)
+            return False, None
+        except Exception as e:
+            logger.warn("Run %s in shell session failed: %s" % (cmd_line, e))
+            return False, None
+        if result is None:
+            return False, None  # 会话正被其它线程使用
+        return True, result[0].strip()
+
     def _gen_su_cmdline(self, cmdline, root_status, need_quote=False):
         if root_status == EnumRootState.SuRoot:
             if need_quote:
@@ -389,6 +756,13 @@ class ADB(object):
 
             if not need_su:
                 return self.run_shell_cmd(cmd_line, **kwds)
+
+        if not binary_output:
+            handled, result = self._run_in_shell_session(cmd_line, root, kwds)
+            if handled:
+                return _handle_result(result)
+
+        if root:
             if self._need_quote == None:
                 self._check_need_quote()
             if self._need_quote:
@@ -416,8 +790,75 @@ class ADB(object):
 
         return _handle_result(self.run_adb_cmd("shell", cmd_line, **kwds))
 
+    def _gen_root_script(self, script):
+        """生成以root权限运行一段脚本的命令行，整段脚本只启动一次su
+        """
+        if self._root_state == EnumRootState.Unknown:
+            self._root_state = self.get_root_state()
+        if self._root_state == EnumRootState.AdbdRoot:
+            return script
+        elif self._root_state == EnumRootState.NonRoot:
+            raise RuntimeError("device is not rooted")
+        script = "'%s'" % script.replace("'", "'\\''")
+        if self._root_state == EnumRootState.SuRoot:
+            return "su -c %s" % script
+        return "su root sh -c %s" % script
+
+    def run_shell_batch(self, cmd_list, root=False, **kwds):
+        """在一次shell调用中依次执行多条命令
+
+        每条命令后输出唯一的分隔标记及退出码，再按标记拆分出每条命令的结果，命令行过长时自动分批
+
+        :param cmd_list: 要运行的命令行列表
+        :type  cmd_list: list
+        :param root:     是否使用root权限
+        :type  root:     bool
+        :return: [(输出, 退出码), ...]
+        """
+        sentinel = "__QT4A_%s__" % uuid.uuid4().hex[:16]
+        pattern = re.compile(r"^%s(\d+)$" % sentinel)
+        script_list = [
+            "%s; r=$?; echo; echo %s$r" % (cmd_line, sentinel) for cmd_line in cmd_list
+        ]
+
+        batch_list = [[]]
+        batch_size = 0
+        for script in script_list:
+            if batch_list[-1] and batch_size + len(script) > 3000:
+                batch_list.append([])
+                batch_size = 0
+            batch_list[-1].append(script)
+            batch_size += len(script) + 2
+
+        result = []
+        for batch in batch_list:
+            if not batch:
+                continue
+            cmd_line = "; ".join(batch)
+            if root:
+                cmd_line = self._gen_root_script(cmd_line)
+            output = self.run_shell_cmd(cmd_line, **kwds)
+            batch_result = []
+            lines = []
+            for line in output.split("\n"):
+                ret = pattern.match(line.strip())
+                if ret:
+                    batch_result.append(("\n".join(lines).strip(), int(ret.group(1))))
+                    lines = []
+                else:
+                    lines.append(line)
+            if len(batch_result) != len(batch):
+                raise RuntimeError("Run shell batch failed: %r" % output)
+            result.extend(batch_result)
+        return result
+
     def reboot(self, _timeout=180):
         """重启手机"""
+        self._boot_id = None
+        self._process_table.clear()
+        self._list_dir_cache = {}
+        self._properties = None
+        self.close_shell_sessions()
         try:
             self.run_adb_cmd("reboot", retry_count=1, timeout=30)
         except TimeoutError:
@@ -447,10 +888,31 @@ class ADB(object):
         if not boot_complete:
             raise RuntimeError("dev.bootcomplete 标志在  %s 秒后仍未设置，手机重启失败" % _timeout)
 
-    def start_logcat(self, process_list=[], params="", clear=True):
+    def start_logcat(
+        self,
+        process_list=[],
+        params="",
+        clear=True,
+        filter_on_device=False,
+        tag_specs=None,
+        buffers=None,
+        binary=False,
+        aggregator=None,
+    ):
         """运行logcat进程
         :param process_list: 要捕获日志的进程名或进程ID列表，为空则捕获所有进程
         :type process_list:  list
+        :param filter_on_device: 是否在设备端按进程过滤，SDK>=28时使用--uid，
+                                 SDK>=24且只有一个进程时使用--pid，进程重启后会自动更新
+        :type filter_on_device:  bool
+        :param tag_specs:    设备端的tag过滤规则，如["ActivityManager:I", "*:S"]
+        :type tag_specs:     list
+        :param buffers:      要读取的缓冲区，如["main", "system", "crash"]
+        :type buffers:       list
+        :param binary:       是否通过exec:服务读取logcat -B的二进制输出，需要SDK>=21
+        :type binary:        bool
+        :param aggregator:   由LogcatAggregator的工作线程处理logcat输出，不再创建独立线程
+        :type aggregator:    LogcatAggregator
         """
         if not hasattr(self, "_start_count"):
             self._start_count = 0
@@ -458,23 +920,189 @@ class ADB(object):
         if self._start_count > 1:
             return
         logger.debug("[ADB] start logcat")
+        self._logcat_filter = self._build_logcat_filter(
+            process_list if filter_on_device else [], tag_specs, buffers
+        )
+        self._logcat_stats = {"received": 0, "kept": 0, "restarts": 0}
+        self._logcat_last_time = None
+        self._logcat_binary = binary and self.get_sdk_version() >= 21
         if clear:
-            self.run_shell_cmd("logcat -c " + params)  # 清除缓冲区
-        if not hasattr(self, "_log_list"):
-            self._log_list = []
+            self.run_shell_cmd(
+                " ".join(["logcat", "-c"] + self._logcat_filter["buffers"] + [params])
+            )  # 清除缓冲区
         self._logcat_running = True
-        self._log_pipe = self.run_shell_cmd(
-            "logcat -v threadtime " + params, sync=False
-        )
+        self._log_pipe = self._open_logcat_pipe(params)
 
         # self._logcat_thread_func(process_list)
 
-        self._logcat_thread = ThreadEx(
-            target=self._logcat_thread_func, args=[process_list, params]
-        )
-        self._logcat_thread.setDaemon(True)
-        self._logcat_thread.start()
-        self._log_filter_thread_list.append(self._logcat_thread.ident)
+        if aggregator and hasattr(self._log_pipe.stdout, "read_lines"):
+            self._logcat_aggregator = aggregator
+            state = self._create_logcat_state(process_list, params)
+            aggregator._register(self, state)
+        else:
+            self._logcat_aggregator = None
+            self._logcat_thread = ThreadEx(
+                target=self._logcat_thread_func, args=[process_list, params]
+            )
+            self._logcat_thread.setDaemon(True)
+            self._logcat_thread.start()
+            self._log_filter_thread_list.append(self._logcat_thread.ident)
+        if self._logcat_filter["pid_process"]:
+            t = ThreadEx(target=self._logcat_pid_monitor_func)
+            t.daemon = True
+            t.start()
+
+    def _get_package_uid(self, package_name):
+        """获取应用的uid，不存在时返回None
+        """
+        result = self.run_shell_cmd("pm list packages -U %s" % package_name)
+        for line in result.split("\n"):
+            ret = re.match(r"^package:(\S+)\s+uid:(\d+)", line.strip())
+            if ret and ret.group(1) == package_name:
+                return int(ret.group(2))
+        return None
+
+    def _build_logcat_filter(self, process_list, tag_specs=None, buffers=None):
+        """生成设备端的logcat过滤条件
+        """
+        logcat_filter = {
+            "buffers": [],
+            "tag_specs": list(tag_specs or []),
+            "uids": None,
+            "pid_process": None,
+            "pid": 0,
+        }
+        if not process_list and not buffers:
+            return logcat_filter
+        sdk_version = self.get_sdk_version()
+        for buffer in buffers or []:
+            if sdk_version < self.logcat_buffer_sdk.get(buffer, 0):
+                logger.warn(
+                    "[ADB] logcat buffer %s is not supported in sdk %d"
+                    % (buffer, sdk_version)
+                )
+                continue
+            logcat_filter["buffers"].extend(["-b", buffer])
+
+        if (
+            process_list
+            and sdk_version >= 28
+            and all(isinstance(it, six.string_types) for it in process_list)
+        ):
+            uids = set()
+            for process in process_list:
+                uid = self._get_package_uid(process.split(":")[0])
+                if uid is None:
+                    logger.warn("[ADB] get uid of %s failed" % process)
+                    uids = None
+                    break
+                uids.add(uid)
+            if uids:
+                logcat_filter["uids"] = ",".join(
+                    "%d" % it for it in sorted(uids)
+                )
+        if (
+            process_list
+            and not logcat_filter["uids"]
+            and sdk_version >= 24
+            and len(process_list) == 1
+        ):
+            process = process_list[0]
+            if isinstance(process, six.integer_types):
+                logcat_filter["pid"] = process
+            else:
+                logcat_filter["pid_process"] = process
+                logcat_filter["pid"] = self.get_pid(process)
+        return logcat_filter
+
+    def _get_logcat_cmdline(self, params="", restart=False):
+        """生成logcat命令行
+        """
+        if self._logcat_binary:
+            args = ["logcat", "-B"]
+        else:
+            args = ["logcat", "-v", "threadtime"]
+        logcat_filter = self._logcat_filter
+        if logcat_filter:
+            args.extend(logcat_filter["buffers"])
+            if logcat_filter["uids"]:
+                args.append("--uid=%s" % logcat_filter["uids"])
+            elif logcat_filter["pid"]:
+                args.append("--pid=%d" % logcat_filter["pid"])
+            if restart and self._logcat_last_time and (
+                logcat_filter["uids"]
+                or logcat_filter["pid_process"]
+                or self._logcat_binary
+            ):
+                # 从上次读到的位置继续，避免重复读取整个缓冲区
+                args.append("-T '%s'" % self._logcat_last_time)
+        if params:
+            args.append(params)
+        if logcat_filter:
+            args.extend(logcat_filter["tag_specs"])
+        return " ".join(args)
+
+    def _open_logcat_pipe(self, params="", restart=False):
+        """启动logcat进程，二进制模式下使用exec:服务以避免终端转换换行符
+        """
+        cmdline = self._get_logcat_cmdline(params, restart)
+        pipe = None
+        if self._logcat_binary:
+            pipe = self.run_adb_cmd("exec", cmdline, sync=False)
+            if not hasattr(pipe, "stdout"):
+                logger.warn(
+                    "[ADB] exec %s failed: %r, use text mode" % (cmdline, pipe)
+                )
+                self._logcat_binary = False
+                cmdline = self._get_logcat_cmdline(params, restart)
+                pipe = None
+        if pipe is None:
+            pipe = self.run_shell_cmd(cmdline, sync=False)
+        if restart and self._logcat_aggregator:
+            self._logcat_aggregator.watch_pipe(self, pipe)
+        return pipe
+
+    def _get_device_utc_offset(self):
+        """获取设备时区相对UTC的偏移（秒）
+        """
+        result = self.run_shell_cmd("date +%z").strip()
+        ret = re.match(r"^([+-])(\d\d)(\d\d)$", result)
+        if not ret:
+            logger.warn("[ADB] unexpected timezone: %r" % result)
+            return 0
+        offset = int(ret.group(2)) * 3600 + int(ret.group(3)) * 60
+        return -offset if ret.group(1) == "-" else offset
+
+    def _logcat_pid_monitor_func(self):
+        """设备端按进程ID过滤时，进程重启后更新过滤条件并重启logcat
+        """
+        process_name = self._logcat_filter["pid_process"]
+        while self._logcat_running:
+            time.sleep(self.logcat_pid_check_interval)
+            if not self._logcat_running:
+                break
+            try:
+                pid = self._process_table.get_pid(process_name)
+            except RuntimeError:
+                logger.exception("[ADB] get pid of %s failed" % process_name)
+                continue
+            if not pid or pid == self._logcat_filter["pid"]:
+                continue
+            logger.info(
+                "[ADB] process %s restarted: %d => %d"
+                % (process_name, self._logcat_filter["pid"], pid)
+            )
+            self._logcat_filter["pid"] = pid
+            if self._log_pipe.poll() is None:
+                self._log_pipe.terminate()
+
+    def get_logcat_stats(self):
+        """获取logcat统计信息
+
+        :return: {"received": 收到的行数, "kept": 保存的行数, "restarts": logcat重启次数}
+        :rtype:  dict
+        """
+        return dict(self._logcat_stats)
 
     def stop_logcat(self):
         """停止logcat
@@ -494,7 +1122,10 @@ class ADB(object):
                 except WindowsError as e:
                     logger.warn("terminate logcat process failed: %s" % e)
 
-        if hasattr(self, "_logcat_thread"):
+        if self._logcat_aggregator:
+            self._logcat_aggregator._unregister(self)
+            self._logcat_aggregator = None
+        elif hasattr(self, "_logcat_thread"):
             if self._logcat_thread.ident in self._log_filter_thread_list:
                 self._log_filter_thread_list.remove(self._logcat_thread.ident)
             else:
@@ -506,245 +1137,356 @@ class ADB(object):
     def get_log(self, clear=True):
         """获取已经保存的log
         """
-        if not hasattr(self, "_log_list"):
-            return []
-        result = self._log_list
+        result = self._log_store.get_lines()
         if clear:
-            self._log_list = []
+            self._log_store.clear()
         return result
 
-    def save_log(self, save_path):
-        """保存log
+    def save_log(self, save_path, clear=True, start_time=None, end_time=None):
+        """保存log，已落盘的压缩日志直接导出，保存路径以.gz或.zst（与logcat_compress一致）结尾时保存为压缩文件
+
+        :param save_path:  保存路径
+        :type save_path:   string
+        :param clear:      保存后是否清空日志
+        :type clear:       bool
+        :param start_time: 只保存包含该时间之后日志的段，格式为：2021-01-01 10:59:42.899
+        :type start_time:  string
+        :param end_time:   只保存包含该时间之前日志的段
+        :type end_time:    string
         """
-        if not hasattr(self, "_log_list"):
-            return
-        log_list = self.get_log()
-        for i, log in enumerate(log_list):
-            if isinstance(log, bytes):
-                # 先编码为unicode
-                for code in ["utf8", "gbk"]:
-                    try:
-                        log = log.decode(code)
-                        break
-                    except UnicodeDecodeError as e:
-                        # logger.warn('decode with %s error: %s' % (code, e))
-                        pass
-                else:
-                    log = repr(log)
-            log_list[i] = log.encode("utf8") if not isinstance(log, bytes) else log
-        f = open(save_path, "wb")
-        f.write(b"\n".join(log_list))
-        f.close()
+        self._log_store.save(save_path, start_time, end_time)
+        if clear:
+            self._log_store.clear()
+
+    def get_log_cursor(self):
+        """获取当前日志位置，用于query_log和wait_for_log的since参数
+
+        :rtype: int
+        """
+        return self._log_store.cursor
+
+    def query_log(self, **kwds):
+        """通过索引查询已经保存的log，参数含义见LogcatStore.query
+
+        :rtype: list
+        """
+        return self._log_store.query(**kwds)
+
+    def wait_for_log(self, timeout=10, **kwds):
+        """等待满足条件的log出现，参数含义见LogcatStore.wait_for_log
+
+        :rtype: LogRecord
+        """
+        return self._log_store.wait_for_log(timeout=timeout, **kwds)
+
+    def subscribe_logcat(self, callback=None, **kwds):
+        """订阅logcat日志，参数含义见LogcatSubscription
+
+        :rtype: LogcatSubscription
+        """
+        subscription = LogcatSubscription(callback, **kwds)
+        # 写时复制，logcat读取线程遍历时无需加锁
+        self._logcat_subscriptions = self._logcat_subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe_logcat(self, subscription):
+        """取消订阅
+        """
+        subscription.close()
+        self._logcat_subscriptions = [
+            it for it in self._logcat_subscriptions if it is not subscription
+        ]
 
     def add_logcat_callback(self, callback):
-        """添加logcat回调
+        """添加logcat回调，回调在独立的线程中执行，不会阻塞logcat读取
         """
-        if callback not in self._logcat_callbacks:
-            self._logcat_callbacks.append(callback)
+        if callback in self._logcat_callbacks:
+            return
+
+        def wrap_func(record):
+            callback(
+                record.pid,
+                record.process_name,
+                record.date,
+                record.timestamp,
+                record.level,
+                record.tag,
+                record.tid,
+                record.message,
+            )
+
+        self._logcat_callbacks[callback] = self.subscribe_logcat(wrap_func)
 
     def remove_logcat_callback(self, callback):
         """移除logcat回调
         """
-        if callback in self._logcat_callbacks:
-            self._logcat_callbacks.remove(callback)
+        subscription = self._logcat_callbacks.pop(callback, None)
+        if subscription:
+            self.unsubscribe_logcat(subscription)
 
     def insert_logcat(
         self, process_name, year, month_day, timestamp, level, tag, tid, content
     ):
-        self._log_list.append(
-            b"[%s] [%d-%s %s] %s/%s(%d): %s"
-            % (
-                utf8_encode(process_name),
-                int(year),
-                utf8_encode(month_day),
-                utf8_encode(timestamp),
-                utf8_encode(level),
-                utf8_encode(tag),
-                int(tid),
-                utf8_encode(content),
-            )
-        )
         pid = 0
-        pattern = re.compile(r"^(.+)\((\d+)\)$")
-        ret = pattern.match(process_name)
+        ret = self._process_name_pattern.match(process_name)
         if ret:
             process_name = ret.group(1)
             pid = int(ret.group(2))
-        for callback in self._logcat_callbacks:
-            callback(
-                pid,
-                process_name,
-                "%s-%s" % (year, month_day),
-                timestamp,
-                level,
-                tag,
-                int(tid),
-                content,
-            )
+        record = self._log_store.append(
+            pid,
+            process_name,
+            "%d-%s" % (int(year), month_day),
+            timestamp,
+            level,
+            tag,
+            int(tid),
+            content,
+        )
+        for subscription in self._logcat_subscriptions:
+            if subscription.match(record):
+                subscription.put(record)
 
     def _logcat_thread_func(self, process_list, params=""):
         """获取logcat线程
         """
-        import re
+        state = self._create_logcat_state(process_list, params)
+        try:
+            while self._pump_logcat(state):
+                pass
+        finally:
+            self._close_logcat_state(state)
+
+    def _create_logcat_state(self, process_list, params=""):
+        """创建logcat读取状态，独立线程与LogcatAggregator的工作线程共用
+        """
+        state = {
+            "process_list": process_list,
+            "params": params,
+            "filter_pid_list": set(),  # 没有找到匹配进程的列表
+            "zygote_pid": 0,  # zygote进程ID
+            "parser": None,
+        }
+        init_process_list = ["<pre-initialized>", "zygote"]
+
+        def on_process_renamed(pid, old_name, new_name):
+            # 修复之前记录的“<pre-initialized>”进程
+            for init_process in init_process_list:
+                if old_name.startswith(init_process) and not new_name.startswith(
+                    init_process
+                ):
+                    break
+            else:
+                return
+            process = self._log_store.get_process(pid)
+            if not process or not process.name.startswith(init_process):
+                return
+            if process_list:
+                for it in process_list:
+                    if pid == it or new_name.startswith(it):
+                        break
+                else:
+                    # 不在需要记录的进程列表中
+                    self._log_store.drop_process(process)
+                    return
+            # 替换为真实进程名
+            self._log_store.rename_process(process, new_name)
+
+        state["listener"] = on_process_renamed
+        self._process_table.add_listener(on_process_renamed)
+        if self._logcat_binary:
+            state["parser"] = LogcatBinaryParser(self._get_device_utc_offset())
+        return state
+
+    def _close_logcat_state(self, state):
+        self._process_table.remove_listener(state["listener"])
+
+    def _restart_logcat(self, params):
+        """logcat进程退出后重新启动，logcat已停止时返回False
+        """
+        logger.debug("logcat进程：%s 已退出" % self._log_pipe.pid)
+        if not self._logcat_running:
+            logger.info("logcat线程停止运行")
+            return False
+        self._logcat_stats["restarts"] += 1
+        self._log_pipe = self._open_logcat_pipe(params, True)
+        return True
 
-        # pattern = re.compile(r'([A-Z])/([\w|.]+)\s*\(\s*(\d+)\):.+') #标准格式
-        # pattern = re.compile(r'([\d|-]+)\s+([\d|:|\.]+)\s+(\d+)\s+(\d+)\s+(\w)\s+(\S+)\s*:\s+(.+)')  # [^:]
-        # 会过滤掉只有内容和内容为空的情况：--------- beginning of /dev/log/main not match pattern；04-16 10:09:25.170  2183  2183 D AndroidRuntime:
-        pattern = re.compile(
-            r"([\d|-]+)\s+([\d|:|\.]+)\s+(\d+)\s+(\d+)\s+(\w)\s+(.*?)\s*:\s*(.*)"
-        )
-        # Date Time PID TID Level Tag Content
-        pid_dict = {}
-        filter_pid_list = []  # 没有找到匹配进程的列表
-        zygote_pid = 0  # zygote进程ID
+    def _pump_logcat(self, state, block=True):
+        """读取并处理一批logcat输出
 
+        :param state: _create_logcat_state返回的读取状态
+        :type state:  dict
+        :param block: 为False时只处理管道中已有的数据，不等待
+        :type block:  bool
+        :return: logcat停止后返回False
+        :rtype:  bool
+        """
+        if not self._logcat_running:
+            return False
+        stdout = self._log_pipe.stdout
+        parser = state["parser"]
         while self._logcat_running:
-            log = self._log_pipe.stdout.readline()
-            log = enforce_utf8_decode(log).strip()
+            if parser:
+                data = stdout.read(65536 if block else -1)
+            elif block:
+                data = stdout.readline()
+            else:
+                data = stdout.read_lines()
+            if not data:
+                break
+            if parser:
+                self._read_binary_logcat(data, state)
+            else:
+                self._read_text_logcat([data] if block else data, state)
+            if block:
+                return self._logcat_running
+        else:
+            return False
+        if self._log_pipe.poll() != None:
+            # 进程已退出
+            if parser:
+                parser.reset()
+            return self._restart_logcat(state["params"])
+        return self._logcat_running
 
+    def _read_text_logcat(self, line_list, state):
+        """处理logcat -v threadtime的输出
+        """
+        for log in line_list:
+            log = enforce_utf8_decode(log).strip()
             if not log:
-                if self._log_pipe.poll() != None:
-                    logger.debug("logcat进程：%s 已退出" % self._log_pipe.pid)
-                    # 进程已退出
-                    # TODO: 解决logcat重复问题
-                    if not self._logcat_running:
-                        logger.info("logcat线程停止运行")
-                        return
-                    self._log_pipe = self.run_shell_cmd(
-                        "logcat -v threadtime " + params, sync=False
-                    )
-                else:
-                    continue
+                continue
+            self._logcat_stats["received"] += 1
 
             if "beginning of main" in log or "beginning of system" in log:
                 continue
 
-            ret = pattern.match(log)
+            ret = threadtime_pattern.match(log)
             if not ret:
                 logger.info("log: %s not match pattern" % log)
                 continue
-            tag = ret.group(6).strip()
-            if tag in [
-                "inject",
-                "dexloader",
-                "ActivityInspect",
-                "MethodHook",
-                "androidhook",
-            ]:
-                logger.info(log)  # 测试桩日志加入到qt4a日志中
-                continue
-
-            if tag in ["Web Console"]:
-                if ret.group(7).startswith("[ClickListener]"):
-                    logger.info(log)  # WebView的控件点击信息
-                    continue
+            self._logcat_last_time = "%s %s" % (ret.group(1), ret.group(2))
+            if not hasattr(self, "_year"):
+                self._year = datetime.date.today().year
+            self._ingest_logcat(
+                state["process_list"],
+                state,
+                self._year,
+                ret.group(1),
+                ret.group(2),
+                int(ret.group(3)),
+                int(ret.group(4)),
+                ret.group(5),
+                ret.group(6).strip(),
+                ret.group(7),
+                log,
+            )
 
-            pid = int(ret.group(3))
-            if pid in filter_pid_list:
-                continue
+    def _read_binary_logcat(self, data, state):
+        """处理logcat -B的输出
+        """
+        try:
+            entry_list = state["parser"].feed(data)
+        except ValueError:
+            logger.exception("[ADB] parse binary logcat failed")
+            return
+        self._logcat_stats["received"] += len(entry_list)
+        for year, month_day, timestamp, pid, tid, level, tag, content in entry_list:
+            self._logcat_last_time = "%s %s" % (month_day, timestamp)
+            self._ingest_logcat(
+                state["process_list"],
+                state,
+                year,
+                month_day,
+                timestamp,
+                pid,
+                tid,
+                level,
+                tag,
+                content,
+            )
 
-            init_process_list = ["<pre-initialized>", "zygote"]
-
-            if pid not in pid_dict.keys():
-                for item in self.list_process():
-                    if (
-                        zygote_pid == 0
-                        and item["proc_name"] == "zygote"
-                        and item["ppid"] == 1
-                    ):
-                        # zygote父进程ID为1
-                        zygote_pid = item["pid"]
-
-                    for init_process in init_process_list:
-                        if (
-                            item["pid"] in pid_dict
-                            and pid_dict[item["pid"]].startswith(init_process)
-                            and not item["proc_name"].startswith(init_process)
-                        ):
+    def _ingest_logcat(
+        self,
+        process_list,
+        state,
+        year,
+        month_day,
+        timestamp,
+        pid,
+        tid,
+        level,
+        tag,
+        content,
+        log=None,
+    ):
+        """处理一条解析后的日志，文本与二进制格式共用
+        """
+        if tag in [
+            "inject",
+            "dexloader",
+            "ActivityInspect",
+            "MethodHook",
+            "androidhook",
+        ] or (tag == "Web Console" and content.startswith("[ClickListener]")):
+            # 测试桩日志及WebView的控件点击信息加入到qt4a日志中
+            if log is None:
+                log = "%s %s %5d %5d %s %s: %s" % (
+                    month_day,
+                    timestamp,
+                    pid,
+                    tid,
+                    level,
+                    tag,
+                    content,
+                )
+            logger.info(log)
+            return
 
-                            for i in range(len(self._log_list) - 1, -1, -1):
-                                # 修复之前记录的“<pre-initialized>”进程
-                                pre_process_name = "[%s(%d)]" % (
-                                    init_process,
-                                    item["pid"],
-                                )
-                                pre_process_name = pre_process_name.encode("utf8")
-                                if pre_process_name not in self._log_list[i]:
-                                    continue
-                                if process_list:
-                                    del_flag = True
-                                    for process in process_list:
-                                        if pid == process or item[
-                                            "proc_name"
-                                        ].startswith(process):
-                                            # 替换为真实进程名
-                                            self._log_list[i] = self._log_list[
-                                                i
-                                            ].replace(
-                                                pre_process_name,
-                                                (
-                                                    "[%s(%d)]"
-                                                    % (item["proc_name"], item["pid"])
-                                                ),
-                                            )
-                                            del_flag = False
-                                            break
-                                    if del_flag:
-                                        # 不在需要记录的进程列表中
-                                        del self._log_list[i]
-                                else:
-                                    # 直接替换
-                                    new_process_name = "[%s(%d)]" % (
-                                        item["proc_name"],
-                                        item["pid"],
-                                    )
-                                    new_process_name = new_process_name.encode("utf8")
-                                    self._log_list[i] = self._log_list[i].replace(
-                                        pre_process_name, new_process_name
-                                    )
-                    pid_dict[item["pid"]] = item["proc_name"]
-                #                     if item['proc_name'] in init_process_list and item['pid'] != zygote_pid:
-                #                         pid_dict[item['pid']] += '(%d)' % item['pid']
-                if pid not in pid_dict.keys():
-                    filter_pid_list.append(pid)
-                    continue
+        if pid in state["filter_pid_list"]:
+            return
 
-            found = False
-            if not process_list:
-                found = True  # 不指定进程列表则捕获所有进程
-            else:
-                for process in process_list:
-                    if pid == process or (
-                        pid in pid_dict
-                        and (
-                            pid_dict[pid].startswith(process)
-                            or pid_dict[pid].startswith("<pre-initialized>")
-                            or (
-                                pid_dict[pid].startswith("zygote") and pid != zygote_pid
-                            )
-                        )
-                    ):  # 进程初始化中
-                        found = True
-                        break
+        item = self._process_table.get(pid)
+        if item is None:
+            state["filter_pid_list"].add(pid)
+            return
+        proc_name = item["proc_name"]
+        if state["zygote_pid"] == 0:
+            zygote = self._process_table.get(
+                self._process_table.get_pid("zygote", False), False
+            )
+            if zygote and zygote["ppid"] == 1:
+                # zygote父进程ID为1
+                state["zygote_pid"] = zygote["pid"]
 
-            if found:
-                import datetime
+        found = False
+        if not process_list:
+            found = True  # 不指定进程列表则捕获所有进程
+        else:
+            for process in process_list:
+                if pid == process or (
+                    proc_name.startswith(process)
+                    or proc_name.startswith("<pre-initialized>")
+                    or (proc_name.startswith("zygote") and pid != state["zygote_pid"])
+                ):  # 进程初始化中
+                    found = True
+                    break
 
-                if not hasattr(self, "_year"):
-                    self._year = datetime.date.today().year
-                try:
-                    self.insert_logcat(
-                        "%s(%d)" % (pid_dict.get(pid), pid),
-                        self._year,
-                        ret.group(1),
-                        ret.group(2),
-                        ret.group(5),
-                        ret.group(6),
-                        ret.group(4),
-                        ret.group(7),
-                    )
-                except:
-                    logger.exception("Insert logcat failed: %r" % log)
+        if found:
+            try:
+                self.insert_logcat(
+                    "%s(%d)" % (proc_name, pid),
+                    year,
+                    month_day,
+                    timestamp,
+                    level,
+                    tag,
+                    tid,
+                    content,
+                )
+                self._logcat_stats["kept"] += 1
+            except:
+                logger.exception("Insert logcat failed: %r" % (log or content))
 
     @static_result
     def get_root_state(self):
@@ -833,6 +1575,7 @@ class ADB(object):
         """以指定身份拷贝文件到手机中
         """
         result = self.run_adb_cmd("push", src_path, dst_path, timeout=None)
+        self.invalidate_file_cache(dst_path)
         if "No space left on device" in result or "No such file or directory" in result:
             # 如果源文件不存在不会执行到这里
             raise RuntimeError("设备存储空间不足")
@@ -889,30 +1632,433 @@ class ADB(object):
             logger.debug(self.run_shell_cmd("ls -l %s" % src_path, True))
         return result
 
+    def push_files(self, file_list):
+        """在同一个sync会话中批量上传文件
+
+        :param file_list: [(PC上的源路径, 手机上的目标路径), ...]
+        :type  file_list: list
+        :return: 上传失败的文件列表[(源路径, 目标路径, 错误信息), ...]
+        """
+        if not file_list:
+            return []
+        for _, dst_path in file_list:
+            self.invalidate_file_cache(dst_path)
+        error_list = self.run_adb_cmd("push_files", list(file_list), timeout=None)
+        if not isinstance(error_list, list):
+            # 不支持批量操作的后端逐个上传
+            error_list = []
+            for src_path, dst_path in file_list:
+                result = self.run_adb_cmd("push", src_path, dst_path, timeout=None)
+                error_list.append("" if "bytes in" in result else result)
+        return [
+            (src_path, dst_path, error)
+            for (src_path, dst_path), error in zip(file_list, error_list)
+            if error
+        ]
+
+    def pull_files(self, file_list):
+        """在同一个sync会话中批量下载文件
+
+        :param file_list: [(手机上的源路径, PC上的目标路径), ...]
+        :type  file_list: list
+        :return: 下载失败的文件列表[(源路径, 目标路径, 错误信息), ...]
+        """
+        if not file_list:
+            return []
+        error_list = self.run_adb_cmd("pull_files", list(file_list), timeout=None)
+        if not isinstance(error_list, list):
+            error_list = []
+            for src_path, dst_path in file_list:
+                result = self.run_adb_cmd("pull", src_path, dst_path, timeout=600)
+                error_list.append("" if "bytes in" in result else result)
+        return [
+            (src_path, dst_path, error)
+            for (src_path, dst_path), error in zip(file_list, error_list)
+            if error
+        ]
+
+    def stat_files(self, path_list):
+        """批量获取手机中文件的(mode, size, mtime)，文件不存在时mode为0
+
+        :param path_list: 手机上的文件路径列表
+        :type  path_list: list
+        :return: 与path_list一一对应的列表，后端不支持时返回None
+        """
+        if not path_list:
+            return []
+        result = self.run_adb_cmd("stat_files", list(path_list))
+        if isinstance(result, list):
+            return result
+        return None
+
+    def list_tree(self, dir_path):
+        """递归枚举手机中目录下的所有文件
+
+        :param dir_path: 手机上的目录路径
+        :type  dir_path: string
+        :return: [(相对路径, mode, size, mtime), ...]，后端不支持时返回None
+        """
+        result = self.run_adb_cmd("list_tree", dir_path)
+        if isinstance(result, list):
+            return result
+        return None
+
+    def get_boot_id(self):
+        """获取设备本次启动的唯一标识，设备重启后会变化
+        """
+        if not self._boot_id:
+            self._boot_id = self.run_shell_cmd(
+                "cat /proc/sys/kernel/random/boot_id"
+            ).strip()
+        return self._boot_id
+
+    def get_device_features(self):
+        """获取adbd支持的特性列表，后端不支持时返回空列表
+        """
+        if self._features is None:
+            result = self.run_adb_cmd("features", retry_count=1)
+            if isinstance(result, bytes):
+                result = result.decode("utf8", "replace")
+            if not isinstance(result, six.string_types) or "error" in result:
+                return []
+            self._features = [it.strip() for it in result.split(",") if it.strip()]
+        return self._features
+
+    def get_page_size(self):
+        """获取内存页大小，获取失败时返回4096
+        """
+        if self._page_size is None:
+            result = self.run_shell_cmd("getconf PAGESIZE")
+            try:
+                self._page_size = int(result.strip())
+            except (AttributeError, ValueError):
+                logger.warn("[ADB] get page size failed: %r" % (result,))
+                self._page_size = 4096
+        return self._page_size
+
+    def _get_decompress_cmd(self):
+        """获取设备端从stdin读取gzip数据的解压命令，不支持时返回空字符串
+        """
+        if self._decompress_cmd is None:
+            self._decompress_cmd = ""
+            if "shell_v2" in self.get_device_features():
+                result = self.run_shell_cmd("which gzip gunzip zcat busybox")
+                for line in result.split("\n"):
+                    line = line.strip()
+                    if not line.startswith("/"):
+                        continue
+                    name = line.split("/")[-1]
+                    if name == "gzip":
+                        self._decompress_cmd = "gzip -d -c"
+                    elif name in ("gunzip", "zcat"):
+                        self._decompress_cmd = "%s -c" % name
+                    elif name == "busybox":
+                        self._decompress_cmd = "busybox gzip -d -c"
+                    break
+        return self._decompress_cmd
+
+    def push_file_compressed(self, src_path, dst_path):
+        """边压缩边上传文件，适用于较大的可压缩文件
+
+        :return: 上传结果，设备不支持时返回None
+        """
+        decompress_cmd = self._get_decompress_cmd()
+        if not decompress_cmd:
+            return None
+        result = self.run_adb_cmd(
+            "push_compressed",
+            src_path,
+            dst_path,
+            decompress_cmd,
+            retry_count=1,
+            timeout=None,
+        )
+        self.invalidate_file_cache(dst_path)
+        if not result or "bytes in" not in result:
+            logger.warn("push %s compressed failed: %s" % (src_path, result))
+            return None
+        file_size = os.path.getsize(src_path)
+        stat_list = self.stat_files([dst_path])
+        if stat_list and stat_list[0][1] != file_size & 0xFFFFFFFF:
+            logger.warn(
+                "push %s compressed failed: file size error, expect %d, actual is %d"
+                % (src_path, file_size, stat_list[0][1])
+            )
+            return None
+        return result
+
+    def invalidate_file_cache(self, path):
+        """设备中的文件或目录被修改/删除后，使本地缓存的相关记录失效
+        """
+        if "*" in path:
+            # 通配符路径使其所在目录的缓存失效
+            path = posixpath.dirname(path[: path.index("*")])
+        path = path.rstrip("/")
+        for key in list(self._list_dir_cache.keys()):
+            dir_path = key[0].rstrip("/")
+            if (
+                dir_path == path
+                or dir_path.startswith(path + "/")
+                or path.startswith(dir_path + "/")
+            ):
+                self._list_dir_cache.pop(key, None)
+        manifest = DeviceCache.get_cache(self._device_name, "manifest")
+        if not manifest.exists:
+            return
+        file_dict = manifest.get("files", {})
+        key_list = [
+            key for key in file_dict if key == path or key.startswith(path + "/")
+        ]
+        if key_list:
+            for key in key_list:
+                file_dict.pop(key)
+            manifest.save()
+
+    def _get_files_md5(self, path_list):
+        """通过md5sum批量获取设备中文件的md5，设备不支持md5sum时返回None
+        """
+        md5_dict = {}
+        batch = []
+        for i, path in enumerate(path_list):
+            batch.append('"%s"' % path)
+            if i == len(path_list) - 1 or sum(len(it) + 1 for it in batch) > 3000:
+                result = self.run_shell_cmd("md5sum %s" % " ".join(batch))
+                batch = []
+                if "not found" in result:
+                    return None
+                for line in result.split("\n"):
+                    items = line.strip().split(None, 1)
+                    if len(items) == 2 and len(items[0]) == 32:
+                        md5_dict[items[1]] = items[0]
+        return md5_dict
+
+    def get_changed_files(self, file_list, checksum=False):
+        """获取需要上传的文件列表
+
+        优先使用本地清单缓存：设备本次启动期间上传过且本地文件未变化的文件直接跳过；
+        其余文件通过一次批量STAT比较大小和修改时间，checksum为True时再使用md5sum比较内容
+
+        :param file_list: [(PC上的源路径, 手机上的目标路径), ...]
+        :type  file_list: list
+        :param checksum:  是否比较文件md5
+        :type  checksum:  bool
+        :return: 内容不一致需要上传的文件列表[(源路径, 目标路径), ...]
+        """
+        manifest = DeviceCache.get_cache(self._device_name, "manifest")
+        boot_id = self.get_boot_id()
+        if manifest.get("boot_id") != boot_id:
+            manifest.set("boot_id", boot_id)
+            manifest.set("files", {})  # 设备重启后无法确认设备中的文件未被修改
+        file_dict = manifest.get("files")
+
+        check_list = []
+        for src_path, dst_path in file_list:
+            st = os.stat(src_path)
+            local_stat = [st.st_size, int(st.st_mtime)]
+            entry = file_dict.get(dst_path)
+            if entry and entry["local"] == local_stat:
+                continue
+            check_list.append((src_path, dst_path, local_stat))
+        if not check_list:
+            return []
+
+        stat_list = self.stat_files([it[1] for it in check_list])
+        if stat_list is None:
+            return [it[:2] for it in check_list]
+        changed_list = []
+        same_list = []
+        for item, (mode, size, mtime) in zip(check_list, stat_list):
+            if mode and size == item[2][0] & 0xFFFFFFFF and mtime == item[2][1]:
+                same_list.append(item)
+            else:
+                changed_list.append(item[:2])
+
+        if checksum and same_list:
+            md5_dict = self._get_files_md5([it[1] for it in same_list])
+            if md5_dict is not None:
+                for item in list(same_list):
+                    if md5_dict.get(item[1]) != get_file_md5(item[0]):
+                        same_list.remove(item)
+                        changed_list.append(item[:2])
+        for src_path, dst_path, local_stat in same_list:
+            file_dict[dst_path] = {"local": local_stat}
+        manifest.save()
+        return changed_list
+
+    def record_pushed_files(self, file_list):
+        """记录已上传的文件到本地清单缓存
+
+        :param file_list: [(PC上的源路径, 手机上的目标路径), ...]
+        :type  file_list: list
+        """
+        manifest = DeviceCache.get_cache(self._device_name, "manifest")
+        if manifest.get("boot_id") != self.get_boot_id():
+            return
+        file_dict = manifest.get("files")
+        for src_path, dst_path in file_list:
+            st = os.stat(src_path)
+            file_dict[dst_path] = {"local": [st.st_size, int(st.st_mtime)]}
+        manifest.save()
+
+    def sync_files(self, file_list, checksum=False):
+        """增量上传文件，只传输与设备中不一致的文件
+
+        :param file_list: [(PC上的源路径, 手机上的目标路径), ...]
+        :type  file_list: list
+        :param checksum:  是否比较文件md5
+        :type  checksum:  bool
+        :return: 实际上传的文件列表[(源路径, 目标路径), ...]
+        """
+        changed_list = self.get_changed_files(file_list, checksum)
+        error_list = self.push_files(changed_list)
+        if error_list:
+            failed_set = set([it[1] for it in error_list])
+            self.record_pushed_files(
+                [it for it in changed_list if it[1] not in failed_set]
+            )
+            raise RuntimeError(
+                "Push files to device [%r] failed: %s"
+                % (self._device_name, ", ".join(["%s(%s)" % it[1:] for it in error_list]))
+            )
+        self.record_pushed_files(changed_list)
+        return changed_list
+
     @staticmethod
-    def _get_package_name(apk_path):
-        """获取安装包名
+    def get_apk_info(apk_path):
+        """获取APK的包名、versionCode、大小与内容指纹，结果按路径、修改时间与大小缓存
+
+        :rtype: dict
         """
         import zipfile
         from ._axmlparser import AXMLPrinter
 
+        apk_path = os.path.abspath(apk_path)
+        st = os.stat(apk_path)
+        item = ADB._apk_info_cache.get(apk_path)
+        if item and item[:2] == (st.st_mtime, st.st_size):
+            return item[2]
         package_name = ""
+        version_code = 0
         zf = zipfile.ZipFile(apk_path, mode="r")
         for i in zf.namelist():
             if i == "AndroidManifest.xml":
                 printer = AXMLPrinter(zf.read(i))
-                package_name = (
-                    printer.get_xml_obj()
-                    .getElementsByTagName("manifest")[0]
-                    .getAttribute("package")
-                )
+                manifest = printer.get_xml_obj().getElementsByTagName("manifest")[0]
+                package_name = manifest.getAttribute("package")
+                version_code = manifest.getAttribute("android:versionCode")
                 break
+        zf.close()
         if not package_name:
             raise RuntimeError("获取安装包中的包名信息失败")
-        return package_name
+        info = {
+            "package_name": package_name,
+            "version_code": int(version_code) if version_code.isdigit() else 0,
+            "size": st.st_size,
+            "fingerprint": get_zip_fingerprint(apk_path),
+        }
+        ADB._apk_info_cache[apk_path] = (st.st_mtime, st.st_size, info)
+        return info
 
-    def _install_apk(self, apk_path, package_name, reinstall=False):
+    @staticmethod
+    def _get_package_name(apk_path):
+        """获取安装包名
         """
+        return ADB.get_apk_info(apk_path)["package_name"]
+
+    def _get_installed_package_state(self, package_name):
+        """从dumpsys package中读取已安装应用的versionCode、更新时间与安装包大小
+
+        :return: 应用未安装时返回None
+        :rtype:  dict
+        """
+        result = self.run_shell_cmd("dumpsys package %s" % package_name)
+        pos = result.find("Package [%s]" % package_name)
+        if pos < 0:
+            return None
+        result = result[pos:]
+        state = {}
+        for key, pattern in (
+            ("version_code", r"versionCode=(\d+)"),
+            ("update_time", r"lastUpdateTime=(.+)"),
+            ("code_path", r"codePath=(\S+)"),
+        ):
+            ret = re.search(pattern, result)
+            state[key] = ret.group(1).strip() if ret else None
+        if not state["code_path"]:
+            return None
+        apk_path = state["code_path"]
+        if not apk_path.endswith(".apk"):
+            apk_path += "/base.apk"
+        stat_list = self.stat_files([apk_path])
+        state["size"] = stat_list[0][1] if stat_list else None
+        return state
+
+    def is_apk_installed(self, apk_path):
+        """设备中是否已安装了该APK，依据为本机记录的安装信息与设备中应用的当前状态
+
+        :param apk_path: APK路径
+        :type  apk_path: string
+        :rtype: bool
+        """
+        info = self.get_apk_info(apk_path)
+        package_name = info["package_name"]
+        record = DeviceCache.get_cache(self._device_name, "packages").get(package_name)
+        if not record or record["fingerprint"] != info["fingerprint"]:
+            return False
+        state = self._get_installed_package_state(package_name)
+        if not state or state["version_code"] != str(info["version_code"]):
+            return False
+        # 应用被其它途径重新安装或更新时，更新时间与安装包会发生变化
+        return state == record["state"]
+
+    def record_installed_apk(self, apk_path):
+        """记录设备中安装的APK，用于之后判断是否需要重新安装
+        """
+        info = self.get_apk_info(apk_path)
+        state = self._get_installed_package_state(info["package_name"])
+        if not state:
+            return False
+        cache = DeviceCache.get_cache(self._device_name, "packages")
+        cache.set(
+            info["package_name"], {"fingerprint": info["fingerprint"], "state": state}
+        )
+        cache.save()
+        return True
+
+    def _can_install_streamed(self):
+        """是否支持流式安装，root设备需要处理安装弹窗，仍使用上传后安装的方式
+        """
+        return (
+            self.stream_install
+            and self.get_sdk_version() >= 21
+            and not self.is_rooted()
+        )
+
+    def _install_apk_streamed(self, apk_list, reinstall, timeout, progress_callback):
+        """将本地APK数据直接写入设备端的pm进行安装
+        """
+        ret = self.run_adb_cmd(
+            "install_streamed",
+            apk_list,
+            "-r" if reinstall else "",
+            "cmd" in self.get_device_features(),
+            progress_callback,
+            retry_count=1,
+            timeout=timeout,
+        )
+        return ret or ""
+
+    def _install_apk(
+        self,
+        apk_path,
+        package_name,
+        reinstall=False,
+        streamed=False,
+        progress_callback=None,
+    ):
+        """
+        :param apk_path: 设备中的APK路径，流式安装时为本地APK路径列表
+        :param streamed: 是否使用流式安装
         """
         if self.get_sdk_version() <= 19:
             timeout = 3 * 60
@@ -923,7 +2069,12 @@ class ADB(object):
         for i in range(3):
             # 处理一些必然会失败的情况，如方法数超标之类的问题
             try:
-                if not self.is_rooted():
+                if streamed:
+                    self.run_shell_cmd("am broadcast -a startInstallMonitor")
+                    ret = self._install_apk_streamed(
+                        apk_path, reinstall, timeout, progress_callback
+                    )
+                elif not self.is_rooted():
                     # 通知QT4A助手开始监控应用安装
                     self.run_shell_cmd("am broadcast -a startInstallMonitor")
                     ret = self.run_shell_cmd(cmdline, retry_count=1, timeout=timeout)
@@ -962,7 +2113,9 @@ class ADB(object):
                     return True, "Success"
                 elif "INSTALL_FAILED_ALREADY_EXISTS" in ret:
                     # 尝试覆盖安装
-                    return self._install_apk(apk_path, package_name, True)
+                    return self._install_apk(
+                        apk_path, package_name, True, streamed, progress_callback
+                    )
                 elif (
                     "INSTALL_PARSE_FAILED_NO_CERTIFICATES" in ret
                     or "INSTALL_PARSE_FAILED_UNEXPECTED_EXCEPTION" in ret
@@ -974,7 +2127,9 @@ class ADB(object):
                 elif "INSTALL_FAILED_UPDATE_INCOMPATIBLE" in ret:
                     # 强制卸载应用
                     self.uninstall_app(package_name)
-                    return self._install_apk(apk_path, package_name, False)
+                    return self._install_apk(
+                        apk_path, package_name, False, streamed, progress_callback
+                    )
                 elif (
                     "INSTALL_PARSE_FAILED_INCONSISTENT_CERTIFICATES" in ret
                     or "INSTALL_FAILED_DEXOPT" in ret
@@ -983,7 +2138,9 @@ class ADB(object):
                     if not reinstall:
                         return False, ret
                     self.uninstall_app(package_name)
-                    return self._install_apk(apk_path, package_name, False)
+                    return self._install_apk(
+                        apk_path, package_name, False, streamed, progress_callback
+                    )
                 elif "INSTALL_FAILED_INSUFFICIENT_STORAGE" in ret:
                     # 有可能是存在/data/app-lib/packagename-1目录导致的
                     for i in (1, 2):
@@ -1012,6 +2169,8 @@ class ADB(object):
                             break
                     continue
                 elif "INSTALL_FAILED_CANCELLED_BY_USER" in ret:
+                    if streamed:
+                        return False, ret  # 需要先上传到设备中再安装
                     # 一般是ROM需要手动确认安装，改用system权限安装
                     ret = self.run_shell_cmd("su system %s" % cmdline, timeout=timeout)
                     if "Success" in ret:
@@ -1022,6 +2181,8 @@ class ADB(object):
                 logger.warn("install app timeout: %r" % e)
         else:
             logger.warn("install app failed")
+            if streamed:
+                return False, ret
             ret = self.run_shell_cmd(cmdline, timeout=timeout)  # 改用非root权限安装
             logger.debug(ret)
             if b"Success" in ret or b"INSTALL_FAILED_ALREADY_EXISTS" in ret:
@@ -1029,20 +2190,50 @@ class ADB(object):
 
         return False, ret
 
-    def install_apk(self, apk_path, reinstall=False):
+    def install_apk(self, apk_path, reinstall=False, progress_callback=None):
         """安装应用
-        """
-        if not os.path.exists(apk_path):
-            raise RuntimeError("APK: %s 不存在" % apk_path)
-        package_name = self._get_package_name(apk_path)
 
-        tmp_path = "/data/local/tmp/%s.apk" % package_name
-        self.push_file(apk_path, tmp_path)
+        Android 5.0以上将APK数据直接写入pm进行安装，失败时再上传到设备中安装
+
+        :param apk_path:          APK路径，split APK时为APK路径列表，第一个为base APK
+        :type  apk_path:          string/list
+        :param reinstall:         是否覆盖安装
+        :type  reinstall:         bool
+        :param progress_callback: 流式安装的进度回调，参数为(已发送字节数, 总字节数)
+        :type  progress_callback: function
+        """
+        apk_list = apk_path if isinstance(apk_path, list) else [apk_path]
+        for it in apk_list:
+            if not os.path.exists(it):
+                raise RuntimeError("APK: %s 不存在" % it)
+        package_name = self._get_package_name(apk_list[0])
+        streamed = self._can_install_streamed()
+        if len(apk_list) > 1 and not streamed:
+            raise RuntimeError("设备不支持安装split APK")
 
         if not reinstall:
             self.uninstall_app(package_name)  # 先卸载，再安装
-            result = self._install_apk(tmp_path, package_name, reinstall)
-        else:
+
+        install_path = tmp_path = None
+        if streamed:
+            install_path = apk_list
+            result = self._install_apk(
+                install_path, package_name, reinstall, True, progress_callback
+            )
+            if (
+                not result[0]
+                and len(apk_list) == 1
+                and (
+                    "Failure [INSTALL_" not in result[1]
+                    or "INSTALL_FAILED_CANCELLED_BY_USER" in result[1]
+                )
+            ):
+                logger.warn("install %s streamed failed: %s" % (apk_path, result[1]))
+                streamed = False
+        if not streamed:
+            tmp_path = "/data/local/tmp/%s.apk" % package_name
+            self.push_file(apk_list[0], tmp_path)
+            install_path = tmp_path
             result = self._install_apk(tmp_path, package_name, reinstall)
         # logger.debug(result)
         if result[0] == False:
@@ -1057,7 +2248,9 @@ class ADB(object):
                         break
                     time.sleep(1)
                 else:
-                    result = self._install_apk(tmp_path, package_name, reinstall)
+                    result = self._install_apk(
+                        install_path, package_name, reinstall, streamed
+                    )
             else:
                 err_msg = result[1]
                 if six.PY2:
@@ -1066,10 +2259,16 @@ class ADB(object):
                     if isinstance(package_name, unicode):
                         package_name = package_name.encode("utf8")
                 raise InstallPackageFailedError("安装应用%s失败：%s" % (package_name, err_msg))
-        try:
-            self.delete_file("/data/local/tmp/*.apk")
-        except TimeoutError:
-            pass
+        if tmp_path:
+            try:
+                self.delete_file("/data/local/tmp/*.apk")
+            except TimeoutError:
+                pass
+        if len(apk_list) == 1:
+            try:
+                self.record_installed_apk(apk_list[0])
+            except Exception:
+                logger.exception("record installed apk %s failed" % apk_list[0])
 
     def uninstall_app(self, pkg_name):
         """卸载应用
@@ -1295,46 +2494,93 @@ class ADB(object):
         if not "Broadcast completed: result=0" in result:
             raise RuntimeError("Send broadcast failed: %s" % result)
 
+    def _load_properties(self):
+        """执行一次getprop获取所有属性
+        """
+        result = self.run_shell_cmd("getprop")
+        return dict(self._property_pattern.findall(result))
+
+    def get_properties(self, refresh=False):
+        """获取系统属性快照，快照在设备重启或调用set_property后失效；
+        从本地磁盘缓存读取时只包含ro.开头的只读属性
+
+        :param refresh: 是否重新获取
+        :type  refresh: bool
+        :rtype: dict
+        """
+        if self._properties is not None and not refresh:
+            return self._properties
+        properties = cache = None
+        if self.persist_properties and self._device_name:
+            # 只读属性在设备本次启动期间不会变化，重连已知设备时无需重新获取
+            cache = DeviceCache.get_cache(self._device_name, "properties")
+            boot_id = self.get_boot_id()
+            if not refresh and cache.get("boot_id") == boot_id:
+                properties = cache.get("properties")
+        if properties is None:
+            properties = self._load_properties()
+            if cache:
+                cache.set("boot_id", boot_id)
+                cache.set(
+                    "properties",
+                    dict(
+                        (key, value)
+                        for key, value in properties.items()
+                        if key.startswith("ro.")
+                    ),
+                )
+                cache.save()
+        self._properties = properties
+        return properties
+
+    def invalidate_properties(self):
+        """使系统属性快照失效
+        """
+        self._properties = None
+
     def get_property(self, prop):
         """读取属性
+
+        ro.开头的只读属性从快照中读取，其它属性会在运行时变化，每次都从设备读取
         """
+        if prop.startswith("ro."):
+            properties = self.get_properties()
+            if properties:
+                return properties.get(prop, "")  # 未设置的属性读取结果为空
         return self.run_shell_cmd("getprop %s" % prop)
 
     def set_property(self, prop, value):
         """设置属性
         """
         self.run_shell_cmd("setprop %s %s" % (prop, value), self.is_rooted())
+        self.invalidate_properties()
 
-    @static_result
     def get_cpu_abi(self):
         """获取系统的CPU架构信息
         """
-        ret = self.run_shell_cmd("getprop ro.product.cpu.abi")
+        ret = self.get_property("ro.product.cpu.abi")
         if not ret:
             ret = "armeabi"  # 有些手机可能没有这个系统属性
         return ret
 
-    @static_result
     def get_device_model(self):
         """获取设备型号
         """
-        model = self.run_shell_cmd("getprop ro.product.model")
-        brand = self.run_shell_cmd("getprop ro.product.brand")
+        model = self.get_property("ro.product.model")
+        brand = self.get_property("ro.product.brand")
         if model.find(brand) >= 0:
             return model
         return "%s %s" % (brand, model)
 
-    @static_result
     def get_system_version(self):
         """获取系统版本
         """
-        return self.run_shell_cmd("getprop ro.build.version.release")
+        return self.get_property("ro.build.version.release")
 
-    @static_result
     def get_sdk_version(self):
         """获取SDK版本
         """
-        return int(self.run_shell_cmd("getprop ro.build.version.sdk"))
+        return int(self.get_property("ro.build.version.sdk"))
 
     def get_uid(self, app_name):
         """获取APP的uid
@@ -1400,6 +2646,7 @@ class ADB(object):
             return attr
 
         ret = self.run_shell_cmd("chmod %s %s" % (attr, file_path), self.is_rooted())
+        self.invalidate_file_cache(file_path)
         dir_list, file_list = self.list_dir(file_path)
 
         if (
@@ -1435,12 +2682,14 @@ class ADB(object):
         :type gid:        string
         """
         self.run_shell_cmd("chown %s:%s %s" % (uid, gid, file_path), True)
+        self.invalidate_file_cache(file_path)
 
     def mkdir(self, dir_path, mod=None):
         """创建目录
         """
         cmd = "mkdir %s" % (dir_path)
         ret = self.run_shell_cmd(cmd, self.is_rooted())
+        self.invalidate_file_cache(dir_path)
         #        if not 'File exists' in ret:
         #            #加了-p参数貌似不会返回这个提示信息
         try:
@@ -1452,9 +2701,27 @@ class ADB(object):
         if mod != None:
             self.chmod(dir_path, mod)
 
-    def list_dir(self, dir_path, run_as=None):
+    def list_dir(self, dir_path, run_as=None, cache_ttl=None):
         """列取目录
-        """
+
+        :param dir_path:  目录或文件路径
+        :type dir_path:   string
+        :param run_as:    以指定应用的身份执行
+        :type run_as:     string
+        :param cache_ttl: 结果的缓存时间（秒），默认使用list_dir_cache_ttl，为0时不使用缓存；
+                          通过本对象修改设备中的文件时会使相关缓存失效
+        :type cache_ttl:  int/float
+        :return: (目录列表, 文件列表)
+        :rtype:  tuple
+        """
+        if cache_ttl is None:
+            cache_ttl = self.list_dir_cache_ttl
+        cache_key = (dir_path, run_as)
+        if cache_ttl > 0:
+            item = self._list_dir_cache.get(cache_key)
+            if item and time.time() - item[0] < cache_ttl:
+                return list(item[1]), list(item[2])
+
         if " " in dir_path:
             dir_path = '"%s"' % dir_path
         cmdline = "ls -l %s" % dir_path
@@ -1482,116 +2749,80 @@ class ADB(object):
         if "Not a directory" in result:
             raise RuntimeError("%s %s" % (dir_path, result))
 
-        dir_list = []
-        file_list = []
-
-        def _handle_name(name):
-            return name.split("/")[-1]
-
-        is_toybox = self.get_sdk_version() >= 24
-        is_busybox = None
-        # busybox格式 -rwxrwxrwx    1 shell    shell        13652 Jun  3 10:56 /data/local/tmp/qt4a/inject
-
-        for line in result.split("\n"):
-            items = line.split()
-            if len(items) < 6:
-                continue  # (6, 7, 9)
-            if not line[0] in ("-", "d", "l"):
-                continue
+        dir_list, file_list = self._parse_list_dir(result)
+        if cache_ttl > 0:
+            self._list_dir_cache[cache_key] = (time.time(), dir_list, file_list)
+            return list(dir_list), list(file_list)
+        return dir_list, file_list
 
-            is_dir = items[0][0] == "d"  # 是否是目录
-            is_link = items[0][0] == "l"  # 软链
-            if is_busybox == None:
-                if is_toybox:
-                    item = items[5]  # 日期字段
-                else:
-                    item = items[4]  # 日期字段
-                    if is_dir or is_link:
-                        item = items[3]  # 目录和软链没有size字段
-                pattern = re.compile(r"\d{4}-\d{2}-\d{2}")
-                if pattern.match(item):
-                    is_busybox = False
-                else:
-                    is_busybox = True
-
-            if not is_busybox:
-                # 防止文件名称中有空格
-                if not is_toybox:
-                    if not is_dir and not is_link and len(items) > 7:
-                        items[6] = line[line.find(items[6]) :].strip()
-                    elif is_dir and len(items) > 6:
-                        items[5] = line[line.find(items[5]) :].strip()
-                else:
-                    if not is_dir and not is_link and len(items) > 8:
-                        items[7] = line[line.find(items[7]) :].strip()
-                    elif is_dir and len(items) > 7:
-                        items[6] = line[line.find(items[6]) :].strip()
+    def _detect_list_dir_format(self, result):
+        """根据ls -l的输出确定格式，确定后不再重复检测
+        """
+        if self._list_dir_format is None:
+            for line in result.split("\n"):
+                if not line or line[0] not in ("-", "d", "l"):
+                    continue
+                for name, pattern in self._list_dir_patterns:
+                    if pattern.match(line):
+                        self._list_dir_format = name
+                        return name
+        return self._list_dir_format
 
-            attrs = items[0]
-            if attrs[0] == "d":
-                if is_busybox:
-                    name = _handle_name(items[8])
-                elif is_toybox:
-                    name = items[7]
-                else:
-                    name = items[5]
-                dir_list.append({"name": name, "attr": attrs[1:]})
-            elif attrs[0] == "-":
+    def _parse_list_dir(self, result):
+        """使用预编译的正则一次解析ls -l的全部输出
+        """
+        dir_list = []
+        file_list = []
+        list_format = self._detect_list_dir_format(result)
+        if not list_format:
+            return dir_list, file_list
+        pattern = dict(self._list_dir_patterns)[list_format]
+        is_busybox = list_format == "busybox"
+        time_dict = {}  # 同一目录下大量文件的修改时间相同，避免重复构造
+
+        for ret in pattern.finditer(result):
+            file_type = ret.group(1)
+            attrs = ret.group(2)
+            if is_busybox:
+                last_modify_time = ret.group(4)
+                name = ret.group(5)
+            else:
+                time_key = ret.group(4, 5, 6, 7, 8)
+                last_modify_time = time_dict.get(time_key)
+                if last_modify_time is None:
+                    last_modify_time = datetime.datetime(
+                        *[int(it) for it in time_key]
+                    ).timetuple()
+                    time_dict[time_key] = last_modify_time
+                name = ret.group(9)
+
+            if file_type == "d":
                 if is_busybox:
-                    name = _handle_name(items[8])
-                    size = int(items[4])
-                    last_modify_time = items[7]
-                elif is_toybox:
-                    name = _handle_name(items[7])
-                    size = int(items[4])
-                    last_modify_time = time.strptime(
-                        "%s %s:00" % (items[5], items[6]), "%Y-%m-%d %X"
-                    )
-                else:
-                    name = items[6]
-                    size = int(items[3])
-                    try:
-                        last_modify_time = time.strptime(
-                            "%s %s:00" % (items[4], items[5]), "%Y-%m-%d %X"
-                        )
-                    except:
-                        # TODO: 即将删掉，调试用
-                        logger.info("line=%s" % line)
-                        raise
+                    name = name.split("/")[-1]
+                dir_list.append({"name": name, "attr": attrs})
+            elif file_type == "-":
+                if list_format != "toolbox":
+                    name = name.split("/")[-1]
                 file_list.append(
                     {
                         "name": name,
-                        "attr": attrs[1:],
-                        "size": size,
+                        "attr": attrs,
+                        "size": int(ret.group(3)),
                         "last_modify_time": last_modify_time,
                     }
                 )
-            elif attrs[0] == "l":  # link
+            else:  # link
+                name, _, link = name.partition(" -> ")
                 if is_busybox:
-                    name = _handle_name(items[8])
-                    last_modify_time = items[7]
-                    link = items[10]
-                elif is_toybox:
-                    name = items[7]
-                    last_modify_time = time.strptime(
-                        "%s %s:00" % (items[5], items[6]), "%Y-%m-%d %X"
-                    )
-                    link = items[9]
-                else:
-                    name = items[5]
-                    last_modify_time = time.strptime(
-                        "%s %s:00" % (items[3], items[4]), "%Y-%m-%d %X"
-                    )
-                    link = items[7]
+                    name = name.split("/")[-1]
                 file_list.append(
                     {
                         "name": name,
-                        "attr": attrs[1:],
+                        "attr": attrs,
                         "link": link,
                         "last_modify_time": last_modify_time,
                     }
                 )
-
         return dir_list, file_list
 
     def get_sdcard_path(self):
@@ -1615,6 +2846,7 @@ class ADB(object):
     def copy_file(self, src_path, dst_path):
         """在手机上拷贝文件
         """
+        self.invalidate_file_cache(dst_path)
         if not hasattr(self, "_has_cp"):
             self._has_cp = "not found" not in self.run_shell_cmd("cp")
         if self._has_cp:  # 不是所有的ROM都有cp命令
@@ -1627,6 +2859,7 @@ class ADB(object):
     def delete_file(self, file_path):
         """删除手机上文件
         """
+        self.invalidate_file_cache(file_path)
         if "*" in file_path:
             # 使用通配符时不能使用引号
             self.run_shell_cmd("rm -f %s" % file_path, self.is_rooted())
@@ -1637,6 +2870,7 @@ class ADB(object):
     def delete_folder(self, folder_path):
         """删除手机上的目录
         """
+        self.invalidate_file_cache(folder_path)
         folder_path = folder_path.replace('"', r"\"")
         self.run_shell_cmd('rm -R "%s"' % folder_path, self.is_rooted())
 
@@ -1807,22 +3041,12 @@ class ADB(object):
     def list_process(self):
         """获取进程列表
         """
-        for _ in range(3):
-            try:
-                return self._list_process()
-            except RuntimeError as e:
-                logger.warn("%s" % e)
-        else:
-            raise RuntimeError("获取进程列表失败")
+        return self._process_table.refresh()
 
     def get_pid(self, proc_name):
         """获取进程ID
         """
-        process_list = self.list_process()
-        for process in process_list:
-            if process["proc_name"] == proc_name:
-                return process["pid"]
-        return 0
+        return self._process_table.get_pid(proc_name)
 
     def get_process_status(self, pid):
         """获取进程状态信息
@@ -1916,9 +3140,9 @@ class ADB(object):
                 return line.split("=")[1].strip()
         raise RuntimeError("获取imei号失败：%r" % result)
 
-    def get_cpu_total_time(self):
+    @staticmethod
+    def _parse_cpu_total_time(result):
         cpu_time = 0
-        result = self.run_shell_cmd("cat /proc/stat")
         result = result.split("\n")[0]
         for item in result.split(" "):
             item = item.strip()
@@ -1929,8 +3153,8 @@ class ADB(object):
             cpu_time += int(item)
         return cpu_time
 
-    def get_process_cpu_time(self, pid):
-        result = self.run_shell_cmd("cat /proc/%d/stat" % pid)
+    @staticmethod
+    def _parse_task_cpu_time(result):
         result = result.split(" ")
         utime = int(result[13])
         stime = int(result[14])
@@ -1938,14 +3162,16 @@ class ADB(object):
         cstime = int(result[16])
         return utime + stime + cutime + cstime
 
+    def get_cpu_total_time(self):
+        return self._parse_cpu_total_time(self.run_shell_cmd("cat /proc/stat"))
+
+    def get_process_cpu_time(self, pid):
+        return self._parse_task_cpu_time(self.run_shell_cmd("cat /proc/%d/stat" % pid))
+
     def get_thread_cpu_time(self, pid, tid):
-        result = self.run_shell_cmd("cat /proc/%d/task/%d/stat" % (pid, tid))
-        result = result.split(" ")
-        utime = int(result[13])
-        stime = int(result[14])
-        cutime = int(result[15])
-        cstime = int(result[16])
-        return utime + stime + cutime + cstime
+        return self._parse_task_cpu_time(
+            self.run_shell_cmd("cat /proc/%d/task/%d/stat" % (pid, tid))
+        )
 
     def get_process_cpu(self, proc_name, interval=0.1):
         """获取进程中每个线程的CPU占用率
@@ -1954,16 +3180,23 @@ class ADB(object):
         # print (pid)
         if not pid:
             return None
-        total_cpu1 = self.get_cpu_total_time()
-        process_cpu1 = self.get_process_cpu_time(pid)
-        thread_cpu1 = self.get_thread_cpu_time(pid, pid)
+        cmd_list = [
+            "cat /proc/stat",
+            "cat /proc/%d/stat" % pid,
+            "cat /proc/%d/task/%d/stat" % (pid, pid),
+        ]
+        result1 = [it[0] for it in self.run_shell_batch(cmd_list)]
         time.sleep(interval)
-        total_cpu2 = self.get_cpu_total_time()
-        process_cpu2 = self.get_process_cpu_time(pid)
-        thread_cpu2 = self.get_thread_cpu_time(pid, pid)
-        total_cpu = total_cpu2 - total_cpu1
-        process_cpu = process_cpu2 - process_cpu1
-        thread_cpu = thread_cpu2 - thread_cpu1
+        result2 = [it[0] for it in self.run_shell_batch(cmd_list)]
+        total_cpu = self._parse_cpu_total_time(
+            result2[0]
+        ) - self._parse_cpu_total_time(result1[0])
+        process_cpu = self._parse_task_cpu_time(
+            result2[1]
+        ) - self._parse_task_cpu_time(result1[1])
+        thread_cpu = self._parse_task_cpu_time(
+            result2[2]
+        ) - self._parse_task_cpu_time(result1[2])
         return process_cpu * 100 // total_cpu, thread_cpu * 100 // total_cpu
 
     @staticmethod
@@ -20,87 +20,543 @@ from __future__ import unicode_literals
 
 import six
 import os
+import re
 import time
 import socket, select
+import stat
 import struct
+import tempfile
 import threading
-from io import BytesIO
-from qt4a.androiddriver.util import logger, utf8_encode, get_adb_server_port, TimeoutError
+import zlib
+
+try:
+    import selectors
+except ImportError:  # Python 2
+    selectors = None
+from qt4a.androiddriver.util import (
+    logger,
+    utf8_encode,
+    format_args,
+    get_adb_server_port,
+    TimeoutError,
+)
 
 SYNC_DATA_MAX = 64 * 1024
+COMPRESS_LEVEL = 1  # 流式压缩级别，优先保证压缩速度不低于传输速度
+
+# shell v2协议数据包类型
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
 
 
 class AdbError(RuntimeError):
     pass
 
 
+def parse_framebuffer_header(fb_desc):
+    """解析framebuffer:服务返回的13个uint32组成的头部
+
+    :return: (mode, raw_mode, size, width, height)
+    """
+    version = struct.unpack_from("I", fb_desc, 0)[0]
+    bpp = struct.unpack_from("I", fb_desc, 4)[0]
+    size = struct.unpack_from("I", fb_desc, 8)[0]
+    width = struct.unpack_from("I", fb_desc, 12)[0]
+    height = struct.unpack_from("I", fb_desc, 16)[0]
+    red_offset = struct.unpack_from("I", fb_desc, 20)[0]
+    red_length = struct.unpack_from("I", fb_desc, 24)[0]  # @UnusedVariable
+    blue_offset = struct.unpack_from("I", fb_desc, 28)[0]
+    blue_length = struct.unpack_from("I", fb_desc, 32)[0]  # @UnusedVariable
+    green_offset = struct.unpack_from("I", fb_desc, 36)[0]
+    green_length = struct.unpack_from("I", fb_desc, 40)[0]  # @UnusedVariable
+    alpha_offset = struct.unpack_from("I", fb_desc, 44)[0]
+    alpha_length = struct.unpack_from("I", fb_desc, 48)[0]
+
+    if version != 1:
+        raise AdbError("Unsupported version of framebuffer: %s" % version)
+    # detect order
+    util_map = {red_offset: "R", blue_offset: "B", green_offset: "G"}
+    keys = list(util_map.keys())
+    keys.sort()
+    raw_mode = "".join([util_map[it] for it in keys])
+
+    # detect mode
+    if alpha_length and alpha_offset:
+        mode = "RGBA"
+        if bpp != 32:
+            raise AdbError("Unsupported RGBA mode, bpp is %s" % bpp)
+        raw_mode += "A"
+
+    elif alpha_offset:
+        mode = "RGBX"
+        if bpp != 32:
+            raise AdbError("Unsupported RGBX mode, bpp is %s" % bpp)
+        raw_mode += "X"
+
+    else:
+        mode = "RGB"
+        if bpp == 16:
+            raw_mode += ";16"
+        elif bpp == 24:
+            pass
+        else:
+            raise AdbError("Unsupported RGB mode, bpp is %s" % bpp)
+    return mode, raw_mode, size, width, height
+
+
 class Pipe(object):
-    """模拟实现内存管道
+    """基于定长环形缓冲区的内存管道
+
+    写入方通过条件变量唤醒读取方，不再需要轮询；缓冲区写满时的处理策略：
+    block - 阻塞写入方直到有空间
+    drop_oldest - 丢弃最早的数据
+    spill - 超出部分暂存到临时文件，读取时按顺序回填
     """
 
+    OVERFLOW_BLOCK = "block"
+    OVERFLOW_DROP_OLDEST = "drop_oldest"
+    OVERFLOW_SPILL = "spill"
+
+    def __init__(self, capacity=1024 * 1024, overflow=OVERFLOW_BLOCK):
+        """
+        :param capacity: 环形缓冲区大小
+        :type  capacity: int
+        :param overflow: 缓冲区写满时的处理策略
+        :type  overflow: str
+        """
+        if overflow not in (
+            self.OVERFLOW_BLOCK,
+            self.OVERFLOW_DROP_OLDEST,
+            self.OVERFLOW_SPILL,
+        ):
+            raise ValueError("Invalid overflow policy: %s" % overflow)
+        self._capacity = capacity
+        self._overflow = overflow
+        self._buffer = bytearray(capacity)
+        self._head = 0  # 读指针位置
+        self._size = 0  # 缓冲区中的数据长度
+        self._scan_size = 0  # 已确认不包含换行符的数据长度，避免重复查找
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+        self._spill_file = None
+        self._spill_pos = 0  # 临时文件读指针位置
+        self._spill_size = 0  # 临时文件中未读取的数据长度
+        self.dropped_bytes = 0
+        self.spilled_bytes = 0
+        self.space_callback = None  # 读取方释放缓冲区空间后的回调
+        self.data_callback = None  # 写入数据或关闭后的回调，在锁外调用
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def writable_size(self):
+        """当前可以不阻塞写入的数据长度，只有block策略下会受缓冲区剩余空间限制
+        """
+        if self._overflow != self.OVERFLOW_BLOCK:
+            return self._capacity
+        return self._capacity - self._size
+
+    def _ring_write(self, data):
+        """写入数据，调用方需保证空间足够
+        """
+        tail = (self._head + self._size) % self._capacity
+        first = min(len(data), self._capacity - tail)
+        self._buffer[tail : tail + first] = data[:first]
+        if first < len(data):
+            self._buffer[: len(data) - first] = data[first:]
+        self._size += len(data)
+
+    def _ring_peek(self, size):
+        """读取数据但不从缓冲区中移除
+        """
+        size = min(size, self._size)
+        first = min(size, self._capacity - self._head)
+        result = bytes(self._buffer[self._head : self._head + first])
+        if first < size:
+            result += bytes(self._buffer[: size - first])
+        return result
+
+    def _ring_read(self, size):
+        """读取数据并从缓冲区中移除
+        """
+        result = self._ring_peek(size)
+        self._ring_skip(len(result))
+        return result
+
+    def _ring_skip(self, size):
+        self._head = (self._head + size) % self._capacity
+        self._size -= size
+        self._scan_size = max(0, self._scan_size - size)
+        if self._spill_size:
+            self._refill()
+        self._cond.notify_all()
+        if self.space_callback:
+            self.space_callback()
+
+    def _find_newline(self):
+        """查找第一个换行符相对于读指针的偏移，不存在时返回-1
+        """
+        end = self._head + self._size
+        start = self._head + self._scan_size
+        if start < self._capacity:
+            pos = self._buffer.find(b"\n", start, min(end, self._capacity))
+            if pos >= 0:
+                return pos - self._head
+            start = self._capacity
+        if end > self._capacity:
+            pos = self._buffer.find(
+                b"\n", start - self._capacity, end - self._capacity
+            )
+            if pos >= 0:
+                return pos + self._capacity - self._head
+        self._scan_size = self._size
+        return -1
+
+    def _spill(self, data):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile()
+        self._spill_file.seek(0, 2)
+        self._spill_file.write(data)
+        self._spill_size += len(data)
+        self.spilled_bytes += len(data)
+
+    def _refill(self):
+        """将临时文件中的数据回填到缓冲区
+        """
+        size = min(self._capacity - self._size, self._spill_size)
+        if size <= 0:
+            return
+        self._spill_file.seek(self._spill_pos)
+        self._ring_write(self._spill_file.read(size))
+        self._spill_pos += size
+        self._spill_size -= size
+        if not self._spill_size:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+            self._spill_pos = 0
+
+    def write(self, s):
+        self._write(s)
+        if self.data_callback:
+            self.data_callback()
+
+    def _write(self, s):
+        with self._cond:
+            if self._closed:
+                return
+            if self._overflow == self.OVERFLOW_BLOCK:
+                while s:
+                    while self._size == self._capacity and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    size = min(len(s), self._capacity - self._size)
+                    self._ring_write(s[:size])
+                    s = s[size:]
+                    self._cond.notify_all()
+                return
+            elif self._overflow == self.OVERFLOW_SPILL:
+                if not self._spill_size:
+                    size = min(len(s), self._capacity - self._size)
+                    self._ring_write(s[:size])
+                    s = s[size:]
+                if s:
+                    self._spill(s)
+            else:
+                if len(s) > self._capacity:
+                    self.dropped_bytes += len(s) - self._capacity
+                    s = s[-self._capacity :]
+                size = len(s) - (self._capacity - self._size)
+                if size > 0:
+                    last = self._buffer[(self._head + size - 1) % self._capacity]
+                    self.dropped_bytes += size
+                    self._ring_skip(size)
+                    if last != ord(b"\n"):
+                        # 继续丢弃到行尾，避免读取方拿到不完整的行
+                        self._scan_size = 0
+                        pos = self._find_newline()
+                        if pos >= 0:
+                            self.dropped_bytes += pos + 1
+                            self._ring_skip(pos + 1)
+                self._ring_write(s)
+            self._cond.notify_all()
+
+    def readline(self, timeout=None):
+        """读取一行数据，阻塞直到读取到换行符、缓冲区满或管道关闭
+
+        :param timeout: 超时时间，超时后抛出TimeoutError，默认一直等待
+        :type  timeout: float
+        :return: 包含换行符的一行数据，管道关闭且数据已读完时返回空字符串
+        """
+        if timeout != None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                pos = self._find_newline()
+                if pos >= 0:
+                    return self._ring_read(pos + 1)
+                if self._closed or self._size == self._capacity:
+                    return self._ring_read(self._size)
+                if timeout == None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("Read line timeout")
+                self._cond.wait(remaining)
+
+    def read(self, size=-1):
+        """读取数据
+
+        :param size: 读取的最大长度，小于0时不阻塞并返回管道中当前所有的数据，
+                     否则阻塞直到有数据可读或管道关闭
+        :type  size: int
+        """
+        with self._cond:
+            if size < 0:
+                result = []
+                while self._size:
+                    result.append(self._ring_read(self._size))
+                return b"".join(result)
+            while not self._size and not self._closed:
+                self._cond.wait()
+            return self._ring_read(size)
+
+    def read_lines(self):
+        """不阻塞地读取管道中所有完整的行，管道关闭或缓冲区满时同时返回末尾不完整的行
+
+        :return: 不包含换行符的行列表
+        :rtype:  list
+        """
+        with self._cond:
+            data = self._ring_peek(self._size)
+            pos = data.rfind(b"\n")
+            if self._closed or self._size == self._capacity:
+                pos = len(data) - 1
+            if pos < 0:
+                self._scan_size = self._size
+                return []
+            self._ring_skip(pos + 1)
+            if data[pos : pos + 1] == b"\n":
+                return data[:pos].split(b"\n")
+            return data[: pos + 1].split(b"\n")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    next = __next__
+
+    def close(self):
+        """关闭写入端，读取方读完剩余数据后得到EOF
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self.data_callback:
+            self.data_callback()
+
+
+class _SelectSelector(object):
+    """不支持selectors模块时基于select实现的选择器，只支持读事件
+    """
+
+    class SelectorKey(object):
+        def __init__(self, fileobj, data):
+            self.fileobj = fileobj
+            self.data = data
+
+    def __init__(self):
+        self._key_dict = {}
+
+    def register(self, fileobj, events, data=None):
+        self._key_dict[fileobj] = self.SelectorKey(fileobj, data)
+
+    def unregister(self, fileobj):
+        self._key_dict.pop(fileobj)
+
+    def select(self, timeout=None):
+        infds, _, _ = select.select(list(self._key_dict.keys()), [], [], timeout)
+        return [(self._key_dict[it], 1) for it in infds]
+
+
+class ADBReactor(object):
+    """进程内共享的异步连接事件循环
+
+    所有异步shell等流式连接都注册到同一个选择器中，由一个线程负责读取数据并分发给各连接的处理器，
+    线程数不再随连接数增长。处理器需要实现以下方法：
+    fileno() - 返回socket的文件描述符
+    handle_read() - 连接可读时调用，返回PAUSE表示暂停读取，返回CLOSE表示连接已结束
+    handle_close(timed_out) - 连接结束或超时时调用
+    处理器的deadline属性不为None时，到期后会以超时结束
+    """
+
+    PAUSE = "pause"
+    CLOSE = "close"
+
+    instance = None
+    instance_lock = threading.Lock()
+
     def __init__(self):
-        self._buffer = BytesIO()
-        self._max_buffer_size = 4096 * 16
+        self._selector = selectors.DefaultSelector() if selectors else _SelectSelector()
         self._lock = threading.Lock()
-        self._pos = 0  # 当前读指针位置
-        self._write_buffer = b""  # 保证每次都是整行写
+        self._pending = []  # 待事件循环线程处理的(操作, 处理器)
+        self._handlers = set()
+        self._paused = set()
+        self._wakeup_reader, self._wakeup_writer = self._create_socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, 1, None)
+        self._thread = threading.Thread(target=self._run, name="ADBReactor")
+        self._thread.setDaemon(True)
+        self._thread.start()
 
-    def write(self, s):
-        self._write_buffer += s
-        pos = self._write_buffer.rfind(b"\n")
-        if pos <= 0:
+    @staticmethod
+    def get_reactor():
+        """获取进程内共享的实例
+        """
+        with ADBReactor.instance_lock:
+            if ADBReactor.instance is None:
+                ADBReactor.instance = ADBReactor()
+            return ADBReactor.instance
+
+    @staticmethod
+    def _create_socketpair():
+        if hasattr(socket, "socketpair"):
+            return socket.socketpair()
+        serv = socket.socket()
+        serv.bind(("127.0.0.1", 0))
+        serv.listen(1)
+        client = socket.socket()
+        client.connect(serv.getsockname())
+        sock, _ = serv.accept()
+        serv.close()
+        return sock, client
+
+    @property
+    def thread_id(self):
+        return self._thread.ident
+
+    def _post(self, action, handler):
+        with self._lock:
+            self._pending.append((action, handler))
+        try:
+            self._wakeup_writer.send(b"\x00")
+        except socket.error:
+            pass  # 缓冲区已满时说明事件循环尚未处理，无需再次唤醒
+
+    def register(self, handler):
+        """注册处理器
+        """
+        handler.paused = False
+        self._post("register", handler)
+
+    def unregister(self, handler):
+        """结束处理器对应的连接
+        """
+        self._post("unregister", handler)
+
+    def resume(self, handler):
+        """恢复读取已暂停的连接
+        """
+        self._post("resume", handler)
+
+    def _remove(self, handler, timed_out=False):
+        if handler not in self._handlers:
             return
-        s = self._write_buffer[:pos]
-        self._write_buffer = self._write_buffer[pos:]
+        self._handlers.discard(handler)
+        if handler in self._paused:
+            self._paused.discard(handler)
+        else:
+            self._selector.unregister(handler)
+        try:
+            handler.handle_close(timed_out)
+        except Exception:
+            logger.exception("close %r failed" % handler)
+
+    def _process_pending(self):
         with self._lock:
-            self._buffer.seek(0, 2)  # 将指针置于尾部
-            self._buffer.write(s)
+            pending_list = self._pending
+            self._pending = []
+        for action, handler in pending_list:
+            if action == "register":
+                self._handlers.add(handler)
+                self._selector.register(handler, 1, handler)
+            elif action == "unregister":
+                self._remove(handler)
+            elif action == "resume" and handler in self._paused:
+                self._paused.discard(handler)
+                handler.paused = False
+                self._selector.register(handler, 1, handler)
+
+    def _pause(self, handler):
+        self._selector.unregister(handler)
+        self._paused.add(handler)
+        handler.paused = True
+        if handler.can_read():
+            # 设置暂停标记前读取方可能已经释放了空间
+            self._paused.discard(handler)
+            handler.paused = False
+            self._selector.register(handler, 1, handler)
+
+    def _get_timeout(self):
+        deadline_list = [
+            it.deadline for it in self._handlers if it.deadline is not None
+        ]
+        if not deadline_list:
+            return None
+        return max(0, min(deadline_list) - time.time())
 
-    def readline(self):
-        wait = False
+    def _run(self):
         while True:
-            if wait:
-                time.sleep(0.1)
-            with self._lock:
-                self._buffer.seek(0, 2)
-                buffer_size = self._buffer.tell()
-                if buffer_size <= self._pos:
-                    wait = True
+            self._process_pending()
+            try:
+                event_list = self._selector.select(self._get_timeout())
+            except (select.error, socket.error, ValueError):
+                # 已关闭的socket会导致select失败，逐个检查并剔除
+                logger.exception("select failed")
+                for handler in list(self._handlers - self._paused):
+                    try:
+                        select.select([handler], [], [], 0)
+                    except (select.error, socket.error, ValueError):
+                        self._remove(handler)
+                continue
+            for key, _ in event_list:
+                handler = key.data
+                if handler is None:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except socket.error:
+                        pass
                     continue
-            with self._lock:
-                self._buffer.seek(self._pos)
-                ret = self._buffer.readline()
-                if len(ret) == 0:
-                    wait = True
+                if handler not in self._handlers or handler in self._paused:
                     continue
-                else:
-                    self._pos = self._buffer.tell()
-                    self._buffer.seek(0, 2)
-                    buffer_size = self._buffer.tell()
-                    if buffer_size >= self._max_buffer_size:
-                        # 创建新的缓冲区
-                        self._buffer.seek(self._pos)
-                        buffer = self._buffer.read()
-                        self._buffer.close()
-                        self._buffer = BytesIO()
-                        self._buffer.write(buffer)
-                        self._pos = 0
-                    return ret
-
-    def read(self):
-        """读取管道中的所有数据
-        """
-        with self._lock:
-            self._buffer.seek(self._pos)
-            result = self._buffer.read()
-            if self._write_buffer:
-                result += self._write_buffer
-                self._write_buffer = ""
-            return result
+                try:
+                    result = handler.handle_read()
+                except Exception:
+                    logger.exception("handle read failed")
+                    result = self.CLOSE
+                if result == self.CLOSE:
+                    self._remove(handler)
+                elif result == self.PAUSE:
+                    self._pause(handler)
+            now = time.time()
+            for handler in list(self._handlers):
+                if handler.deadline is not None and now >= handler.deadline:
+                    self._remove(handler, True)
 
 
 class ADBPopen(object):
-    """与Popen兼容
+    """与Popen兼容，由ADBReactor统一读取数据
     """
 
     class StdinPipe(object):
@@ -111,26 +567,26 @@ class ADBPopen(object):
             self._sock = sock
 
         def write(self, s):
-            self._sock.send(s)
+            self._sock.sendall(s)
 
         def flush(self):
             pass
 
-    def __init__(self, sock, timeout=None):
+    def __init__(self, sock, timeout=None, overflow=Pipe.OVERFLOW_SPILL):
         self._sock = sock
+        self._fileno = sock.fileno()
         self._stdin = self.StdinPipe(sock)
-        self._stdout = Pipe()
-        self._stderr = Pipe()
-        self._running = True
-        self._timeout = timeout
-        if self._timeout == None:
-            self._timeout = 0xFFFFFFFF
+        self._stdout = Pipe(overflow=overflow)
+        self._stderr = Pipe(overflow=overflow)
+        self._timed_out = False
+        self.deadline = None
+        if timeout != None:
+            self.deadline = time.time() + timeout
+        self.paused = False
         self._event = threading.Event()  # 接收完数据的事件通知
-        self._thread = threading.Thread(
-            target=self._work_thread, args=(), name=self.__class__.__name__
-        )
-        self._thread.setDaemon(True)
-        self._thread.start()
+        self._reactor = ADBReactor.get_reactor()
+        self._stdout.space_callback = self._on_space
+        self._reactor.register(self)
 
     @property
     def stdin(self):
@@ -146,56 +602,235 @@ class ADBPopen(object):
 
     @property
     def pid(self):
-        return self._thread.ident
+        return self._fileno
 
-    def _work_thread(self):
-        time0 = time.time()
-        while self._running and time.time() - time0 < self._timeout:
-            infds, outfds, errfds = select.select([self._sock,], [], [], 1)
-            if len(infds) > 0:
-                try:
-                    buff = self._sock.recv(4096)
-                    if len(buff) == 0:
-                        self._sock.close()
-                        self._sock = None
-                        self._running = False
-                        self._event.set()
-                        return
-                    self._stdout.write(buff)
-                except socket.error as e:
-                    logger.info("Recv response error: %s" % (e))
-                    self._stdout.write(b" ")  # 通知接收方退出
-                    self._sock.close()
-                    self._sock = None
-                    self._running = False
-                    self._event.set()
-                    return
+    def fileno(self):
+        return self._fileno
+
+    def can_read(self):
+        return self._stdout.writable_size() > 0
+
+    def _on_space(self):
+        if self.paused:
+            self._reactor.resume(self)
+
+    def handle_read(self):
+        size = min(self._stdout.writable_size(), 4096)
+        if size <= 0:
+            return ADBReactor.PAUSE
+        try:
+            buff = self._sock.recv(size)
+        except socket.error as e:
+            logger.info("Recv response error: %s" % (e))
+            return ADBReactor.CLOSE
+        if len(buff) == 0:
+            return ADBReactor.CLOSE
+        self._stdout.write(buff)
+
+    def handle_close(self, timed_out=False):
+        self._timed_out = timed_out
         self._sock.close()
-        self._sock = None
+        self._event.set()
+        self._stdout.close()
+        self._stderr.close()
 
     def poll(self):
         """是否存在
         """
-        if self._thread.is_alive():
-            return None
-        else:
+        if self._event.is_set():
             return 0
+        else:
+            return None
 
     def terminate(self):
         """结束
         """
-        self._running = False
-        time.sleep(1)  # 等待线程退出
+        self._reactor.unregister(self)
+        self._event.wait(2)  # 等待连接关闭
 
     def communicate(self):
         """
         """
-        while True:
-            if self._event.wait(0.001) == True or self.poll() == 0:
-                if self._running:
-                    raise TimeoutError("Execute timeout")
-                return self.stdout.read(), self.stderr.read()
-            # time.sleep(0.001)
+        while not self._event.wait(1):
+            pass
+        if self._timed_out:
+            raise TimeoutError("Execute timeout")
+        return self.stdout.read(), self.stderr.read()
+
+
+class ADBConnectionPool(object):
+    """ADB Server连接池
+
+    连接按(ADB Server, 设备序列号)分组管理：同一设备的并发连接数受限，协议允许复用的空闲连接
+    （如仍处于sync:会话中的连接）会被保留下来供后续命令复用；同时统计命中、未命中与等待耗时
+    """
+
+    instance_dict = {}
+    instance_lock = threading.Lock()
+    max_idle_time = 30  # 空闲连接最长保留时间（秒）
+
+    def __init__(self, server_addr, server_port, max_connections=8):
+        self._server_addr = server_addr
+        self._server_port = server_port
+        self._max_connections = max_connections  # 单个设备的最大并发连接数
+        self._cond = threading.Condition()
+        self._idle_socks = {}  # (serial, service) -> [(sock, release_time), ...]
+        self._active_counts = {}  # serial -> 正在使用中的连接数
+        self._leases = {}  # sock -> serial
+        self._stats = {
+            "hit": 0,
+            "miss": 0,
+            "wait_count": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+        }
+
+    @staticmethod
+    def get_pool(server_addr, server_port):
+        """获取指定ADB Server对应的连接池
+        """
+        key = (server_addr, server_port)
+        with ADBConnectionPool.instance_lock:
+            if key not in ADBConnectionPool.instance_dict:
+                ADBConnectionPool.instance_dict[key] = ADBConnectionPool(
+                    server_addr, server_port
+                )
+            return ADBConnectionPool.instance_dict[key]
+
+    def _create_connection(self):
+        """建立到ADB Server的新连接
+        """
+        error = None
+        for _ in range(3):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.connect((self._server_addr, self._server_port))
+                return sock
+            except socket.error as e:
+                sock.close()
+                error = e
+        raise error
+
+    @staticmethod
+    def _is_alive(sock):
+        """空闲连接上不应有任何可读数据，可读说明对端已关闭连接
+        """
+        try:
+            infds, _, _ = select.select([sock], [], [], 0)
+        except (socket.error, ValueError):
+            return False
+        return len(infds) == 0
+
+    def _pop_idle(self, serial, service):
+        idle_list = self._idle_socks.get((serial, service))
+        while idle_list:
+            sock, release_time = idle_list.pop()
+            if time.time() - release_time < self.max_idle_time and self._is_alive(
+                sock
+            ):
+                return sock
+            sock.close()
+        return None
+
+    def acquire(self, serial=None, service=None, timeout=60):
+        """租用连接
+
+        :param serial:  设备序列号，为None时表示主机级连接，不限制并发数
+        :type  serial:  str
+        :param service: 需要复用的会话类型，如"sync:"；为None时总是返回新连接
+        :type  service: str
+        :param timeout: 等待可用连接的超时时间
+        :type  timeout: int/float
+        :return: (socket, 是否为复用的连接)
+        """
+        with self._cond:
+            if serial is not None:
+                time0 = time.time()
+                waited = False
+                while self._active_counts.get(serial, 0) >= self._max_connections:
+                    waited = True
+                    remaining = timeout - (time.time() - time0)
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            "Wait for connection of device %s timeout" % serial
+                        )
+                    self._cond.wait(remaining)
+                if waited:
+                    wait_time = time.time() - time0
+                    self._stats["wait_count"] += 1
+                    self._stats["wait_time"] += wait_time
+                    self._stats["max_wait_time"] = max(
+                        self._stats["max_wait_time"], wait_time
+                    )
+            sock = None
+            if service is not None:
+                sock = self._pop_idle(serial, service)
+            reused = sock is not None
+            if reused:
+                self._stats["hit"] += 1
+            else:
+                self._stats["miss"] += 1
+            self._active_counts[serial] = self._active_counts.get(serial, 0) + 1
+
+        if not reused:
+            try:
+                sock = self._create_connection()
+            except socket.error:
+                with self._cond:
+                    self._active_counts[serial] -= 1
+                    self._cond.notify()
+                raise
+        with self._cond:
+            self._leases[sock] = serial
+        return sock, reused
+
+    def detach(self, sock):
+        """归还连接的租用名额，连接本身由调用方继续持有或已关闭
+        """
+        with self._cond:
+            if sock not in self._leases:
+                return
+            serial = self._leases.pop(sock)
+            self._active_counts[serial] -= 1
+            self._cond.notify()
+
+    def release(self, sock, service=None):
+        """归还连接
+
+        :param service: 连接当前所处的会话类型，不为None时连接会被保留用于复用，否则直接关闭
+        :type  service: str
+        """
+        if service is not None:
+            with self._cond:
+                if sock in self._leases:
+                    serial = self._leases[sock]
+                    idle_list = self._idle_socks.setdefault((serial, service), [])
+                    if len(idle_list) < self._max_connections:
+                        idle_list.append((sock, time.time()))
+                        self._leases.pop(sock)
+                        self._active_counts[serial] -= 1
+                        self._cond.notify()
+                        return
+        self.detach(sock)
+        sock.close()
+
+    def get_stats(self):
+        """获取连接池统计数据
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["active"] = sum(self._active_counts.values())
+            stats["idle"] = sum(len(it) for it in self._idle_socks.values())
+        return stats
+
+    def clear(self):
+        """关闭所有空闲连接
+        """
+        with self._cond:
+            for idle_list in self._idle_socks.values():
+                for sock, _ in idle_list:
+                    sock.close()
+            self._idle_socks = {}
 
 
 class ADBClient(object):
@@ -203,18 +838,39 @@ class ADBClient(object):
     """
 
     instance_dict = {}
+    instance_lock = threading.Lock()
 
     def __init__(self, server_addr="127.0.0.1", server_port=None):
         self._server_addr = server_addr
         self._server_port = server_port or get_adb_server_port()
-        self._sock = None
-        self._lock = threading.Lock()
+        self._pool = ADBConnectionPool.get_pool(self._server_addr, self._server_port)
+        self._local = threading.local()  # 每个线程独立使用自己租用的连接
 
     @staticmethod
     def get_client(host, port=None):
         """根据主机名获取ADBClient实例
         """
-        return ADBClient(host, port)
+        key = (host, port or get_adb_server_port())
+        with ADBClient.instance_lock:
+            if key not in ADBClient.instance_dict:
+                ADBClient.instance_dict[key] = ADBClient(*key)
+            return ADBClient.instance_dict[key]
+
+    @property
+    def _sock(self):
+        return getattr(self._local, "sock", None)
+
+    @_sock.setter
+    def _sock(self, sock):
+        old_sock = getattr(self._local, "sock", None)
+        if old_sock is not None and old_sock is not sock:
+            self._pool.detach(old_sock)  # 连接已关闭或已转交给其它对象
+        self._local.sock = sock
+
+    def get_pool_stats(self):
+        """获取连接池统计数据
+        """
+        return self._pool.get_stats()
 
     def call(self, cmd, *args, **kwds):
         """调用命令字
@@ -233,6 +889,7 @@ class ADBClient(object):
         if "timeout" in kwds and not cmd in (
             "shell",
             "install",
+            "install_streamed",
             "uninstall",
             "wait_for_device",
             "reboot",
@@ -245,11 +902,10 @@ class ADBClient(object):
             socket_error_count = 0
             while i < retry_count:
                 try:
-                    self._lock.acquire()
                     ret = method(*args, **kwds)
                     break
                 except socket.error as e:
-                    logger.exception("执行%s %s error" % (cmd, " ".join(args)))
+                    logger.exception("执行%s %s error" % (cmd, format_args(args)))
                     socket_error_count += 1
                     if socket_error_count <= 10:
                         i -= 1
@@ -272,14 +928,14 @@ class ADBClient(object):
                         or "closed" in err_msg
                     ):  # wetest设备有时候会返回closed错误
                         # 需要重试
-                        logger.exception("Run %s%s %r" % (cmd, " ".join(args), e))
+                        logger.exception("Run %s%s %r" % (cmd, format_args(args), e))
                     else:
-                        raise RuntimeError("执行%s %s 命令失败：%s" % (cmd, " ".join(args), e))
+                        raise RuntimeError("执行%s %s 命令失败：%s" % (cmd, format_args(args), e))
                     time.sleep(1)
                     if i >= retry_count - 1:
                         raise e
                 except RuntimeError as e:
-                    logger.exception("执行%s%s %r" % (cmd, " ".join(args), e))
+                    logger.exception("执行%s%s %r" % (cmd, format_args(args), e))
                     if "device not found" in str(e):
                         self.wait_for_device(args[0], retry_count=1, timeout=300)
                         self._sock = None
@@ -289,34 +945,31 @@ class ADBClient(object):
                     if self._sock != None:
                         self._sock.close()
                         self._sock = None
-                    self._lock.release()
 
             if ret == None:
-                raise TimeoutError("Run cmd %s %s failed" % (cmd, " ".join(args)))
+                raise TimeoutError("Run cmd %s %s failed" % (cmd, format_args(args)))
 
             if isinstance(ret, (six.string_types, six.binary_type)):
                 return ret, ""
             else:
                 return ret
         else:
-            self._transport(args[0])  # 异步操作的必然需要发送序列号
-            if cmd == "shell":
-                self._lock.acquire()
-                self._send_command("shell:" + " ".join(args[1:]))
-                pipe = ADBPopen(self._sock)
-                self._sock = None
-                self._lock.release()
-                return pipe
-
-    def _connect(self):
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        for i in range(3):
             try:
-                self._sock.connect((self._server_addr, self._server_port))
-                return True
-            except socket.error:
-                pass
-        return False
+                self._transport(args[0])  # 异步操作的必然需要发送序列号
+                if cmd in ("shell", "exec"):
+                    # exec:服务不分配终端，适合传输二进制数据
+                    self._send_command("%s:%s" % (cmd, " ".join(args[1:])))
+                    pipe = ADBPopen(self._sock)
+                    self._sock = None
+                    return pipe
+            finally:
+                if self._sock != None:
+                    self._sock.close()
+                    self._sock = None
+
+    def _connect(self, serial=None):
+        self._sock = self._pool.acquire(serial)[0]
+        return True
 
     def _check_status(self):
         """检查返回状态
@@ -345,16 +998,35 @@ class ADBClient(object):
     def _recv(self, size=None):
         """从socket读取数据
         """
-        result = b""
         if size != None:
-            while len(result) < size:
-                result += self._sock.recv(size - len(result))
-        else:
+            result = bytearray(size)
+            self._recv_into(result)
+            return bytes(result)
+        chunks = []
+        data = self._sock.recv(4096)
+        while data:
+            chunks.append(data)
             data = self._sock.recv(4096)
-            while data:
-                result += data
-                data = self._sock.recv(4096)
-        return result
+        return b"".join(chunks)
+
+    def _recv_into(self, buffer, size=None):
+        """从socket读取数据直接填充到预分配的缓冲区中，避免中间拷贝
+
+        :param buffer: 可写缓冲区，如bytearray
+        :type  buffer: bytearray/memoryview
+        :param size:   读取的字节数，默认填满整个缓冲区
+        :type  size:   int
+        """
+        view = memoryview(buffer)
+        if size == None:
+            size = len(view)
+        offset = 0
+        while offset < size:
+            recv_size = self._sock.recv_into(view[offset:size], size - offset)
+            if recv_size == 0:
+                raise AdbError("connection closed")
+            offset += recv_size
+        return size
 
     def send_command(self, cmd):
         self._send_command(cmd)
@@ -366,6 +1038,8 @@ class ADBClient(object):
         return resp.decode("utf8")
 
     def _transport(self, device_id):
+        if not self._sock:
+            self._connect(device_id)  # 设备级连接受连接池并发数限制
         self._send_command("host:transport:%s" % device_id)
 
     def devices(self):
@@ -384,24 +1058,146 @@ class ADBClient(object):
         self._sock = None
         return result
 
+    def _open_sync(self, device_id):
+        """打开sync:会话，优先复用连接池中仍处于sync:会话的空闲连接
+        """
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        sock, reused = self._pool.acquire(device_id, "sync:")
+        self._sock = sock
+        if not reused:
+            self._send_command("host:transport:%s" % device_id)
+            self._send_command("sync:")
+
+    def _release_sync(self):
+        """结束本次sync操作，会话保持打开状态并归还连接池
+        """
+        sock = self._sock
+        self._local.sock = None
+        self._pool.release(sock, "sync:")
+
     def _sync_read_mode(self, remote_path):
         """
         """
-        remote_path = utf8_encode(remote_path)
-        data = b"STAT" + struct.pack(b"I", len(remote_path)) + remote_path
-        self._sock.send(data)
-        result = self._sock.recv(16)
-        if result[:4] != b"STAT":
-            raise AdbError("sync_read_mode error")
-        mode, size, time = struct.unpack(b"III", result[4:])
-        return mode, size, time
+        return self._sync_stat_list([remote_path])[0]
+
+    def _sync_stat_list(self, path_list, window=256):
+        """在当前sync:会话中批量执行STAT，请求以流水线方式发送，每个窗口只需一次往返
+
+        :return: [(mode, size, time), ...]
+        """
+        result = []
+        for i in range(0, len(path_list), window):
+            path_batch = [utf8_encode(it) for it in path_list[i : i + window]]
+            self._sock.sendall(
+                b"".join(
+                    [b"STAT" + struct.pack(b"I", len(it)) + it for it in path_batch]
+                )
+            )
+            for _ in path_batch:
+                data = self._recv(16)
+                if data[:4] != b"STAT":
+                    raise AdbError("sync_read_mode error")
+                result.append(struct.unpack(b"III", data[4:]))
+        return result
+
+    def _sync_list(self, dir_list, window=64):
+        """在当前sync:会话中批量执行LIST
+
+        :return: 与dir_list一一对应的[(name, mode, size, time), ...]列表
+        """
+        result = []
+        for i in range(0, len(dir_list), window):
+            dir_batch = [utf8_encode(it) for it in dir_list[i : i + window]]
+            self._sock.sendall(
+                b"".join([b"LIST" + struct.pack(b"I", len(it)) + it for it in dir_batch])
+            )
+            for _ in dir_batch:
+                entry_list = []
+                while True:
+                    data = self._recv(20)
+                    mode, size, mtime, name_len = struct.unpack(b"IIII", data[4:])
+                    if data[:4] == b"DONE":
+                        break
+                    elif data[:4] != b"DENT":
+                        raise AdbError("sync_list error: %r" % data[:4])
+                    name = self._recv(name_len).decode("utf8", "replace")
+                    if name not in (".", ".."):
+                        entry_list.append((name, mode, size, mtime))
+                result.append(entry_list)
+        return result
+
+    def _sync_send(self, src_file, dst_file):
+        """在当前sync:会话中发送文件，设备端出错后会关闭会话
+
+        :return: 发送的字节数
+        """
+        try:
+            st = os.stat(src_file)
+        except OSError as e:
+            if e.errno == 2:
+                raise AdbError("cannot stat '%s': No such file or directory" % src_file)
+            else:
+                raise e
+        dst_file = utf8_encode(dst_file)
+        s = b"%s,%d" % (dst_file, st.st_mode)
+        self._sock.sendall(b"SEND" + struct.pack(b"I", len(s)) + s)
+        data_size = 0
+        with open(src_file, "rb") as fp:
+            data = fp.read(SYNC_DATA_MAX)
+            while data:
+                self._sock.sendall(b"DATA" + struct.pack(b"I", len(data)) + data)
+                data_size += len(data)
+                data = fp.read(SYNC_DATA_MAX)
+
+        self._sock.sendall(b"DONE" + struct.pack(b"I", int(st.st_mtime)))
+        result = self._recv(8)
+        if result[:4] == b"OKAY":
+            return data_size
+        elif result[:4] == b"FAIL":
+            msg_len = struct.unpack(b"I", result[4:])[0]
+            error_msg = self._recv(msg_len)
+            raise AdbError(error_msg.decode("utf8", "replace"))
+        else:
+            raise RuntimeError("Unexpect data: %r" % result)
+
+    def _sync_recv(self, src_file, dst_file):
+        """在当前sync:会话中接收文件，设备端出错后会关闭会话
+
+        :return: 接收的字节数
+        """
+        src_file = utf8_encode(src_file)
+        data = b"RECV" + struct.pack(b"I", len(src_file)) + src_file
+        self._sock.sendall(data)
+        data_size = 0
+        header = bytearray(8)
+        buffer = bytearray(SYNC_DATA_MAX)
+        with open(dst_file, "wb") as f:
+            while True:
+                self._recv_into(header)
+                packet_id = bytes(header[:4])
+                psize = struct.unpack_from(b"I", header, 4)[0]  # 每个分包大小
+
+                if packet_id == b"DONE":
+                    break
+                elif packet_id == b"FAIL":
+                    raise AdbError(self._recv(psize).decode("utf8", "replace"))
+                elif packet_id != b"DATA":
+                    raise AdbError("pull_file error")
+
+                if psize > len(buffer):
+                    buffer = bytearray(psize)
+                self._recv_into(buffer, psize)
+                f.write(memoryview(buffer)[:psize])
+                data_size += psize
+        return data_size
 
     def pull(self, device_id, src_file, dst_file):
         """adb pull
         """
         time0 = time.time()
-        self._transport(device_id)
-        self._send_command("sync:")
+        self._open_sync(device_id)
         mode, fsize, ftime = self._sync_read_mode(src_file)
         if fsize > 0:
             if mode == 0:
@@ -409,51 +1205,9 @@ class ADBClient(object):
                 self._sock = None
                 raise AdbError("remote object %r does not exist" % src_file)
 
-            src_file = utf8_encode(src_file)
-            data = b"RECV" + struct.pack(b"I", len(src_file)) + src_file
-            self._sock.send(data)
-            f = open(dst_file, "wb")
-            data_size = 0
-            last_data = b""
-            while True:
-                result = self._sock.recv(8)
-                if len(result) != 8:
-                    logger.warn("返回数据错误：%r" % result)
-
-                last_data += result
-                if len(last_data) < 8:
-                    continue
-                else:
-                    result = last_data[:8]
-                    last_data = last_data[8:]
-
-                psize = struct.unpack(b"I", result[4:])[0]  # 每个分包大小
-
-                if result[:4] == b"DONE":
-                    break
-                elif result[:4] == b"FAIL":
-                    raise AdbError(self._sock.recv(psize))
-                elif result[:4] != b"DATA":
-                    raise AdbError("pull_file error")
-
-                result = self._recv(psize - len(last_data))
-                result = last_data + result
-                if len(result) >= psize:
-                    last_data = result[psize:]
-                    result = result[:psize]
-                else:
-                    raise ValueError(
-                        "Invalid data size, expect %d, actual is %d"
-                        % (psize, len(result))
-                    )
-                f.write(result)
-                data_size += len(result)
-
-            f.close()
-            self._sock.send(b"QUIT" + struct.pack(b"I", 0))
+            data_size = self._sync_recv(src_file, dst_file)
             time_cost = time.time() - time0
-            self._sock.close()
-            self._sock = None
+            self._release_sync()
             if data_size > 0:
                 return "%d KB/s (%d bytes in %fs)" % (
                     int(data_size / 1000 / time_cost) if time_cost > 0 else 65535,
@@ -463,58 +1217,217 @@ class ADBClient(object):
             else:
                 return ""
         else:
+            self._release_sync()
             return "0 KB/s (0 bytes in 0 s)"
 
     def push(self, device_id, src_file, dst_file):
         """adb push
         """
         time0 = time.time()
-        try:
-            st = os.stat(src_file)
-        except OSError as e:
-            if e.errno == 2:
-                raise AdbError("cannot stat '%s': No such file or directory" % src_file)
+        if not os.path.exists(src_file):
+            raise AdbError("cannot stat '%s': No such file or directory" % src_file)
+        self._open_sync(device_id)
+        self._sync_read_mode(dst_file)
+        data_size = self._sync_send(src_file, dst_file)
+        self._release_sync()
+        time_cost = time.time() - time0
+        return "%d KB/s (%d bytes in %fs)" % (
+            int(data_size / 1000.0 / time_cost) if time_cost > 0 else 0,
+            data_size,
+            time_cost,
+        )
+
+    def push_files(self, device_id, file_list):
+        """在同一个sync:会话中上传多个文件
+
+        :param file_list: [(本地路径, 设备路径), ...]
+        :type  file_list: list
+        :return: 与file_list一一对应的错误信息列表，上传成功的文件对应空字符串
+        """
+        error_list = []
+        self._open_sync(device_id)
+        for src_file, dst_file in file_list:
+            try:
+                self._sync_send(src_file, dst_file)
+            except AdbError as e:
+                error_list.append("%s" % e)
+                self._open_sync(device_id)  # 出错后设备端会关闭会话，需要重新打开
             else:
-                raise e
+                error_list.append("")
+        self._release_sync()
+        return error_list
+
+    def pull_files(self, device_id, file_list):
+        """在同一个sync:会话中下载多个文件
+
+        :param file_list: [(设备路径, 本地路径), ...]
+        :type  file_list: list
+        :return: 与file_list一一对应的错误信息列表，下载成功的文件对应空字符串
+        """
+        error_list = []
+        self._open_sync(device_id)
+        for src_file, dst_file in file_list:
+            try:
+                self._sync_recv(src_file, dst_file)
+            except AdbError as e:
+                error_list.append("%s" % e)
+                self._open_sync(device_id)
+            else:
+                error_list.append("")
+        self._release_sync()
+        return error_list
+
+    def stat_files(self, device_id, path_list):
+        """在同一个sync:会话中获取多个文件的信息
+
+        :return: 与path_list一一对应的[(mode, size, time), ...]列表，文件不存在时mode为0
+        """
+        self._open_sync(device_id)
+        result = self._sync_stat_list(path_list)
+        self._release_sync()
+        return result
+
+    def list_tree(self, device_id, dir_path):
+        """在同一个sync:会话中递归枚举目录下的所有文件，每一层目录只需一次往返
+
+        :return: [(相对路径, mode, size, time), ...]
+        """
+        self._open_sync(device_id)
+        result = []
+        dir_list = [""]
+        while dir_list:
+            entry_lists = self._sync_list(
+                [dir_path.rstrip("/") + "/" + it for it in dir_list]
+            )
+            sub_dir_list = []
+            for parent, entry_list in zip(dir_list, entry_lists):
+                for name, mode, size, mtime in entry_list:
+                    path = parent + "/" + name if parent else name
+                    if stat.S_ISDIR(mode):
+                        sub_dir_list.append(path)
+                    else:
+                        result.append((path, mode, size, mtime))
+            dir_list = sub_dir_list
+        self._release_sync()
+        return result
+
+    def features(self, device_id):
+        """获取设备支持的特性列表，如shell_v2、cmd等
+        """
+        return self.send_command("host-serial:%s:features" % device_id)
+
+    def _read_shell_v2(self):
+        """读取shell v2协议的输出直到进程退出
+
+        :return: (exit_code, stdout, stderr)
+        """
+        stdout = []
+        stderr = []
+        while True:
+            packet_id, size = struct.unpack(b"<BI", self._recv(5))
+            data = self._recv(size) if size else b""
+            if packet_id == SHELL_ID_STDOUT:
+                stdout.append(data)
+            elif packet_id == SHELL_ID_STDERR:
+                stderr.append(data)
+            elif packet_id == SHELL_ID_EXIT:
+                exit_code = struct.unpack(b"B", data[:1])[0]
+                return exit_code, b"".join(stdout), b"".join(stderr)
+
+    def push_compressed(self, device_id, src_file, dst_file, decompress_cmd):
+        """流式压缩上传文件
+
+        后台线程按块进行gzip压缩，同时通过shell v2协议的stdin发送给设备端的解压命令，
+        由其写入目标文件，需要设备支持shell_v2特性
+
+        :param decompress_cmd: 设备端从stdin读取gzip数据并输出到stdout的解压命令，如gzip -d
+        :type  decompress_cmd: str
+        """
+        time0 = time.time()
+        st = os.stat(src_file)
+        dst_path = dst_file.replace('"', '\\"')
+        cmdline = '%s > "%s" && chmod %o "%s"' % (
+            decompress_cmd,
+            dst_path,
+            st.st_mode & 0o777,
+            dst_path,
+        )
         self._transport(device_id)
-        self._send_command("sync:")
-        dst_file = utf8_encode(dst_file)
-        mode, fsize, ftime = self._sync_read_mode(dst_file)
+        self._send_command("shell,v2,raw:" + cmdline)
 
-        s = b"%s,%d" % (dst_file, st.st_mode)
-        data = b"SEND" + struct.pack(b"I", len(s)) + s
-        self._sock.send(data)
-        with open(src_file, "rb") as fp:
-            data = fp.read(SYNC_DATA_MAX)
-            data_size = 0
-            while data:
-                send_data = b"DATA" + struct.pack(b"I", len(data)) + data
-                self._sock.send(send_data)
-                data_size += len(data)
-                data = fp.read(SYNC_DATA_MAX)
+        chunk_queue = six.moves.queue.Queue(8)
+        stop_event = threading.Event()
 
-        data = b"DONE" + struct.pack(b"I", int(st.st_mtime))
-        self._sock.send(data)
-        result = self._sock.recv(8)
-        if result[:4] == b"OKAY":
-            self._sock.close()
-            self._sock = None
-            time_cost = time.time() - time0
-            return "%d KB/s (%d bytes in %fs)" % (
-                int(data_size / 1000.0 / time_cost) if time_cost > 0 else 0,
-                data_size,
-                time_cost,
+        def _put(chunk):
+            while not stop_event.is_set():
+                try:
+                    chunk_queue.put(chunk, timeout=1)
+                    return
+                except six.moves.queue.Full:
+                    pass
+
+        def _compress_thread():
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+            try:
+                with open(src_file, "rb") as fp:
+                    data = fp.read(SYNC_DATA_MAX)
+                    while data and not stop_event.is_set():
+                        data = compressor.compress(data)
+                        if data:
+                            _put(data)
+                        data = fp.read(SYNC_DATA_MAX)
+                _put(compressor.flush())
+            except Exception as e:
+                _put(e)
+            else:
+                _put(None)
+
+        t = threading.Thread(target=_compress_thread, name="CompressThread")
+        t.daemon = True
+        t.start()
+        compressed_size = 0
+        try:
+            while True:
+                chunk = chunk_queue.get()
+                if chunk is None:
+                    break
+                elif isinstance(chunk, Exception):
+                    raise chunk
+                self._sock.sendall(
+                    struct.pack(b"<BI", SHELL_ID_STDIN, len(chunk)) + chunk
+                )
+                compressed_size += len(chunk)
+            self._sock.sendall(struct.pack(b"<BI", SHELL_ID_CLOSE_STDIN, 0))
+        except socket.error as e:
+            # 设备端命令提前退出时发送会失败，转为AdbError避免被当作连接错误反复重试
+            exit_code, output = -1, str(e)
+            try:
+                exit_code, stdout, stderr = self._read_shell_v2()
+                output = (stdout + stderr).decode("utf8", "replace") or output
+            except Exception:
+                pass
+            raise AdbError(
+                "Decompress %s failed(%d): %s" % (dst_file, exit_code, output)
             )
-        elif result[:4] == b"FAIL":
-            msg_len = struct.unpack(b"I", result[4:])[0]
-            error_msg = self._sock.recv(msg_len)
-            self._sock.close()
-            self._sock = None
-            raise AdbError(error_msg)
-        else:
-            self._sock.close()
-            self._sock = None
-            raise RuntimeError("Unexpect data: %r" % result)
+        finally:
+            stop_event.set()
+        exit_code, stdout, stderr = self._read_shell_v2()
+        self._sock.close()
+        self._sock = None
+        if exit_code != 0:
+            raise AdbError(
+                "Decompress %s failed(%d): %s"
+                % (dst_file, exit_code, (stdout + stderr).decode("utf8", "replace"))
+            )
+        time_cost = time.time() - time0
+        logger.info(
+            "push %s compressed %d => %d bytes" % (src_file, st.st_size, compressed_size)
+        )
+        return "%d KB/s (%d bytes in %fs)" % (
+            int(st.st_size / 1000.0 / time_cost) if time_cost > 0 else 0,
+            st.st_size,
+            time_cost,
+        )
 
     def install(self, device_id, apk_path, args="", **kwds):
         """adb install
@@ -528,6 +1441,118 @@ class ADBClient(object):
         result = self.shell(device_id, cmdline, **kwds)
         return result[0].decode("utf8")
 
+    def _exec_with_input(
+        self, device_id, cmdline, file_path=None, callback=None, timeout=None
+    ):
+        """通过exec:服务执行命令，并将文件内容写入命令的标准输入
+
+        :param callback: 每发送一块数据后的回调，参数为本次发送的字节数
+        :type  callback: function
+        :return: 命令的输出
+        """
+        self._transport(device_id)
+        self._send_command("exec:" + cmdline)
+        try:
+            self._sock.settimeout(timeout)
+            if file_path:
+                with open(file_path, "rb") as fp:
+                    data = fp.read(SYNC_DATA_MAX)
+                    while data:
+                        self._sock.sendall(data)
+                        if callback:
+                            callback(len(data))
+                        data = fp.read(SYNC_DATA_MAX)
+            return self._recv().decode("utf8", "replace").strip()
+        finally:
+            self._sock.close()
+            self._sock = None
+
+    def install_streamed(
+        self,
+        device_id,
+        apk_list,
+        args="",
+        use_cmd=True,
+        progress_callback=None,
+        timeout=None,
+    ):
+        """将APK数据直接写入设备端pm的标准输入进行安装，不需要先上传到设备中，需要Android 5.0以上
+
+        :param apk_list:          APK路径列表，包含多个APK时作为split APK在同一个会话中安装
+        :type  apk_list:          list
+        :param args:              安装参数，如-r
+        :type  args:              str
+        :param use_cmd:           是否使用cmd package代替pm，Android 7.0以上支持
+        :type  use_cmd:           bool
+        :param progress_callback: 进度回调，参数为(已发送字节数, 总字节数)
+        :type  progress_callback: function
+        :param timeout:           超时时间
+        :type  timeout:           float
+        :return: pm的输出
+        """
+        pm = "cmd package" if use_cmd else "pm"
+        args = args + " " if args else ""
+        size_list = [os.path.getsize(it) for it in apk_list]
+        total_size = sum(size_list)
+        progress = [0]
+
+        def _on_sent(size):
+            progress[0] += size
+            if progress_callback:
+                progress_callback(progress[0], total_size)
+
+        if len(apk_list) == 1 and use_cmd:
+            return self._exec_with_input(
+                device_id,
+                "%s install %s-S %d" % (pm, args, total_size),
+                apk_list[0],
+                _on_sent,
+                timeout,
+            )
+
+        # 低版本的pm install不支持从标准输入读取，与split APK一样使用安装会话
+        result = self._exec_with_input(
+            device_id,
+            "%s install-create %s-S %d" % (pm, args, total_size),
+            timeout=timeout,
+        )
+        ret = re.search(r"\[(\d+)\]", result)
+        if not ret:
+            return result
+        session_id = ret.group(1)
+        committed = False
+        try:
+            for index, apk_path in enumerate(apk_list):
+                result = self._exec_with_input(
+                    device_id,
+                    "%s install-write -S %d %s %d_%s -"
+                    % (
+                        pm,
+                        size_list[index],
+                        session_id,
+                        index,
+                        os.path.basename(apk_path).replace(" ", "_"),
+                    ),
+                    apk_path,
+                    _on_sent,
+                    timeout,
+                )
+                if "Success" not in result:
+                    return result
+            committed = True
+            return self._exec_with_input(
+                device_id, "%s install-commit %s" % (pm, session_id), timeout=timeout
+            )
+        finally:
+            if not committed:
+                try:
+                    self._exec_with_input(
+                        device_id, "%s install-abandon %s" % (pm, session_id)
+                    )
+                except Exception:
+                    # 连接断开时放弃会话同样会失败，不能掩盖原始异常
+                    logger.exception("abandon install session %s failed" % session_id)
+
     def uninstall(self, device_id, package_name, **kwds):
         """adb uninstall
         """
@@ -615,54 +1640,11 @@ class ADBClient(object):
         self._transport(device_id)
         self._send_command("framebuffer:")
 
-        fb_desc = self._sock.recv(13 * 4)
-        version = struct.unpack_from("I", fb_desc, 0)[0]
-        bpp = struct.unpack_from("I", fb_desc, 4)[0]
-        size = struct.unpack_from("I", fb_desc, 8)[0]
-        width = struct.unpack_from("I", fb_desc, 12)[0]
-        height = struct.unpack_from("I", fb_desc, 16)[0]
-        red_offset = struct.unpack_from("I", fb_desc, 20)[0]
-        red_length = struct.unpack_from("I", fb_desc, 24)[0]  # @UnusedVariable
-        blue_offset = struct.unpack_from("I", fb_desc, 28)[0]
-        blue_length = struct.unpack_from("I", fb_desc, 32)[0]  # @UnusedVariable
-        green_offset = struct.unpack_from("I", fb_desc, 36)[0]
-        green_length = struct.unpack_from("I", fb_desc, 40)[0]  # @UnusedVariable
-        alpha_offset = struct.unpack_from("I", fb_desc, 44)[0]
-        alpha_length = struct.unpack_from("I", fb_desc, 48)[0]
-
-        if version != 1:
-            raise AdbError("Unsupported version of framebuffer: %s" % version)
-        # detect order
-        util_map = {red_offset: "R", blue_offset: "B", green_offset: "G"}
-        keys = list(util_map.keys())
-        keys.sort()
-        raw_mode = "".join([util_map[it] for it in keys])
-
-        # detect mode
-        if alpha_length and alpha_offset:
-            mode = "RGBA"
-            if bpp != 32:
-                raise AdbError("Unsupported RGBA mode, bpp is %s" % bpp)
-            raw_mode += "A"
-
-        elif alpha_offset:
-            mode = "RGBX"
-            if bpp != 32:
-                raise AdbError("Unsupported RGBX mode, bpp is %s" % bpp)
-            raw_mode += "X"
-
-        else:
-            mode = "RGB"
-            if bpp == 16:
-                raw_mode += ";16"
-            elif bpp == 24:
-                pass
-            else:
-                raise AdbError("Unsupported RGB mode, bpp is %s" % bpp)
-
-        data = b""
-        while len(data) < size:
-            data += self._sock.recv(4096)
+        mode, raw_mode, size, width, height = parse_framebuffer_header(
+            self._recv(13 * 4)
+        )
+        data = bytearray(size)
+        self._recv_into(data)
         self._sock.close()
         self._sock = None
         return Image.frombuffer(mode, (width, height), data, "raw", raw_mode, 0, 1)
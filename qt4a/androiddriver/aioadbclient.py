@@ -0,0 +1,357 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""基于asyncio的ADB客户端，仅支持Python 3.5及以上版本
+"""
+
+import asyncio
+import os
+import struct
+import time
+
+from qt4a.androiddriver.adbclient import (
+    AdbError,
+    SYNC_DATA_MAX,
+    parse_framebuffer_header,
+)
+from qt4a.androiddriver.util import get_adb_server_port, utf8_encode
+
+
+class AsyncADBConnection(object):
+    """与ADB Server之间的一条异步连接
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @property
+    def reader(self):
+        return self._reader
+
+    @property
+    def writer(self):
+        return self._writer
+
+    async def send_command(self, cmd):
+        """发送命令并检查返回状态
+        """
+        if not isinstance(cmd, bytes):
+            cmd = cmd.encode("utf8")
+        self._writer.write(b"%04x%s" % (len(cmd), cmd))
+        await self.check_status()
+
+    async def check_status(self):
+        """检查返回状态
+        """
+        stat = await self.read(4)
+        if stat == b"OKAY":
+            return True
+        elif stat == b"FAIL":
+            size = int(await self.read(4), 16)
+            val = await self.read(size)
+            self.close()
+            raise AdbError(val.decode("utf8"))
+        else:
+            raise AdbError("Bad response: %r" % (stat,))
+
+    async def read(self, size):
+        """读取指定长度的数据
+        """
+        try:
+            return await self._reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise AdbError("connection closed")
+
+    async def read_all(self):
+        """读取数据直到连接关闭
+        """
+        return await self._reader.read()
+
+    async def write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def close(self):
+        self._writer.close()
+
+
+class AsyncShellStream(object):
+    """异步shell命令的输出流，支持async for逐行读取
+    """
+
+    def __init__(self, client, device_id, conn):
+        self._client = client
+        self._device_id = device_id
+        self._conn = conn
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._conn is None:
+            raise StopAsyncIteration
+        line = await self._conn.reader.readline()
+        if not line:
+            self.close()
+            raise StopAsyncIteration
+        return line
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def read(self):
+        """读取剩余的所有输出
+        """
+        if self._conn is None:
+            return b""
+        result = await self._conn.read_all()
+        self.close()
+        return result
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._client.release(self._device_id)
+
+
+class AsyncADBClient(object):
+    """基于asyncio的ADB客户端，与ADBClient使用相同的协议，返回结果也保持一致
+
+    同一设备的并发连接数受max_connections限制，多个设备之间可通过asyncio.gather并发执行
+    """
+
+    def __init__(self, server_addr="127.0.0.1", server_port=None, max_connections=8):
+        self._server_addr = server_addr
+        self._server_port = server_port or get_adb_server_port()
+        self._max_connections = max_connections
+        self._semaphores = {}
+
+    def _get_semaphore(self, serial):
+        if serial not in self._semaphores:
+            self._semaphores[serial] = asyncio.Semaphore(self._max_connections)
+        return self._semaphores[serial]
+
+    def release(self, serial):
+        """释放设备连接数配额
+        """
+        if serial:
+            self._get_semaphore(serial).release()
+
+    async def _connect(self, serial=None):
+        """建立与ADB Server的连接，指定设备时受该设备的并发连接数限制
+        """
+        if serial:
+            await self._get_semaphore(serial).acquire()
+        try:
+            reader, writer = await asyncio.open_connection(
+                self._server_addr, self._server_port
+            )
+        except Exception:
+            self.release(serial)
+            raise
+        return AsyncADBConnection(reader, writer)
+
+    async def _transport(self, device_id):
+        conn = await self._connect(device_id)
+        try:
+            await conn.send_command("host:transport:%s" % device_id)
+        except Exception:
+            conn.close()
+            self.release(device_id)
+            raise
+        return conn
+
+    async def send_command(self, cmd):
+        """发送host命令并读取带长度的返回数据
+        """
+        conn = await self._connect()
+        try:
+            await conn.send_command(cmd)
+            size = int(await conn.read(4), 16)
+            resp = await conn.read(size)
+        finally:
+            conn.close()
+        return resp.decode("utf8")
+
+    async def devices(self):
+        """adb devices
+        """
+        return await self.send_command("host:devices")
+
+    async def get_state(self, device_id):
+        """获取设备状态
+        """
+        return await self.send_command("host-serial:%s:get-state" % device_id)
+
+    async def features(self, device_id):
+        """获取设备支持的特性列表
+        """
+        return await self.send_command("host-serial:%s:features" % device_id)
+
+    async def shell(self, device_id, cmd, timeout=None):
+        """adb shell
+
+        :return: (stdout, stderr)，与ADBClient.shell一致
+        """
+        stream = await self.open_shell(device_id, cmd)
+        try:
+            stdout = await asyncio.wait_for(stream.read(), timeout)
+        finally:
+            stream.close()
+        return stdout, b""
+
+    async def open_shell(self, device_id, cmd):
+        """执行shell命令并返回输出流，可使用async for逐行读取
+
+        :rtype: AsyncShellStream
+        """
+        conn = await self._transport(device_id)
+        try:
+            await conn.send_command("shell:%s" % cmd)
+        except Exception:
+            conn.close()
+            self.release(device_id)
+            raise
+        return AsyncShellStream(self, device_id, conn)
+
+    async def _open_sync(self, device_id):
+        conn = await self._transport(device_id)
+        try:
+            await conn.send_command("sync:")
+        except Exception:
+            conn.close()
+            self.release(device_id)
+            raise
+        return conn
+
+    def _close_sync(self, device_id, conn):
+        conn.writer.write(b"QUIT\x00\x00\x00\x00")
+        conn.close()
+        self.release(device_id)
+
+    async def _sync_stat(self, conn, path):
+        path = utf8_encode(path)
+        await conn.write(b"STAT" + struct.pack(b"I", len(path)) + path)
+        data = await conn.read(16)
+        if data[:4] != b"STAT":
+            raise AdbError("sync_read_mode error")
+        return struct.unpack(b"III", data[4:])
+
+    async def stat(self, device_id, path):
+        """获取手机中文件的(mode, size, mtime)，文件不存在时mode为0
+        """
+        conn = await self._open_sync(device_id)
+        try:
+            return await self._sync_stat(conn, path)
+        finally:
+            self._close_sync(device_id, conn)
+
+    async def pull(self, device_id, src_file, dst_file):
+        """adb pull
+        """
+        time0 = time.time()
+        conn = await self._open_sync(device_id)
+        try:
+            mode, fsize, _ = await self._sync_stat(conn, src_file)
+            if fsize == 0:
+                return "0 KB/s (0 bytes in 0 s)"
+            if mode == 0:
+                raise AdbError("remote object %r does not exist" % src_file)
+            path = utf8_encode(src_file)
+            await conn.write(b"RECV" + struct.pack(b"I", len(path)) + path)
+            data_size = 0
+            with open(dst_file, "wb") as fp:
+                while True:
+                    header = await conn.read(8)
+                    packet_id = header[:4]
+                    psize = struct.unpack_from(b"I", header, 4)[0]
+                    if packet_id == b"DONE":
+                        break
+                    elif packet_id == b"FAIL":
+                        raise AdbError(
+                            (await conn.read(psize)).decode("utf8", "replace")
+                        )
+                    elif packet_id != b"DATA":
+                        raise AdbError("pull_file error")
+                    fp.write(await conn.read(psize))
+                    data_size += psize
+        finally:
+            self._close_sync(device_id, conn)
+        time_cost = time.time() - time0
+        if data_size > 0:
+            return "%d KB/s (%d bytes in %fs)" % (
+                int(data_size / 1000 / time_cost) if time_cost > 0 else 65535,
+                data_size,
+                time_cost,
+            )
+        return ""
+
+    async def push(self, device_id, src_file, dst_file):
+        """adb push
+        """
+        time0 = time.time()
+        if not os.path.exists(src_file):
+            raise AdbError("cannot stat '%s': No such file or directory" % src_file)
+        st = os.stat(src_file)
+        conn = await self._open_sync(device_id)
+        try:
+            s = b"%s,%d" % (utf8_encode(dst_file), st.st_mode)
+            conn.writer.write(b"SEND" + struct.pack(b"I", len(s)) + s)
+            data_size = 0
+            with open(src_file, "rb") as fp:
+                data = fp.read(SYNC_DATA_MAX)
+                while data:
+                    await conn.write(b"DATA" + struct.pack(b"I", len(data)) + data)
+                    data_size += len(data)
+                    data = fp.read(SYNC_DATA_MAX)
+            await conn.write(b"DONE" + struct.pack(b"I", int(st.st_mtime)))
+            result = await conn.read(8)
+            if result[:4] == b"FAIL":
+                msg_len = struct.unpack(b"I", result[4:])[0]
+                raise AdbError((await conn.read(msg_len)).decode("utf8", "replace"))
+            elif result[:4] != b"OKAY":
+                raise RuntimeError("Unexpect data: %r" % result)
+        finally:
+            self._close_sync(device_id, conn)
+        time_cost = time.time() - time0
+        return "%d KB/s (%d bytes in %fs)" % (
+            int(data_size / 1000.0 / time_cost) if time_cost > 0 else 0,
+            data_size,
+            time_cost,
+        )
+
+    async def snapshot_screen(self, device_id):
+        """截屏
+
+        return: Image.Image
+        """
+        from PIL import Image
+
+        conn = await self._transport(device_id)
+        try:
+            await conn.send_command("framebuffer:")
+            mode, raw_mode, size, width, height = parse_framebuffer_header(
+                await conn.read(13 * 4)
+            )
+            data = await conn.read(size)
+        finally:
+            conn.close()
+            self.release(device_id)
+        return Image.frombuffer(mode, (width, height), data, "raw", raw_mode, 0, 1)
@@ -27,6 +27,7 @@ import time
 from qt4a.androiddriver.adb import ADB
 from qt4a.androiddriver.clientsocket import DirectAndroidSpyClient
 from qt4a.androiddriver.devicedriver import DeviceDriver
+from qt4a.androiddriver.perfsampler import PerfSampler
 from qt4a.androiddriver.util import (
     AndroidPackage,
     AndroidSpyError,
@@ -98,6 +99,16 @@ def install_qt4a_helper(adb, root_path):
         adb.install_apk(apk_path)
 
 
+def _run_shell_batch(adb, cmd_list, root=False):
+    """批量执行命令，失败的命令只打印警告
+    """
+    for cmd_line, (output, exit_code) in zip(
+        cmd_list, adb.run_shell_batch(cmd_list, root)
+    ):
+        if exit_code != 0:
+            logger.warn("%s failed(%d): %s" % (cmd_line, exit_code, output))
+
+
 def copy_android_driver(device_id_or_adb, force=False, root_path=None, enable_acc=True):
     """测试前的测试桩拷贝
     """
@@ -127,15 +138,12 @@ def copy_android_driver(device_id_or_adb, force=False, root_path=None, enable_ac
     current_version = int(f.read())
     f.close()
 
-    if not force:
-        version_file = dst_path + "version.txt"
-        version = adb.run_shell_cmd("cat %s" % version_file)
-
-        if (
-            version
-            and "No such file or directory" not in version
-            and current_version <= int(version)
-        ):
+    version_file = dst_path + "version.txt"
+    version = adb.run_shell_cmd("cat %s" % version_file)
+    if not version or "No such file or directory" in version:
+        adb.invalidate_file_cache(dst_path)  # 测试桩目录可能已被清除，不能再信任本地缓存
+    elif not force:
+        if current_version <= int(version):
             install_qt4a_helper(adb, root_path)  # 避免QT4A助手被意外删除的情况
             # 不需要拷贝测试桩
             logger.warn("忽略本次测试桩拷贝：当前版本为%s，设备中版本为%s" % (current_version, int(version)))
@@ -177,9 +185,11 @@ def copy_android_driver(device_id_or_adb, force=False, root_path=None, enable_ac
     if rooted and adb.is_selinux_opened():
         # 此时如果还是开启状态说明关闭selinux没有生效,主要是三星手机上面
         adb.run_shell_cmd("rm -r %s" % dst_path, True)
+        adb.invalidate_file_cache(dst_path)
         # adb.run_shell_cmd('chcon u:object_r:shell_data_file:s0 %slibdexloader.so' % dst_path, True)  # 恢复文件context，否则拷贝失败
         # adb.run_shell_cmd('chcon u:object_r:shell_data_file:s0 %slibandroidhook.so' % dst_path, True)
 
+    push_list = []
     for file in file_list:
         file_path = os.path.join(root_path, file)
         # if use_pie and not "." in file and os.path.exists(file_path + "_pie"):
@@ -187,16 +197,21 @@ def copy_android_driver(device_id_or_adb, force=False, root_path=None, enable_ac
         if not os.path.exists(file_path):
             continue
         save_name = os.path.split(file)[-1]
-        adb.push_file(file_path, dst_path + save_name)
-
-    adb.chmod("%sdroid_inject" % dst_path, 755)
-    adb.chmod("%sinject" % dst_path, 755)
-    adb.chmod("%sscreenkit" % dst_path, 755)
-    adb.run_shell_cmd("ln -s %sscreenkit %sscreenshot" % (dst_path, dst_path))
+        push_list.append((file_path, dst_path + save_name))
+    pushed_list = adb.sync_files(push_list)  # 只拷贝与设备中不一致的文件
+    logger.info(
+        "%d of %d driver files pushed to device" % (len(pushed_list), len(push_list))
+    )
 
+    exec_file_list = ["droid_inject", "inject", "screenkit"]
     if cpu_abi in ("arm64-v8a", "x86_64"):
-        adb.chmod("%sdroid_inject64" % dst_path, 755)
-        adb.chmod("%sinject64" % dst_path, 755)
+        exec_file_list += ["droid_inject64", "inject64"]
+    cmd_list = ["chmod 755 %s%s" % (dst_path, it) for it in exec_file_list]
+    cmd_list.append(
+        "[ -e %sscreenshot ] || ln -s %sscreenkit %sscreenshot"
+        % (dst_path, dst_path, dst_path)
+    )
+    _run_shell_batch(adb, cmd_list, rooted)
 
     try:
         print(adb.run_shell_cmd("rm -R %scache" % dst_path, rooted))  # 删除目录 rm -rf
@@ -225,35 +240,24 @@ def copy_android_driver(device_id_or_adb, force=False, root_path=None, enable_ac
                 raise RuntimeError("get sdcard context failed: %s" % result)
             context = ret.group(1)
             logger.info("sdcard context is %s" % context)
-            adb.run_shell_cmd(
-                "chcon %s %s" % (context, dst_path), True
-            )  # make app access
-            adb.run_shell_cmd(
-                "chcon u:object_r:app_data_file:s0 %sSpyHelper.jar" % dst_path, True
-            )
-            adb.run_shell_cmd(
-                "chcon u:object_r:app_data_file:s0 %sSpyHelper.sh" % dst_path, True
-            )
-            # 不修改文件context无法加载so
-            adb.run_shell_cmd(
-                "chcon u:object_r:system_file:s0 %slibdexloader.so" % dst_path, True
-            )
-            adb.run_shell_cmd(
-                "chcon u:object_r:app_data_file:s0 %slibandroidhook.so" % dst_path, True
-            )
-            adb.run_shell_cmd("chcon %s %sAndroidSpy.jar" % (context, dst_path), True)
-            adb.run_shell_cmd("chcon %s %scache" % (context, dst_path), True)
+            cmd_list = [
+                "chcon %s %s" % (context, dst_path),  # make app access
+                "chcon u:object_r:app_data_file:s0 %sSpyHelper.jar" % dst_path,
+                "chcon u:object_r:app_data_file:s0 %sSpyHelper.sh" % dst_path,
+                # 不修改文件context无法加载so
+                "chcon u:object_r:system_file:s0 %slibdexloader.so" % dst_path,
+                "chcon u:object_r:app_data_file:s0 %slibandroidhook.so" % dst_path,
+                "chcon %s %sAndroidSpy.jar" % (context, dst_path),
+                "chcon %s %scache" % (context, dst_path),
+            ]
         else:
             # 不修改文件context无法加载so
-            adb.run_shell_cmd(
-                "chcon u:object_r:app_data_file:s0 %slibdexloader.so" % dst_path, True
-            )
-            adb.run_shell_cmd(
-                "chcon u:object_r:app_data_file:s0 %slibandroidhook.so" % dst_path, True
-            )
-            adb.run_shell_cmd(
-                "chcon u:object_r:app_data_file:s0 %scache" % dst_path, True
-            )
+            cmd_list = [
+                "chcon u:object_r:app_data_file:s0 %slibdexloader.so" % dst_path,
+                "chcon u:object_r:app_data_file:s0 %slibandroidhook.so" % dst_path,
+                "chcon u:object_r:app_data_file:s0 %scache" % dst_path,
+            ]
+        _run_shell_batch(adb, cmd_list, True)
 
     if rooted:
         if adb.get_sdk_version() < 24:
@@ -521,15 +525,10 @@ class AndroidDriver(object):
         :param max_t_cpu: 线程占用的CPU
         :type max_t_cpu:  int
         """
-        time0 = time.time()
-        while time.time() - time0 < timeout:
-            ret = self._adb.get_process_cpu(self._process_name)
-            if ret != None:
-                p_cpu, t_cpu = ret
-                logger.debug("current cpu: %d, %d" % (p_cpu, t_cpu))
-                if p_cpu < max_p_cpu and t_cpu < max_t_cpu:
-                    return
-            time.sleep(interval)
+        with PerfSampler(self._adb, [self._process_name], interval) as sampler:
+            sampler.wait_for_cpu_low(
+                self._process_name, max_p_cpu, max_t_cpu, timeout=timeout
+            )
 
     def close(self):
         """关闭连接
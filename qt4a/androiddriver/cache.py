@@ -0,0 +1,133 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""设备相关的本地缓存
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+
+from qt4a.androiddriver.util import logger, mkdir
+
+
+def get_cache_dir(create=True):
+    """获取本地缓存根目录
+    优先使用环境变量[QT4A_CACHE_PATH], 若不存在则使用[APPDATA] / [HOME]下的qt4a/cache目录
+
+    :param create: 目录不存在时是否创建
+    :type  create: bool
+    """
+    cache_dir = os.environ.get("QT4A_CACHE_PATH")
+    if not cache_dir:
+        root_dir = os.environ.get("APPDATA" if sys.platform == "win32" else "HOME")
+        cache_dir = os.path.join(root_dir or os.path.expanduser("~"), "qt4a", "cache")
+    if create:
+        mkdir(cache_dir)
+    return cache_dir
+
+
+class DeviceCache(object):
+    """以json文件保存在本地的设备缓存，每个设备的每类缓存对应一个文件
+    """
+
+    instance_dict = {}
+    instance_lock = threading.Lock()
+
+    def __init__(self, device_id, name):
+        self._device_id = device_id
+        self._name = name
+        self._lock = threading.Lock()
+        self._data = None
+
+    @staticmethod
+    def get_cache(device_id, name):
+        """获取设备缓存实例，同一设备的同类缓存在进程内共享
+
+        :param device_id: 设备序列号
+        :type  device_id: str
+        :param name:      缓存类型
+        :type  name:      str
+        """
+        key = (device_id, name)
+        with DeviceCache.instance_lock:
+            if key not in DeviceCache.instance_dict:
+                DeviceCache.instance_dict[key] = DeviceCache(device_id, name)
+            return DeviceCache.instance_dict[key]
+
+    def _get_file_path(self, create=True):
+        file_name = re.sub(r"[^\w\.\-]", "_", self._device_id) + ".json"
+        dir_path = os.path.join(get_cache_dir(create), self._name)
+        if create:
+            mkdir(dir_path)
+        return os.path.join(dir_path, file_name)
+
+    @property
+    def file_path(self):
+        """缓存文件路径
+        """
+        return self._get_file_path()
+
+    @property
+    def exists(self):
+        """缓存是否已加载或已保存在磁盘中，不会创建缓存目录
+        """
+        with self._lock:
+            return self._data is not None or os.path.exists(
+                self._get_file_path(False)
+            )
+
+    def _load(self):
+        if self._data is None:
+            self._data = {}
+            file_path = self.file_path
+            if os.path.exists(file_path):
+                try:
+                    with open(file_path, "r") as fp:
+                        self._data = json.load(fp)
+                except (IOError, ValueError):
+                    logger.exception("load cache %s failed" % file_path)
+        return self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._load().get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._load()[key] = value
+
+    def remove(self, key):
+        with self._lock:
+            self._load().pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+
+    def save(self):
+        """写入磁盘，先写临时文件再替换，避免并发读取到不完整的内容
+        """
+        with self._lock:
+            data = json.dumps(self._load())
+            file_path = self.file_path
+            tmp_path = "%s.%d.tmp" % (file_path, threading.current_thread().ident)
+            with open(tmp_path, "w") as fp:
+                fp.write(data)
+            if sys.platform == "win32" and os.path.exists(file_path):
+                os.remove(file_path)
+            os.rename(tmp_path, file_path)
@@ -0,0 +1,231 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""基于logcat日志流的crash检测
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import re
+import threading
+
+from qt4a.androiddriver.logcat import LogProcess, LogRecord, LogcatSubscription
+from qt4a.androiddriver.util import logger
+
+
+class EnumCrashKind(object):
+    """crash种类
+    """
+
+    JAVA = "java"
+    NATIVE = "native"
+    ANR = "anr"
+    CUSTOM = "custom"
+
+
+class CrashEvent(object):
+    """一次crash
+
+    records为crash相关的日志，同一线程后续相同tag的日志会继续追加；context为crash发生前的日志
+    """
+
+    def __init__(self, kind, process_name, record, context):
+        """
+        :param process_name: 日志内容中指定的进程名，为None时使用日志所属的进程
+        :type process_name:  string
+        """
+        self.kind = kind
+        self._process_name = process_name
+        self._process = record.process
+        self.records = [record]
+        self.context = context
+
+    @property
+    def process_name(self):
+        """发生crash的进程名，日志所属进程后续被重命名时同时生效
+        """
+        return self._process_name or self._process.name
+
+    @property
+    def pid(self):
+        return self.records[0].pid
+
+    @property
+    def tid(self):
+        return self.records[0].tid
+
+    @property
+    def lines(self):
+        """crash相关的日志行
+        """
+        return [it.format().decode("utf8") for it in self.records]
+
+    def __repr__(self):
+        return "<CrashEvent %s %s(%d)>" % (self.kind, self.process_name, self.pid)
+
+
+class _CrashRule(object):
+    def __init__(self, kind, tag, pattern, target_group=0):
+        self.kind = kind
+        self.tag = re.compile(tag)
+        self.pattern = re.compile(pattern)
+        self.target_group = target_group  # 进程名所在的分组，为0时使用日志所属的进程名
+
+
+class CrashDetector(object):
+    """在logcat日志流上实时检测Java crash、native crash与ANR
+
+    所有规则在创建时编译一次，并合并tag规则用于快速过滤；按线程维护状态，crash发生后同一线程中
+    相同tag的日志都属于该crash
+    """
+
+    builtin_rules = [
+        (EnumCrashKind.JAVA, r"AndroidRuntime", r"FATAL EXCEPTION:.*", 0),
+        (
+            EnumCrashKind.NATIVE,
+            r"DEBUG",
+            r"pid: \d+, tid: \d+, name: .*>>> (.*) <<<",
+            1,
+        ),
+        (EnumCrashKind.ANR, r"ActivityManager", r"ANR in (\S+)", 1),
+    ]
+
+    # AndroidTestBase保存的日志格式
+    line_pattern = re.compile(
+        r"\[(.*)\((\d+)\)\] \[(.*) (\S+)\] (.)/(.*)\((\d+)\): (.*)"
+    )
+
+    def __init__(self, patterns=None, context_lines=20, callback=None):
+        """
+        :param patterns:      自定义规则，(tag正则, 日志内容正则)列表
+        :type patterns:       list
+        :param context_lines: crash发生前保留的日志行数
+        :type context_lines:  int
+        :param callback:      检测到crash时的回调，参数为CrashEvent
+        :type callback:       function
+        """
+        self._rules = [_CrashRule(*it) for it in self.builtin_rules]
+        for tag, pattern in patterns or []:
+            self._rules.append(_CrashRule(EnumCrashKind.CUSTOM, tag, pattern))
+        self._tag_filter = re.compile(
+            "|".join("(?:%s)" % it.tag.pattern for it in self._rules)
+        )
+        self._context = collections.deque(maxlen=context_lines)
+        self._active = {}  # tid => (CrashEvent, tag)
+        self._events = []
+        self._lock = threading.Lock()
+        self._callback = callback
+        self._subscription = None
+
+    def feed(self, record):
+        """输入一条日志
+
+        :param record: 日志
+        :type record:  LogRecord
+        """
+        with self._lock:
+            self._feed(record)
+
+    def _feed(self, record):
+        state = self._active.get(record.tid)
+        if state:
+            if state[1] == record.tag:
+                state[0].records.append(record)
+                return
+            self._active.pop(record.tid)
+        if self._tag_filter.match(record.tag):
+            for rule in self._rules:
+                if not rule.tag.match(record.tag):
+                    continue
+                ret = rule.pattern.match(record.message)
+                if not ret:
+                    continue
+                process_name = (
+                    ret.group(rule.target_group) if rule.target_group else None
+                )
+                event = CrashEvent(
+                    rule.kind, process_name, record, list(self._context)
+                )
+                self._active[record.tid] = (event, record.tag)
+                self._events.append(event)
+                if self._callback:
+                    try:
+                        self._callback(event)
+                    except:
+                        logger.exception("crash callback %r failed" % self._callback)
+                break
+        self._context.append(record)
+
+    def feed_line(self, line):
+        """输入一行格式化后的日志，用于检测已保存的日志
+        """
+        if isinstance(line, bytes):
+            line = line.decode("utf8", "replace")
+        ret = self.line_pattern.match(line)
+        if not ret:
+            logger.warn("提取crash日志时，log:%s无法解析" % line)
+            return
+        self.feed(
+            LogRecord(
+                0,
+                LogProcess(int(ret.group(2)), ret.group(1)),
+                ret.group(3),
+                ret.group(4),
+                ret.group(5),
+                ret.group(6),
+                int(ret.group(7)),
+                ret.group(8),
+            )
+        )
+
+    def get_events(self, process_list=None):
+        """获取检测到的crash
+
+        :param process_list: 关心的进程名正则列表，为None时返回所有crash
+        :type process_list:  list
+        :rtype: list
+        """
+        with self._lock:
+            events = list(self._events)
+        if process_list is None:
+            return events
+        pattern_list = [re.compile(it) for it in process_list]
+        return [
+            event
+            for event in events
+            if any(it.match(event.process_name) for it in pattern_list)
+        ]
+
+    def attach(self, adb):
+        """订阅设备的logcat日志，日志在订阅自身的线程中处理，处理不及时丢弃最旧的日志，
+        不会阻塞logcat读取线程
+        """
+        self._subscription = adb.subscribe_logcat(
+            self.feed, max_size=100000, policy=LogcatSubscription.POLICY_DROP_OLDEST
+        )
+
+    def detach(self, adb, timeout=10):
+        """取消订阅，并等待已收到的日志处理完成
+        """
+        if self._subscription:
+            adb.unsubscribe_logcat(self._subscription)
+            self._subscription.join(timeout)
+            if self._subscription.dropped:
+                logger.warn(
+                    "[CrashDetector] %d log records dropped"
+                    % self._subscription.dropped
+                )
+            self._subscription = None
@@ -25,6 +25,7 @@ import traceback
 import six
 from qt4a.androiddriver.adb import ADB
 from qt4a.androiddriver.clientsocket import DirectAndroidSpyClient
+from qt4a.androiddriver.perfsampler import PerfSampler
 from qt4a.androiddriver.util import (
     SocketError,
     TimeoutError,
@@ -69,7 +70,7 @@ class DeviceDriver(object):
         """获取设备ID
         """
         if not self._device_id:
-            self._device_id = self.adb.run_shell_cmd("getprop ro.serialno")
+            self._device_id = self.adb.get_property("ro.serialno")
         return self._device_id
 
     def run_driver_cmd(self, cmd, *args, **kwargs):
@@ -148,11 +149,16 @@ class DeviceDriver(object):
         if not os.path.exists(pkg_path):
             raise RuntimeError("APK: %r not exist" % pkg_path)
 
+        if self.adb.is_apk_installed(pkg_path):
+            logger.info("APP %s is installed" % pkg_path)
+            return True
+
         pkg_size = os.path.getsize(pkg_path)
         pkg_md5 = get_file_md5(pkg_path)
         pkg_name = ADB._get_package_name(pkg_path)
         if self.is_package_installed(pkg_name, pkg_size, pkg_md5):
             logger.info("APP %s [%d]%s is installed" % (pkg_name, pkg_size, pkg_md5))
+            self.adb.record_installed_apk(pkg_path)
             return True
 
         self.adb.install_apk(pkg_path, overwrite)
@@ -581,16 +587,8 @@ class DeviceDriver(object):
         :param timeout:  超时时间，超市时间到后，无论当前CPU使用率是多少，都会返回
         :type  timeout:  int
         """
-        time0 = time.time()
-        time1 = time0
-        while time.time() - time0 < timeout:
-            cpu_usage = self._adb.get_cpu_usage()
-            # print (cpu_usage)
-            if cpu_usage > usage:
-                time1 = time.time()
-            if time.time() - time1 > duration:
-                break
-            time.sleep(1)
+        with PerfSampler(self._adb, interval=1) as sampler:
+            sampler.wait_for_system_cpu_low(usage, duration, timeout)
 
     def connect_wifi(self, wifi_name, wifi_pass=""):
         """连接指定的Wifi
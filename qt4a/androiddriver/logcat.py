@@ -0,0 +1,1134 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""logcat日志存储
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+import collections
+import gzip
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+import six
+
+from qt4a.androiddriver.util import enforce_utf8_decode, logger, ThreadEx
+
+# logcat -v threadtime格式：Date Time PID TID Level Tag Content
+# 会过滤掉只有内容和内容为空的情况：--------- beginning of /dev/log/main not match pattern；04-16 10:09:25.170  2183  2183 D AndroidRuntime:
+threadtime_pattern = re.compile(
+    r"([\d|-]+)\s+([\d|:|\.]+)\s+(\d+)\s+(\d+)\s+(\w)\s+(.*?)\s*:\s*(.*)"
+)
+
+LOG_LEVELS = "??VDIWEFS"  # 按android_LogPriority取值索引
+BINARY_LOG_IDS = (2, 5, 6)  # events/stats/security缓冲区的内容为二进制格式
+
+# logger_entry头部：len, hdr_size, pid, tid, sec, nsec，v1~v4相同；v3及以上偏移20处为lid
+_entry_header = struct.Struct(b"<HHiIII")
+_entry_lid = struct.Struct(b"<I")
+_entry_levels = dict(
+    (struct.pack(b"B", i), level) for i, level in enumerate(LOG_LEVELS)
+)
+_milliseconds = [".%03d" % i for i in range(1000)]
+
+
+def decode_log_content(content):
+    """将日志内容统一解码为unicode，依次尝试utf8和gbk，都失败时使用repr
+    """
+    if isinstance(content, bytes):
+        for code in ("utf8", "gbk"):
+            try:
+                return content.decode(code)
+            except UnicodeDecodeError:
+                pass
+        return repr(content)
+    return content
+
+
+class LogProcess(object):
+    """日志所属的进程，同一进程ID的不同进程实例对应不同的对象
+    """
+
+    __slots__ = ("pid", "name", "dropped")
+
+    def __init__(self, pid, name):
+        self.pid = pid
+        self.name = name
+        self.dropped = False
+
+    @property
+    def label(self):
+        if self.pid:
+            return "%s(%d)" % (self.name, self.pid)
+        return self.name
+
+
+class LogRecord(object):
+    """一条logcat日志
+    """
+
+    __slots__ = (
+        "seq",
+        "process",
+        "date",
+        "timestamp",
+        "level",
+        "tag",
+        "tid",
+        "message",
+    )
+
+    def __init__(self, seq, process, date, timestamp, level, tag, tid, message):
+        self.seq = seq
+        self.process = process
+        self.date = date
+        self.timestamp = timestamp
+        self.level = level
+        self.tag = tag
+        self.tid = tid
+        self.message = message
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def process_name(self):
+        return self.process.name
+
+    def format(self):
+        """格式化为utf8编码的日志行
+        """
+        return (
+            "[%s] [%s %s] %s/%s(%d): %s"
+            % (
+                self.process.label,
+                self.date,
+                self.timestamp,
+                self.level,
+                self.tag,
+                self.tid,
+                self.message,
+            )
+        ).encode("utf8")
+
+
+class _Segment(object):
+    """日志段，同时维护段内按tag、级别、进程的倒排索引
+    """
+
+    __slots__ = (
+        "records",
+        "last_time",
+        "first_seq",
+        "_max_time",
+        "_time_count",
+        "tags",
+        "levels",
+        "processes",
+        "persisted",
+    )
+
+    def __init__(self, first_seq):
+        self.records = []
+        self.last_time = 0
+        self.first_seq = first_seq
+        self._max_time = ""
+        self._time_count = 0
+        self.tags = {}
+        self.levels = {}
+        self.processes = {}
+        self.persisted = False  # 是否已写入磁盘
+
+    def append(self, record):
+        offset = len(self.records)
+        self.records.append(record)
+        self.tags.setdefault(record.tag, []).append(offset)
+        self.levels.setdefault(record.level, []).append(offset)
+        self.processes.setdefault(record.process, []).append(offset)
+
+    def get_max_time(self):
+        """段内最大的日志时间，格式同LogcatStore.query的start_time，只在查询时增量计算
+        """
+        for record in self.records[self._time_count :]:
+            log_time = "%s %s" % (record.date, record.timestamp)
+            if log_time > self._max_time:
+                self._max_time = log_time
+        self._time_count = len(self.records)
+        return self._max_time
+
+    def get_start_time(self):
+        record = self.records[0]
+        return "%s %s" % (record.date, record.timestamp)
+
+    def overlaps(self, start_time, end_time):
+        """判断段内日志时间是否与指定时间范围有交集
+        """
+        if start_time and self.get_max_time() < start_time:
+            return False
+        if end_time and self.get_start_time() > end_time:
+            return False
+        return True
+
+
+class LogcatSegmentWriter(object):
+    """将日志段写入滚动的压缩文件
+
+    每个日志段压缩为一个独立的gzip member或zstd frame追加到当前文件，文件行数超过max_file_lines时
+    切换到新文件；同时记录每个文件的起止时间，导出时按时间范围选择文件，压缩格式相同时直接拼接
+    """
+
+    max_file_lines = 200000
+    suffixes = {"gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self, directory=None, compress="gzip"):
+        """
+        :param directory: 日志文件目录，第一次写入时创建；为None时第一次写入时创建临时目录，
+                          清空或对象销毁时删除
+        :type directory:  string
+        :param compress:  压缩格式，gzip或zstd，zstd需要安装zstandard
+        :type compress:   string
+        """
+        if compress not in self.suffixes:
+            raise ValueError("Invalid compress format: %s" % compress)
+        if compress == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                logger.warn(
+                    "[LogcatSegmentWriter] zstandard not installed, use gzip"
+                )
+                compress = "gzip"
+        self._directory = directory
+        self._temp_dir = directory is None
+        self._compress = compress
+        self._files = []  # [文件路径, 开始时间, 结束时间, 行数]
+        self._file_index = 0
+        self._line_count = 0
+
+    @property
+    def line_count(self):
+        return self._line_count
+
+    @property
+    def suffix(self):
+        return self.suffixes[self._compress]
+
+    def compress(self, data):
+        """将数据压缩为一个独立的gzip member或zstd frame
+        """
+        if self._compress == "zstd":
+            import zstandard
+
+            return zstandard.ZstdCompressor().compress(data)
+        buff = six.BytesIO()
+        with gzip.GzipFile(fileobj=buff, mode="wb") as fp:
+            fp.write(data)
+        return buff.getvalue()
+
+    def _open_reader(self, fp):
+        if self._compress == "zstd":
+            import zstandard
+
+            return zstandard.ZstdDecompressor().stream_reader(
+                fp, read_across_frames=True
+            )
+        return gzip.GzipFile(fileobj=fp, mode="rb")
+
+    def write(self, lines, start_time, end_time):
+        """写入一个日志段
+
+        :param lines:      日志行列表
+        :type lines:       list
+        :param start_time: 段内第一条日志的时间
+        :type start_time:  string
+        :param end_time:   段内最大的日志时间
+        :type end_time:    string
+        """
+        if not lines:
+            return
+        if not self._files or self._files[-1][3] >= self.max_file_lines:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp("", "qt4a_logcat_")
+            elif not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            self._file_index += 1
+            path = os.path.join(
+                self._directory, "logcat_%04d.log%s" % (self._file_index, self.suffix)
+            )
+            self._files.append([path, start_time, end_time, 0])
+        entry = self._files[-1]
+        with open(entry[0], "ab") as fp:
+            fp.write(self.compress(b"\n".join(lines) + b"\n"))
+        entry[2] = max(entry[2], end_time)
+        entry[3] += len(lines)
+        self._line_count += len(lines)
+
+    def get_files(self, start_time=None, end_time=None):
+        """获取与时间范围有交集的日志文件
+
+        :rtype: list
+        """
+        return [
+            it[0]
+            for it in self._files
+            if (not start_time or it[2] >= start_time)
+            and (not end_time or it[1] <= end_time)
+        ]
+
+    def iter_lines(self):
+        """按顺序读取所有日志行
+
+        :rtype: generator
+        """
+        for path in self.get_files():
+            with open(path, "rb") as fp:
+                reader = self._open_reader(fp)
+                remain = b""
+                while True:
+                    data = reader.read(65536)
+                    if not data:
+                        break
+                    lines = (remain + data).split(b"\n")
+                    remain = lines.pop()
+                    for line in lines:
+                        yield line
+                if remain:
+                    yield remain
+
+    def export(self, fp, compressed=False, start_time=None, end_time=None):
+        """导出日志文件内容
+
+        :param fp:         导出的目标文件
+        :type fp:          file
+        :param compressed: 为True时直接拼接压缩后的数据，否则解压后写入
+        :type compressed:  bool
+        """
+        for path in self.get_files(start_time, end_time):
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src if compressed else self._open_reader(src), fp)
+
+    def clear(self):
+        """删除所有日志文件
+        """
+        for it in self._files:
+            if os.path.exists(it[0]):
+                os.remove(it[0])
+        self._files = []
+        self._line_count = 0
+        if self._directory is None:
+            return
+        if os.path.isdir(self._directory) and not os.listdir(self._directory):
+            os.rmdir(self._directory)
+        if self._temp_dir:
+            self._directory = None
+
+    def __del__(self):
+        if self._temp_dir and self._directory:
+            try:
+                shutil.rmtree(self._directory, True)
+            except Exception:
+                pass  # 解释器退出时模块可能已被清理
+
+
+class LogcatStore(object):
+    """有界的logcat日志存储
+
+    日志按段保存，超出行数或时间限制时整段淘汰；指定segment_dir时写满的段会压缩写入磁盘，
+    读取和保存时仍能获取完整日志。进程名保存在进程对象中，进程改名只需修改一处。
+    """
+
+    segment_size = 4096
+
+    # 最近写满的段延迟写入磁盘，使进程被过滤时能够丢弃其日志
+    pending_segments = 2
+
+    def __init__(
+        self, max_lines=None, max_age=None, segment_dir=None, compress="gzip"
+    ):
+        """
+        :param max_lines: 内存中保留的最大行数，为None时不限制
+        :type max_lines:  int
+        :param max_age:   内存中日志的最长保留时间（秒），为None时不限制
+        :type max_age:    int/float
+        :param segment_dir: 日志段的落盘目录，为True时第一次落盘时创建临时目录，为None时被淘汰的日志直接丢弃
+        :type segment_dir:  string/bool
+        :param compress:    落盘文件的压缩格式，见LogcatSegmentWriter
+        :type compress:     string
+        """
+        self._max_lines = max_lines
+        self._max_age = max_age
+        self._writer = None
+        if segment_dir:
+            self._writer = LogcatSegmentWriter(
+                None if segment_dir is True else segment_dir, compress
+            )
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self._segments = []
+        self._line_count = 0
+        self._seq = 0
+        self._processes = {}
+        self._strings = {}
+        self._evicted_lines = 0
+
+    def __len__(self):
+        with self._lock:
+            if not self._writer:
+                return self._line_count
+            return self._writer.line_count + sum(
+                len(it.records) for it in self._segments if not it.persisted
+            )
+
+    @property
+    def spilled_lines(self):
+        """已落盘的行数
+        """
+        return self._writer.line_count if self._writer else 0
+
+    @property
+    def evicted_lines(self):
+        """已丢弃的行数
+        """
+        return self._evicted_lines
+
+    @property
+    def cursor(self):
+        """最后一条日志的序号，可作为query和wait_for_log的since参数
+        """
+        return self._seq
+
+    def _intern(self, s):
+        return self._strings.setdefault(s, s)
+
+    def get_process(self, pid):
+        """获取进程ID当前对应的进程对象
+
+        :rtype: LogProcess
+        """
+        return self._processes.get(pid)
+
+    def _get_process(self, pid, name):
+        key = pid or name
+        process = self._processes.get(key)
+        if process is None or process.name != name:
+            # 进程ID被复用时创建新的进程实例，不影响之前的日志
+            process = LogProcess(pid, name)
+            self._processes[key] = process
+        return process
+
+    def rename_process(self, process, name):
+        """修改进程名，之前记录的该进程日志同时生效
+        """
+        with self._lock:
+            process.name = name
+
+    def drop_process(self, process):
+        """丢弃进程的所有日志
+        """
+        with self._lock:
+            process.dropped = True
+            key = process.pid or process.name
+            if self._processes.get(key) is process:
+                self._processes.pop(key)
+
+    def append(self, pid, process_name, date, timestamp, level, tag, tid, message):
+        """追加一条日志
+
+        :rtype: LogRecord
+        """
+        with self._lock:
+            self._seq += 1
+            record = LogRecord(
+                self._seq,
+                self._get_process(pid, process_name),
+                self._intern(date),
+                timestamp,
+                self._intern(level),
+                self._intern(tag),
+                tid,
+                decode_log_content(message),
+            )
+            if (
+                not self._segments
+                or len(self._segments[-1].records) >= self.segment_size
+            ):
+                self._segments.append(_Segment(self._seq))
+                if self._writer:
+                    self._persist(self.pending_segments)
+            segment = self._segments[-1]
+            segment.append(record)
+            segment.last_time = time.time()
+            self._line_count += 1
+            self._evict()
+            self._appended.notify_all()
+        return record
+
+    def _evict(self):
+        expire_time = time.time() - self._max_age if self._max_age else 0
+        while len(self._segments) > 1:
+            segment = self._segments[0]
+            if not (
+                segment.last_time < expire_time
+                or (
+                    self._max_lines
+                    and self._line_count - len(segment.records) >= self._max_lines
+                )
+            ):
+                break
+            if self._writer:
+                self._persist_segment(segment)
+            else:
+                self._evicted_lines += len(segment.records)
+            self._segments.pop(0)
+            self._line_count -= len(segment.records)
+
+    def _persist_segment(self, segment):
+        if segment.persisted:
+            return
+        self._writer.write(
+            list(self._iter_segment_lines(segment)),
+            segment.get_start_time(),
+            segment.get_max_time(),
+        )
+        segment.persisted = True
+
+    def _persist(self, keep):
+        """将除最后keep个段之外的段写入磁盘
+        """
+        for segment in self._segments[: max(len(self._segments) - keep, 0)]:
+            self._persist_segment(segment)
+
+    def _iter_segment_lines(self, segment):
+        for record in segment.records:
+            if not record.process.dropped:
+                yield record.format()
+
+    def records(self):
+        """获取内存中的日志记录
+
+        :rtype: list
+        """
+        with self._lock:
+            result = []
+            for segment in self._segments:
+                for record in segment.records:
+                    if not record.process.dropped:
+                        result.append(record)
+            return result
+
+    def query(
+        self,
+        tag=None,
+        level=None,
+        pid=None,
+        process_name=None,
+        pattern=None,
+        since=0,
+        start_time=None,
+        limit=None,
+        reverse=False,
+    ):
+        """查询内存中满足条件的日志，已落盘的日志不参与查询
+
+        :param tag:          tag或tag列表
+        :type tag:           string/list
+        :param level:        最低日志级别
+        :type level:         string
+        :param pid:          进程ID或进程ID列表
+        :type pid:           int/list
+        :param process_name: 进程名需要匹配的正则
+        :type process_name:  string
+        :param pattern:      日志内容需要匹配的正则
+        :type pattern:       string/re.Pattern
+        :param since:        只返回序号大于该值的日志，一般为之前获取的cursor
+        :type since:         int
+        :param start_time:   只返回不早于该时间的日志，格式为：2021-01-01 10:59:42.899
+        :type start_time:    string
+        :param limit:        最多返回的条数，为None时不限制
+        :type limit:         int
+        :param reverse:      是否从最新的日志开始查找
+        :type reverse:       bool
+        :rtype: list
+        """
+        query = _LogQuery(tag, level, pid, process_name, pattern, start_time)
+        with self._lock:
+            return self._query(query, since, limit, reverse)
+
+    def _query(self, query, since, limit, reverse):
+        result = []
+        segments = self._segments
+        if since:
+            index = bisect.bisect_right([it.first_seq for it in segments], since)
+            segments = segments[max(index - 1, 0) :]
+        if reverse:
+            segments = reversed(segments)
+        for segment in segments:
+            for record in query.search(segment, since, reverse):
+                result.append(record)
+                if limit and len(result) >= limit:
+                    return result
+        return result
+
+    def wait_for_log(
+        self,
+        tag=None,
+        level=None,
+        pid=None,
+        process_name=None,
+        pattern=None,
+        since=None,
+        timeout=10,
+    ):
+        """等待满足条件的日志出现，有新日志写入时才会重新查询新增部分
+
+        :param since:   从该序号之后开始查找，为None时只等待新写入的日志
+        :type since:    int
+        :param timeout: 超时时间（秒）
+        :type timeout:  int/float
+        :return: 找到的第一条日志，超时返回None
+        :rtype:  LogRecord
+        """
+        query = _LogQuery(tag, level, pid, process_name, pattern)
+        time0 = time.time()
+        with self._lock:
+            if since is None:
+                since = self._seq
+            while True:
+                result = self._query(query, since, 1, False)
+                if result:
+                    return result[0]
+                since = self._seq
+                timeout_left = time0 + timeout - time.time()
+                if timeout_left <= 0:
+                    return None
+                self._appended.wait(timeout_left)
+
+    def get_lines(self):
+        """获取所有日志行，包括已落盘的部分
+
+        :rtype: list
+        """
+        with self._lock:
+            result = []
+            if self._writer:
+                result.extend(self._writer.iter_lines())
+            for segment in self._segments:
+                if not segment.persisted:
+                    result.extend(self._iter_segment_lines(segment))
+            return result
+
+    def save(self, save_path, start_time=None, end_time=None):
+        """导出日志到文件，已落盘的部分直接拷贝，文件后缀与压缩格式一致时保存为压缩文件
+
+        :param save_path:  保存路径
+        :type save_path:   string
+        :param start_time: 只导出包含该时间之后日志的段，格式同query
+        :type start_time:  string
+        :param end_time:   只导出包含该时间之前日志的段
+        :type end_time:    string
+        """
+        with self._lock:
+            compressed = self._writer and save_path.endswith(self._writer.suffix)
+            lines = []
+            for segment in self._segments:
+                if not segment.persisted and segment.overlaps(start_time, end_time):
+                    lines.extend(self._iter_segment_lines(segment))
+            with open(save_path, "wb") as fp:
+                if self._writer:
+                    self._writer.export(fp, compressed, start_time, end_time)
+                if compressed:
+                    if lines:
+                        fp.write(self._writer.compress(b"\n".join(lines) + b"\n"))
+                    return
+                for line in lines:
+                    fp.write(line + b"\n")
+                if fp.tell():
+                    # 去掉末尾的换行
+                    fp.seek(-1, os.SEEK_END)
+                    fp.truncate()
+
+    def clear(self):
+        """清空所有日志
+        """
+        with self._lock:
+            self._segments = []
+            self._line_count = 0
+            self._strings = {}
+            self._evicted_lines = 0
+            if self._writer:
+                self._writer.clear()
+
+
+class _LogQuery(object):
+    """编译后的查询条件，在日志段上优先使用最小的倒排索引获取候选日志
+    """
+
+    def __init__(
+        self,
+        tag=None,
+        level=None,
+        pid=None,
+        process_name=None,
+        pattern=None,
+        start_time=None,
+    ):
+        self.tags = None
+        if tag:
+            self.tags = set([tag] if isinstance(tag, six.string_types) else tag)
+        self.levels = None
+        if level:
+            self.levels = set(LOG_LEVELS[LOG_LEVELS.index(level) : -1])
+        self.pids = None
+        if pid:
+            self.pids = set([pid] if isinstance(pid, six.integer_types) else pid)
+        self.process_name = None
+        if process_name:
+            self.process_name = re.compile(process_name)
+        self.pattern = None
+        if pattern:
+            if isinstance(pattern, six.string_types):
+                pattern = re.compile(pattern)
+            self.pattern = pattern
+        self.start_time = start_time
+
+    def _match_processes(self, segment):
+        processes = set()
+        for process in segment.processes:
+            if process.dropped:
+                continue
+            if self.pids is not None and process.pid not in self.pids:
+                continue
+            if self.process_name and not self.process_name.match(process.name):
+                continue
+            processes.add(process)
+        return processes
+
+    def _get_candidates(self, segment, processes):
+        """返回候选日志在段内的偏移，为None时需要扫描整段
+        """
+        candidates = None
+        for keys, index in (
+            (self.tags, segment.tags),
+            (self.levels, segment.levels),
+            (processes, segment.processes),
+        ):
+            if keys is None:
+                continue
+            offsets = []
+            for key in keys:
+                offsets.extend(index.get(key, ()))
+            if candidates is None or len(offsets) < len(candidates):
+                candidates = offsets
+                if not candidates:
+                    break
+        if candidates is not None:
+            candidates.sort()
+        return candidates
+
+    def search(self, segment, since=0, reverse=False):
+        """在日志段中查找满足条件的日志
+
+        :rtype: generator
+        """
+        if self.start_time and segment.get_max_time() < self.start_time:
+            return
+        processes = None
+        if self.pids is not None or self.process_name:
+            processes = self._match_processes(segment)
+        candidates = self._get_candidates(segment, processes)
+        records = segment.records
+        start = max(since - segment.first_seq + 1, 0)
+        if candidates is None:
+            candidates = range(start, len(records))
+        elif start:
+            candidates = candidates[bisect.bisect_left(candidates, start) :]
+        if reverse:
+            candidates = reversed(candidates)
+        for offset in candidates:
+            record = records[offset]
+            if record.process.dropped:
+                continue
+            if self.tags is not None and record.tag not in self.tags:
+                continue
+            if self.levels is not None and record.level not in self.levels:
+                continue
+            if processes is not None and record.process not in processes:
+                continue
+            if self.pattern and not self.pattern.search(record.message):
+                continue
+            if (
+                self.start_time
+                and "%s %s" % (record.date, record.timestamp) < self.start_time
+            ):
+                continue
+            yield record
+
+
+class LogcatBinaryParser(object):
+    """解析`logcat -B`输出的logger_entry记录，支持v1~v4格式
+
+    v1头部为20字节，hdr_size字段为0；v2~v4头部大小由hdr_size字段指定，
+    v3及以上在偏移20处为缓冲区ID(lid)。多行日志会拆分为多条，与文本格式的输出保持一致
+    """
+
+    max_hdr_size = 100
+
+    def __init__(self, utc_offset=0):
+        """
+        :param utc_offset: 设备时区相对UTC的偏移（秒）
+        :type utc_offset:  int
+        """
+        self._buffer = b""
+        self._utc_offset = utc_offset
+        self._last_sec = None
+        self._last_time = None
+        self._tags = {}
+
+    def reset(self):
+        """丢弃未解析完的数据
+        """
+        self._buffer = b""
+
+    def _update_time(self, sec):
+        tm = time.gmtime(sec + self._utc_offset)
+        self._last_time = (
+            tm.tm_year,
+            "%02d-%02d" % (tm.tm_mon, tm.tm_mday),
+            "%02d:%02d:%02d" % (tm.tm_hour, tm.tm_min, tm.tm_sec),
+        )
+        self._last_sec = sec
+
+    def feed(self, data):
+        """输入数据，返回其中完整的日志记录
+
+        :param data: logcat -B的输出
+        :type data:  bytes
+        :return: [(year, month_day, timestamp, pid, tid, level, tag, message), ...]
+        :rtype:  list
+        """
+        if self._buffer:
+            data = self._buffer + data
+        size = len(data)
+        offset = 0
+        result = []
+        append = result.append
+        header_unpack = _entry_header.unpack_from
+        lid_unpack = _entry_lid.unpack_from
+        max_hdr_size = self.max_hdr_size
+        levels = _entry_levels
+        tags = self._tags
+        milliseconds = _milliseconds
+        binary_ids = BINARY_LOG_IDS
+        while size - offset >= 20:
+            payload_len, hdr_size, pid, tid, sec, nsec = header_unpack(data, offset)
+            if hdr_size == 0:
+                hdr_size = 20
+            elif hdr_size < 20 or hdr_size > max_hdr_size:
+                self.reset()
+                raise ValueError("Invalid logger_entry header size: %d" % hdr_size)
+            start = offset + hdr_size
+            end = start + payload_len
+            if end > size:
+                break
+            offset = end
+            if payload_len < 2:
+                continue
+            if hdr_size >= 24:
+                lid = lid_unpack(data, start - hdr_size + 20)[0]
+                if lid in binary_ids:
+                    continue
+            level = levels.get(data[start : start + 1], "?")
+            pos = data.find(b"\0", start + 1, end)
+            if pos < 0:
+                pos = end
+            tag = data[start + 1 : pos]
+            if tag in tags:
+                tag = tags[tag]
+            else:
+                tag = tags[tag] = enforce_utf8_decode(tag)
+            try:
+                message = data[pos + 1 : end].rstrip(b"\0").decode("utf8")
+            except UnicodeDecodeError:
+                message = enforce_utf8_decode(data[pos + 1 : end].rstrip(b"\0"))
+            if sec != self._last_sec:
+                self._update_time(sec)
+            year, month_day, hms = self._last_time
+            timestamp = hms + milliseconds[nsec // 1000000 % 1000]
+            if "\n" in message:
+                for line in message.rstrip("\n").split("\n"):
+                    append((year, month_day, timestamp, pid, tid, level, tag, line))
+            else:
+                append((year, month_day, timestamp, pid, tid, level, tag, message))
+        self._buffer = data[offset:]
+        return result
+
+
+class LogcatSubscription(object):
+    """logcat订阅
+
+    每个订阅者拥有独立的有界队列，过滤条件在订阅时编译一次；可以指定回调函数，由独立的线程投递，
+    也可以使用for或async for直接读取。队列满时按指定策略丢弃日志或阻塞写入方
+    """
+
+    POLICY_DROP_OLDEST = "drop_oldest"  # 丢弃最旧的日志
+    POLICY_DROP_NEWEST = "drop_newest"  # 丢弃新到的日志
+    POLICY_BLOCK = "block"  # 阻塞logcat读取线程直到有空间
+
+    def __init__(
+        self,
+        callback=None,
+        tag=None,
+        level=None,
+        pid=None,
+        process_name=None,
+        pattern=None,
+        max_size=10000,
+        policy=POLICY_DROP_OLDEST,
+    ):
+        """
+        :param callback:     回调函数，参数为LogRecord，为None时需要调用方自行读取
+        :type callback:      function
+        :param tag:          tag或tag列表
+        :type tag:           string/list
+        :param level:        最低日志级别，如W表示只接收W/E/F级别的日志
+        :type level:         string
+        :param pid:          进程ID或进程ID列表
+        :type pid:           int/list
+        :param process_name: 进程名需要匹配的正则
+        :type process_name:  string
+        :param pattern:      日志内容需要匹配的正则
+        :type pattern:       string/re.Pattern
+        :param max_size:     队列长度
+        :type max_size:      int
+        :param policy:       队列满时的处理策略
+        :type policy:        string
+        """
+        if policy not in (
+            self.POLICY_DROP_OLDEST,
+            self.POLICY_DROP_NEWEST,
+            self.POLICY_BLOCK,
+        ):
+            raise ValueError("Invalid policy: %s" % policy)
+        self._filters = self._compile_filters(tag, level, pid, process_name, pattern)
+        self._max_size = max_size
+        self._policy = policy
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._received = 0
+        self._delivered = 0
+        self._dropped = 0
+        self._max_lag = 0
+        self._callback = callback
+        self._async_waiters = []  # 等待日志的(事件循环, future)
+        self._thread = None
+        if callback:
+            self._thread = ThreadEx(target=self._deliver_thread_func)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @staticmethod
+    def _compile_filters(tag, level, pid, process_name, pattern):
+        filters = []
+        if tag:
+            tags = set([tag] if isinstance(tag, six.string_types) else tag)
+            filters.append(lambda record: record.tag in tags)
+        if level:
+            levels = set(LOG_LEVELS[LOG_LEVELS.index(level) : -1])
+            filters.append(lambda record: record.level in levels)
+        if pid:
+            pids = set([pid] if isinstance(pid, six.integer_types) else pid)
+            filters.append(lambda record: record.process.pid in pids)
+        if process_name:
+            process_name = re.compile(process_name)
+            filters.append(lambda record: process_name.match(record.process.name))
+        if pattern:
+            if isinstance(pattern, six.string_types):
+                pattern = re.compile(pattern)
+            filters.append(lambda record: pattern.search(record.message))
+        return filters
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def lag(self):
+        """队列中尚未被读取的日志数
+        """
+        return len(self._queue)
+
+    @property
+    def max_lag(self):
+        """队列长度的最大值
+        """
+        return self._max_lag
+
+    @property
+    def dropped(self):
+        """因队列满被丢弃的日志数
+        """
+        return self._dropped
+
+    def get_stats(self):
+        """获取统计信息
+
+        :rtype: dict
+        """
+        with self._cond:
+            return {
+                "received": self._received,
+                "delivered": self._delivered,
+                "dropped": self._dropped,
+                "lag": len(self._queue),
+                "max_lag": self._max_lag,
+            }
+
+    def match(self, record):
+        """判断日志是否满足过滤条件
+        """
+        for func in self._filters:
+            if not func(record):
+                return False
+        return True
+
+    def put(self, record):
+        """写入一条日志，由logcat读取线程调用
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._received += 1
+            if len(self._queue) >= self._max_size:
+                if self._policy == self.POLICY_DROP_NEWEST:
+                    self._dropped += 1
+                    return
+                elif self._policy == self.POLICY_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    while len(self._queue) >= self._max_size and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+            self._queue.append(record)
+            if len(self._queue) > self._max_lag:
+                self._max_lag = len(self._queue)
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def get(self, timeout=None):
+        """读取一条日志，订阅已关闭或超时返回None
+
+        :rtype: LogRecord
+        """
+        with self._cond:
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while not self._queue and not self._closed:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+            if not self._queue:
+                return None
+            record = self._queue.popleft()
+            self._delivered += 1
+            self._cond.notify_all()
+            return record
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        record = self.get()
+        if record is None:
+            raise StopIteration
+        return record
+
+    next = __next__
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._poll_async(loop, future)
+        return future
+
+    def _poll_async(self, loop, future):
+        """在事件循环线程中读取日志，队列为空时登记等待，由put或close唤醒
+
+        只在future未被取消时才从队列中取出日志，避免日志丢失
+        """
+        if future.done():
+            return
+        with self._cond:
+            if not self._queue:
+                if self._closed:
+                    future.set_exception(StopAsyncIteration())
+                else:
+                    self._async_waiters.append((loop, future))
+                return
+            record = self._queue.popleft()
+            self._delivered += 1
+            self._cond.notify_all()
+        future.set_result(record)
+
+    def _wake_async_waiters(self):
+        waiters = self._async_waiters
+        self._async_waiters = []
+        for loop, future in waiters:
+            if future.done():
+                continue
+            try:
+                loop.call_soon_threadsafe(self._poll_async, loop, future)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    def _deliver_thread_func(self):
+        for record in self:
+            try:
+                self._callback(record)
+            except:
+                logger.exception("logcat callback %r failed" % self._callback)
+
+    def join(self, timeout=None):
+        """等待投递线程处理完队列中的日志，需要先调用close
+        """
+        if self._thread:
+            self._thread.join(timeout)
+
+    def close(self):
+        """关闭订阅，队列中剩余的日志仍然可以读取
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._wake_async_waiters()
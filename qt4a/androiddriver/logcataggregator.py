@@ -0,0 +1,249 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""多设备logcat聚合服务
+"""
+
+from __future__ import unicode_literals
+
+import heapq
+import threading
+
+import six
+
+from qt4a.androiddriver.logcat import LogcatSubscription
+from qt4a.androiddriver.util import logger, ThreadEx
+
+
+class _LogcatSource(object):
+    """一个设备的logcat输入
+    """
+
+    def __init__(self, adb, state):
+        self.adb = adb
+        self.state = state
+        self.queued = False  # 是否在就绪队列中
+        self.running = False  # 是否正在被工作线程处理
+        self.dirty = False  # 处理期间是否有新数据
+        self.closed = False
+
+
+class _DeviceTap(object):
+    """注册到单个设备上的订阅，将日志转发给聚合服务的跨设备订阅
+    """
+
+    def __init__(self, aggregator, device_name):
+        self._aggregator = aggregator
+        self._device_name = device_name
+
+    def match(self, record):
+        return bool(self._aggregator._subscriptions)
+
+    def put(self, record):
+        for subscription in self._aggregator._subscriptions:
+            if subscription.match(record):
+                subscription.put((self._device_name, record))
+
+    def close(self):
+        pass
+
+
+class LogcatAggregator(object):
+    """主机级的多设备logcat聚合服务
+
+    所有设备的logcat输出由少量工作线程统一处理：管道收到数据时将对应设备加入就绪队列，工作线程取出后
+    只处理管道中已有的数据，线程数不随设备数增长。同时提供跨设备的订阅以及按时间合并的日志视图
+    """
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, workers=2):
+        """
+        :param workers: 工作线程数
+        :type workers:  int
+        """
+        self._lock = threading.Lock()
+        self._ready = six.moves.queue.Queue()
+        self._sources = {}  # 设备名 => _LogcatSource
+        self._taps = {}  # 设备名 => _DeviceTap
+        self._subscriptions = []
+        for i in range(workers):
+            t = ThreadEx(
+                target=self._work_thread_func, name="LogcatAggregator-%d" % i
+            )
+            t.daemon = True
+            t.start()
+
+    @staticmethod
+    def get_instance():
+        """获取进程内共享的实例
+        """
+        with LogcatAggregator.instance_lock:
+            if LogcatAggregator.instance is None:
+                LogcatAggregator.instance = LogcatAggregator()
+            return LogcatAggregator.instance
+
+    @property
+    def devices(self):
+        """正在聚合logcat的设备
+
+        :rtype: list
+        """
+        with self._lock:
+            return [it.adb for it in self._sources.values()]
+
+    def add_device(self, adb, process_list=[], **kwds):
+        """启动设备的logcat并由聚合服务处理，参数含义见ADB.start_logcat
+        """
+        adb.start_logcat(process_list, aggregator=self, **kwds)
+
+    def remove_device(self, adb):
+        """停止设备的logcat
+        """
+        adb.stop_logcat()
+
+    def _register(self, adb, state):
+        """由ADB.start_logcat调用
+        """
+        source = _LogcatSource(adb, state)
+        tap = _DeviceTap(self, adb.device_name)
+        with self._lock:
+            self._sources[adb.device_name] = source
+            self._taps[adb.device_name] = tap
+        adb._logcat_subscriptions = adb._logcat_subscriptions + [tap]
+        self.watch_pipe(adb, adb._log_pipe)
+
+    def _unregister(self, adb):
+        """由ADB.stop_logcat调用
+        """
+        with self._lock:
+            source = self._sources.get(adb.device_name)
+            if not source or source.adb is not adb:
+                return
+            self._sources.pop(adb.device_name)
+            tap = self._taps.pop(adb.device_name)
+        adb.unsubscribe_logcat(tap)
+        self._close_source(source)
+
+    def _close_source(self, source):
+        with self._lock:
+            if source.closed:
+                return
+            source.closed = True
+        source.adb._close_logcat_state(source.state)
+
+    def watch_pipe(self, adb, pipe):
+        """logcat管道有数据时调度设备，logcat重启后需要重新调用
+
+        :return: 管道不支持数据通知时返回False
+        :rtype:  bool
+        """
+        if not hasattr(pipe.stdout, "read_lines"):
+            return False
+        with self._lock:
+            source = self._sources.get(adb.device_name)
+        if source:
+            pipe.stdout.data_callback = lambda: self._schedule(source)
+            self._schedule(source)
+        return True
+
+    def _schedule(self, source):
+        with self._lock:
+            if source.closed:
+                return
+            if source.running:
+                source.dirty = True
+            elif not source.queued:
+                source.queued = True
+                self._ready.put(source)
+
+    def _work_thread_func(self):
+        while True:
+            source = self._ready.get()
+            with self._lock:
+                source.queued = False
+                source.running = True
+            running = False
+            try:
+                running = source.adb._pump_logcat(source.state, False)
+            except:
+                logger.exception("[LogcatAggregator] %s" % source.adb.device_name)
+            with self._lock:
+                source.running = False
+                if running and source.dirty:
+                    source.dirty = False
+                    source.queued = True
+                    self._ready.put(source)
+            if not running:
+                self._close_source(source)
+
+    def subscribe(self, callback=None, **kwds):
+        """订阅所有设备的logcat日志，参数含义见LogcatSubscription，收到的数据为(设备名, LogRecord)
+
+        :rtype: LogcatSubscription
+        """
+        subscription = LogcatSubscription(callback, **kwds)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """取消订阅
+        """
+        subscription.close()
+        with self._lock:
+            self._subscriptions = [
+                it for it in self._subscriptions if it is not subscription
+            ]
+
+    def get_records(self, start_time=None, end_time=None, devices=None):
+        """获取按时间合并后的所有设备日志
+
+        :param start_time: 开始时间，格式为：2021-01-01 10:59:42.899
+        :type start_time:  string
+        :param end_time:   结束时间
+        :type end_time:    string
+        :param devices:    设备ADB对象列表，默认为所有正在聚合的设备
+        :type devices:     list
+        :return: [(设备名, LogRecord), ...]
+        :rtype:  list
+        """
+        if devices is None:
+            devices = self.devices
+
+        def iter_device(adb):
+            for record in adb.query_log(start_time=start_time):
+                log_time = "%s %s" % (record.date, record.timestamp)
+                if end_time and log_time > end_time:
+                    continue
+                yield log_time, adb.device_name, record
+
+        # 单个设备的日志基本有序，多路归并即可得到全局时间顺序
+        return [
+            (device_name, record)
+            for _, device_name, record in heapq.merge(
+                *[iter_device(it) for it in devices]
+            )
+        ]
+
+    def save_log(self, save_path, start_time=None, end_time=None, devices=None):
+        """将合并后的日志保存到文件，每行以设备名开头
+        """
+        with open(save_path, "wb") as fp:
+            for device_name, record in self.get_records(start_time, end_time, devices):
+                fp.write(("[%s] " % device_name).encode("utf8"))
+                fp.write(record.format())
+                fp.write(b"\n")
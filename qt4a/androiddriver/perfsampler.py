@@ -0,0 +1,488 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+"""基于设备端常驻采集循环的CPU与内存采样
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import csv
+import threading
+import time
+
+import six
+
+from qt4a.androiddriver.util import logger, ThreadEx
+
+
+class ThreadSample(object):
+    """一个线程的采样结果
+    """
+
+    __slots__ = ("tid", "name", "cpu")
+
+    def __init__(self, tid, name, cpu):
+        self.tid = tid
+        self.name = name
+        self.cpu = cpu  # 占整机CPU时间的百分比
+
+
+class ProcessSample(object):
+    """一个进程的采样结果
+    """
+
+    __slots__ = ("name", "pid", "cpu", "rss", "thread_count", "threads")
+
+    def __init__(self, name, pid, cpu, rss, thread_count, threads):
+        self.name = name
+        self.pid = pid
+        self.cpu = cpu  # 占整机CPU时间的百分比
+        self.rss = rss  # 常驻内存（字节）
+        self.thread_count = thread_count
+        self.threads = threads  # 线程ID => ThreadSample
+
+    @property
+    def main_thread(self):
+        """主线程的采样结果，可能为None
+        """
+        return self.threads.get(self.pid)
+
+
+class PerfSample(object):
+    """一次采样的结果
+    """
+
+    __slots__ = ("time", "uptime", "cpu_usage", "processes")
+
+    def __init__(self, time, uptime, cpu_usage, processes):
+        self.time = time  # 收到采样时的本地时间
+        self.uptime = uptime  # 设备开机时长
+        self.cpu_usage = cpu_usage  # 整机CPU使用率
+        self.processes = processes  # 进程名 => ProcessSample，不包含未运行的进程
+
+
+class _TaskStat(object):
+    """/proc/<pid>/stat中关心的字段
+    """
+
+    __slots__ = ("tid", "name", "cpu_time", "thread_count")
+
+    def __init__(self, line):
+        # 线程名中可能包含空格与括号，以最后一个右括号分割
+        pos = line.rindex(")")
+        self.tid = int(line[: line.index("(")])
+        self.name = line[line.index("(") + 1 : pos]
+        items = line[pos + 2 :].split()
+        self.cpu_time = sum(int(it) for it in items[11:15])  # utime+stime+cutime+cstime
+        self.thread_count = int(items[17])
+
+
+class PerfSampler(object):
+    """目标进程的CPU与内存采样器
+
+    在设备上启动一个shell循环，每隔interval秒输出/proc/stat、/proc/<pid>/stat、/proc/<pid>/statm
+    以及所有线程的stat，本地计算出整机CPU使用率、进程与线程的CPU占用率、常驻内存与线程数，
+    保存在定长的环形缓冲区中
+    """
+
+    page_size = 4096  # 无法获取设备的内存页大小时使用
+    resolve_interval = 5  # 目标进程不存在时重新获取进程ID的间隔
+
+    def __init__(
+        self, adb, process_list=[], interval=0.5, max_samples=7200, root=False
+    ):
+        """
+        :param adb:          ADB对象
+        :type adb:           ADB
+        :param process_list: 要采样的进程名列表，为空时只采样整机CPU使用率
+        :type process_list:  list
+        :param interval:     采样间隔（秒）
+        :type interval:      float
+        :param max_samples:  最多保留的采样数
+        :type max_samples:   int
+        :param root:         是否使用root权限读取
+        :type root:          bool
+        """
+        self._adb = adb
+        self._process_list = list(process_list)
+        self._interval = interval
+        self._root = root
+        self._samples = collections.deque(maxlen=max_samples)
+        self._cond = threading.Condition()
+        self._pids = {}  # 进程名 => 进程ID
+        self._page_size = self.page_size
+        self._last = None  # 上一次采样的原始数据
+        self._pipe = None
+        self._running = False
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """启动采样
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = ThreadEx(target=self._work_thread_func, name="PerfSampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止采样
+        """
+        self._running = False
+        pipe = self._pipe
+        if pipe and pipe.poll() == None:
+            pipe.terminate()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(5)
+        self._thread = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def _resolve_pids(self):
+        """获取目标进程的进程ID，不存在的进程不包含在结果中
+        """
+        if not self._process_list:
+            return {}
+        process_table = self._adb._process_table
+        process_table.refresh()
+        pids = {}
+        for process_name in self._process_list:
+            pid = process_table.get_pid(process_name, False)
+            if pid:
+                pids[process_name] = pid
+        return pids
+
+    def _get_cmdline(self, pid_list):
+        interval = self._interval
+        if interval == int(interval):
+            sleep_cmd = "sleep %d" % interval
+        else:
+            # 低版本toolbox的sleep不支持小数
+            sleep_cmd = "sleep %s 2>/dev/null || sleep 1" % interval
+        cmd_list = [
+            "echo '#S'",
+            "cat /proc/uptime",
+            "read l < /proc/stat",
+            'echo "$l"',
+        ]
+        if pid_list:
+            cmd_list.append(
+                'for p in %s; do echo "#P $p"; cat /proc/$p/stat /proc/$p/statm '
+                "/proc/$p/task/*/stat 2>/dev/null; done"
+                % " ".join(str(it) for it in pid_list)
+            )
+        cmd_list.extend(["echo '#E'", sleep_cmd])
+        return "while true; do %s; done" % "; ".join(cmd_list)
+
+    def _work_thread_func(self):
+        try:
+            self._page_size = self._adb.get_page_size()
+        except:
+            logger.exception("[PerfSampler] get page size failed")
+        while self._running:
+            self._pids = self._resolve_pids()
+            resolve_time = time.time()
+            cmdline = self._get_cmdline(sorted(self._pids.values()))
+            pipe = self._pipe = self._adb.run_shell_cmd(cmdline, self._root, sync=False)
+            frame = None
+            while self._running:
+                line = pipe.stdout.readline()
+                if not line:
+                    break
+                line = line.decode("utf8", "replace").strip()
+                if line == "#S":
+                    frame = []
+                elif line == "#E":
+                    if frame is None:
+                        continue
+                    try:
+                        self._handle_frame(frame)
+                    except:
+                        logger.exception("[PerfSampler] parse sample failed")
+                    frame = None
+                    if (
+                        self._has_missing_process()
+                        and time.time() - resolve_time >= self.resolve_interval
+                    ):
+                        resolve_time = time.time()
+                        if self._resolve_pids() != self._pids:
+                            break
+                elif frame is not None and line:
+                    frame.append(line)
+            if pipe.poll() == None:
+                pipe.terminate()
+            if self._running and not line:
+                logger.warn("[PerfSampler] sample process exited, restart")
+                time.sleep(1)
+
+    def _has_missing_process(self):
+        """是否有目标进程退出或尚未启动
+        """
+        if len(self._pids) < len(self._process_list):
+            return True
+        return self._last is not None and any(
+            it not in self._last[3] for it in self._pids.values()
+        )
+
+    def _parse_frame(self, frame):
+        """解析一次采样的原始数据
+
+        :return: (开机时长, 总CPU时间, 空闲CPU时间, {进程ID: (进程stat, 常驻内存页数, [线程stat])})
+        """
+        uptime = float(frame[0].split()[0])
+        items = [int(it) for it in frame[1].split()[1:]]
+        processes = {}
+        lines = None
+        for line in frame[2:]:
+            if line.startswith("#P "):
+                lines = processes[int(line[3:])] = []
+            elif lines is not None:
+                lines.append(line)
+        result = {}
+        for pid, lines in processes.items():
+            if len(lines) < 2 or "(" in lines[1]:
+                continue  # 进程已退出
+            try:
+                result[pid] = (
+                    _TaskStat(lines[0]),
+                    int(lines[1].split()[1]),
+                    [_TaskStat(it) for it in lines[2:]],
+                )
+            except (ValueError, IndexError):
+                # 读取过程中进程退出，数据不完整
+                logger.debug("[PerfSampler] incomplete stat of %d" % pid)
+        return uptime, sum(items), items[3], result
+
+    def _handle_frame(self, frame):
+        """根据前后两次采样计算CPU占用率并保存结果
+        """
+        current = self._parse_frame(frame)
+        last, self._last = self._last, current
+        if last is None:
+            return
+        total_time = current[1] - last[1]
+        if total_time <= 0:
+            return
+        processes = {}
+        for process_name, pid in self._pids.items():
+            if pid not in current[3] or pid not in last[3]:
+                continue
+            stat, rss, task_list = current[3][pid]
+            last_stat, _, last_task_list = last[3][pid]
+            last_tasks = dict((it.tid, it.cpu_time) for it in last_task_list)
+            threads = {}
+            for task in task_list:
+                if task.tid in last_tasks:
+                    cpu = (task.cpu_time - last_tasks[task.tid]) * 100.0 / total_time
+                else:
+                    cpu = 0.0  # 新创建的线程
+                threads[task.tid] = ThreadSample(task.tid, task.name, cpu)
+            processes[process_name] = ProcessSample(
+                process_name,
+                pid,
+                (stat.cpu_time - last_stat.cpu_time) * 100.0 / total_time,
+                rss * self._page_size,
+                stat.thread_count,
+                threads,
+            )
+        idle_time = current[2] - last[2]
+        sample = PerfSample(
+            time.time(),
+            current[0],
+            (total_time - idle_time) * 100.0 / total_time,
+            processes,
+        )
+        with self._cond:
+            self._samples.append(sample)
+            self._cond.notify_all()
+
+    def get_samples(self, start_time=None, end_time=None):
+        """获取采样结果
+
+        :param start_time: 开始时间，为time.time()返回的时间
+        :type start_time:  float
+        :param end_time:   结束时间
+        :type end_time:    float
+        :rtype: list
+        """
+        with self._cond:
+            samples = list(self._samples)
+        return [
+            it
+            for it in samples
+            if (start_time is None or it.time >= start_time)
+            and (end_time is None or it.time <= end_time)
+        ]
+
+    def get_latest(self):
+        """获取最近一次的采样结果，尚无结果时返回None
+
+        :rtype: PerfSample
+        """
+        with self._cond:
+            if self._samples:
+                return self._samples[-1]
+        return None
+
+    def get_series(self, process_name=None, field="cpu", start_time=None):
+        """获取指标的时间序列
+
+        :param process_name: 进程名，为None时返回整机CPU使用率
+        :type process_name:  string
+        :param field:        进程的指标：cpu、rss或thread_count
+        :type field:         string
+        :return: [(时间, 值), ...]
+        :rtype:  list
+        """
+        result = []
+        for sample in self.get_samples(start_time):
+            if process_name is None:
+                result.append((sample.time, sample.cpu_usage))
+            elif process_name in sample.processes:
+                result.append(
+                    (sample.time, getattr(sample.processes[process_name], field))
+                )
+        return result
+
+    def wait_for(self, predicate, duration=0, timeout=60):
+        """等待采样结果在持续时间内都满足条件
+
+        :param predicate: 判断条件，参数为PerfSample
+        :type predicate:  function
+        :param duration:  持续时间（秒），为0时只需一次采样满足条件
+        :type duration:   float
+        :param timeout:   超时时间（秒）
+        :type timeout:    float
+        :return: 超时或采样停止时返回False
+        :rtype:  bool
+        """
+        time0 = time.time()
+        last_time = time0
+        begin_time = None  # 持续满足条件的开始时间
+        while True:
+            with self._cond:
+                samples = [it for it in self._samples if it.time > last_time]
+                if not samples:
+                    remain = time0 + timeout - time.time()
+                    if remain <= 0 or not self._running:
+                        return False
+                    self._cond.wait(remain)
+                    continue
+            for sample in samples:
+                last_time = sample.time
+                if not predicate(sample):
+                    begin_time = None
+                    continue
+                if begin_time is None:
+                    begin_time = sample.time
+                if sample.time - begin_time >= duration:
+                    return True
+            if time.time() - time0 >= timeout:
+                return False
+
+    def wait_for_cpu_low(
+        self, process_name, max_cpu, max_thread_cpu=None, duration=0, timeout=60
+    ):
+        """等待进程CPU占用率与主线程CPU占用率低于指定值
+
+        :param process_name:   进程名
+        :type process_name:    string
+        :param max_cpu:        进程CPU占用率阈值
+        :type max_cpu:         float
+        :param max_thread_cpu: 主线程CPU占用率阈值，为None时不检查
+        :type max_thread_cpu:  float
+        :rtype: bool
+        """
+
+        def predicate(sample):
+            process = sample.processes.get(process_name)
+            if process is None or process.cpu >= max_cpu:
+                return False
+            if max_thread_cpu is not None:
+                thread = process.main_thread
+                return thread is not None and thread.cpu < max_thread_cpu
+            return True
+
+        return self.wait_for(predicate, duration, timeout)
+
+    def wait_for_system_cpu_low(self, usage, duration=0, timeout=60):
+        """等待整机CPU使用率低于指定值
+
+        :param usage: CPU使用率阈值
+        :type usage:  float
+        :rtype: bool
+        """
+        return self.wait_for(lambda it: it.cpu_usage <= usage, duration, timeout)
+
+    def export_csv(self, file_path, threads=False, start_time=None, end_time=None):
+        """将采样结果导出为csv文件，每行为一个进程（或线程）的一次采样
+
+        :param file_path: 文件路径
+        :type file_path:  string
+        :param threads:   是否同时导出线程的CPU占用率
+        :type threads:    bool
+        """
+        if six.PY2:
+            fp = open(file_path, "wb")
+        else:
+            fp = open(file_path, "w", newline="")
+        with fp:
+            writer = csv.writer(fp)
+            header = [
+                "time",
+                "uptime",
+                "system_cpu",
+                "process",
+                "pid",
+                "cpu",
+                "rss",
+                "thread_count",
+            ]
+            if threads:
+                header.extend(["tid", "thread_name", "thread_cpu"])
+            writer.writerow(header)
+            for sample in self.get_samples(start_time, end_time):
+                row = ["%.3f" % sample.time, sample.uptime, "%.2f" % sample.cpu_usage]
+                if not sample.processes:
+                    writer.writerow(row)
+                for process in sample.processes.values():
+                    process_row = row + [
+                        process.name,
+                        process.pid,
+                        "%.2f" % process.cpu,
+                        process.rss,
+                        process.thread_count,
+                    ]
+                    if not threads:
+                        writer.writerow(process_row)
+                        continue
+                    for thread in process.threads.values():
+                        writer.writerow(
+                            process_row
+                            + [thread.tid, thread.name, "%.2f" % thread.cpu]
+                        )
@@ -256,6 +256,32 @@ def get_file_md5(file_path):
         return md5.hexdigest()
 
 
+def get_zip_fingerprint(file_path):
+    """计算zip文件（如APK）的内容指纹
+
+    中央目录中记录了每个文件的CRC32与大小，只读取中央目录计算md5即可反映文件内容的变化，
+    不需要读取整个文件；找不到中央目录时退化为计算整个文件的md5
+    """
+    import hashlib
+    import struct
+
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as fp:
+        tail_size = min(file_size, 0xFFFF + 22)  # 目录结束记录最大长度
+        fp.seek(file_size - tail_size)
+        data = fp.read(tail_size)
+        pos = data.rfind(b"PK\x05\x06")
+        if pos >= 0 and len(data) - pos >= 22:
+            cd_size, cd_offset = struct.unpack(b"<II", data[pos + 12 : pos + 20])
+            if cd_offset + cd_size <= file_size:
+                fp.seek(cd_offset)
+                md5 = hashlib.md5()
+                md5.update(fp.read(cd_size))
+                md5.update(data[pos:])
+                return md5.hexdigest()
+    return get_file_md5(file_path)
+
+
 class static_property(property):
     """静态属性"""
 
@@ -747,6 +773,61 @@ def time_clock():
         return time.time()
 
 
+def format_args(args):
+    """格式化命令参数用于日志输出，列表参数只输出元素个数"""
+    arg_list = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            arg_list.append("<%d items>" % len(arg))
+        else:
+            arg_list.append("%s" % (arg,))
+    return " ".join(arg_list)
+
+
+def parallel_map(func, item_list, workers=4):
+    """使用多个线程并发执行func(item)
+
+    :param func:      执行函数
+    :type  func:      function
+    :param item_list: 参数列表
+    :type  item_list: list
+    :param workers:   最大并发线程数
+    :type  workers:   int
+    :return: 与item_list一一对应的返回值列表，任一调用抛出异常时在全部执行结束后抛出第一个异常
+    """
+    item_list = list(item_list)
+    result_list = [None] * len(item_list)
+    error_list = []
+    index_list = list(range(len(item_list)))
+    lock = threading.Lock()
+
+    def _work_thread():
+        while True:
+            with lock:
+                if not index_list:
+                    return
+                index = index_list.pop(0)
+            try:
+                result_list[index] = func(item_list[index])
+            except Exception as e:
+                logger.exception("parallel_map %r failed" % (item_list[index],))
+                with lock:
+                    error_list.append((index, e))
+
+    thread_list = []
+    for _ in range(min(workers, len(item_list))):
+        t = threading.Thread(target=_work_thread)
+        t.daemon = True
+        t.start()
+        thread_list.append(t)
+    for t in thread_list:
+        t.join()
+    if error_list:
+        error_list.sort(key=lambda it: it[0])
+        raise error_list[0][1]
+    return result_list
+
+
 def is_int(num):
     """判断整数num是否可以用32位表示"""
     return num <= 2147483647 and num >= -2147483648
@@ -30,6 +30,8 @@ from testbase.conf import settings
 from tuia.env import run_env, EnumEnvType
 
 from qt4a.androiddriver import util
+from qt4a.androiddriver.crashdetector import CrashDetector, EnumCrashKind
+from qt4a.androiddriver.logcataggregator import LogcatAggregator
 from qt4a.device import Device, DeviceProviderManager
 from qt4a.androidapp import AndroidApp
 
@@ -65,6 +67,7 @@ class AndroidTestBase(tc.TestCase):
         self._run_device = None
         self._target_crash_proc_list = []
         self._check_log_called = False
+        self._crash_detectors = {}  # 设备ID => CrashDetector
 
     initTest = init_test
 
@@ -171,7 +174,10 @@ class AndroidTestBase(tc.TestCase):
             )
             t.setDaemon(True)
             t.start()
-        device.adb.start_logcat()
+        device.adb.start_logcat(aggregator=LogcatAggregator.get_instance())
+        crash_detector = CrashDetector(self._get_crash_patterns())
+        crash_detector.attach(device.adb)
+        self._crash_detectors[device.device_id] = crash_detector
         return device
 
     def get_extra_fail_record(self):
@@ -298,21 +304,16 @@ class AndroidTestBase(tc.TestCase):
         crash_files = {}
         logcat_files = {}
         crash_type = ""
-        for device in Device.device_list:
-            device.adb.stop_logcat()
-            ret_type, crash_path = self.extract_crash_from_logcat(
-                device.adb.get_log(False)
-            )
+        device_list = list(Device.device_list)
+        # 各设备的crash提取与日志保存互不依赖，并发执行
+        result_list = util.parallel_map(
+            self._save_device_logcat, device_list, workers=len(device_list) or 1
+        )
+        for device, (ret_type, crash_path, log_path) in zip(device_list, result_list):
             devicename = "设备:%s" % device.device_id
             if crash_path:
                 crash_type = ret_type
                 crash_files[devicename] = crash_path
-            log_path = "%s_%s_%s.log" % (
-                self.__class__.__name__,
-                get_valid_file_name(device.device_id),
-                int(time.time()),
-            )
-            device.adb.save_log(log_path)
             if os.path.isfile(log_path):
                 logcat_files[devicename] = log_path
             else:
@@ -342,107 +343,117 @@ class AndroidTestBase(tc.TestCase):
                 EnumLogLevel.APPCRASH, crash_title, attachments=crash_files
             )
 
+    def _save_device_logcat(self, device):
+        """停止单个设备的logcat，提取crash并保存日志
+
+        :return: (crash类型, crash日志路径, logcat日志路径)
+        :rtype:  tuple
+        """
+        device.adb.stop_logcat()
+        crash_detector = self._crash_detectors.pop(device.device_id, None)
+        if crash_detector:
+            crash_detector.detach(device.adb)
+        if (
+            self.extract_crash_from_logcat.__func__
+            is not AndroidTestBase.__dict__["extract_crash_from_logcat"]
+        ):
+            # 子类重载了crash提取方法，保持原有的调用方式
+            ret_type, crash_path = self.extract_crash_from_logcat(
+                device.adb.get_log(False)
+            )
+        else:
+            if not crash_detector:
+                crash_detector = self._create_crash_detector(device.adb.get_log(False))
+            ret_type, crash_path = self._extract_crash(crash_detector, device.device_id)
+        log_path = "%s_%s_%s.log" % (
+            self.__class__.__name__,
+            get_valid_file_name(device.device_id),
+            int(time.time()),
+        )
+        device.adb.save_log(log_path)
+        return ret_type, crash_path, log_path
+
+    def _get_crash_patterns(self):
+        """获取用户自定义的crash规则
+        """
+        pattern_list = self.extract_crash_by_patterns()
+        if not pattern_list:
+            return []
+        if isinstance(pattern_list, tuple):
+            pattern_list = [pattern_list]
+        if not isinstance(pattern_list, list):
+            raise RuntimeError("传入的pattern_list不是列表或二元组")
+        result = []
+        for pattern in pattern_list:
+            if not isinstance(pattern, tuple) or not len(pattern) == 2:
+                util.logger.warn("传入的pattern不是二元组")
+            else:
+                result.append(pattern)
+        return result
+
     def extract_crash_from_logcat(self, log_list):
         """检测logcat日志中是否有crash发生并萃取出相关日志
         """
-        from qt4a.androiddriver.util import logger as qt4a_logger
+        return self._extract_crash(self._create_crash_detector(log_list))
 
-        pattern_list = self.extract_crash_by_patterns()
+    def _create_crash_detector(self, log_list):
+        """使用已保存的logcat日志创建CrashDetector
+        """
+        crash_detector = CrashDetector(self._get_crash_patterns())
+        for log in log_list:
+            crash_detector.feed_line(log)
+        return crash_detector
+
+    def _extract_crash(self, crash_detector, device_id=None):
+        """从CrashDetector中萃取关心的进程的crash日志
+
+        :param crash_detector: 已检测logcat日志的CrashDetector
+        :type crash_detector:  CrashDetector
+        :param device_id:      设备ID，用于区分多个设备的crash日志文件
+        :type device_id:       string
+        """
         if self._target_crash_proc_list == []:  # 表示用户不关心任何进程的crash问题，则不对crash进行提取
             return None, None
 
-        if (
-            not isinstance(pattern_list, list)
-            and not isinstance(pattern_list, tuple)
-            and not len(pattern_list) == 2
-        ):
-            raise RuntimeError("传入的pattern_list不是列表或二元组")
-        if isinstance(pattern_list, tuple):
-            pattern_list = [pattern_list]
-
-        new_pattern_list = []
+        process_list = []
         for proc in self._target_crash_proc_list:
             if not isinstance(proc, str):
-                qt4a_logger.warn("传入的process不是字符串类型")
+                util.logger.warn("传入的process不是字符串类型")
                 continue
-            for pattern in pattern_list:
-                if not isinstance(pattern, tuple) or not len(pattern) == 2:
-                    qt4a_logger.warn("传入的pattern不是二元组")
-                else:
-                    new_pattern_list.append((proc,) + pattern)
-            new_pattern_list.append(
-                (proc,) + (r"AndroidRuntime", r"FATAL EXCEPTION:.*")
-            )  # system crash1:java crash
-            # new_pattern_list.append((proc,) + (r'dalvikvm', r'threadid=.*: thread exiting with uncaught exception .*')) #与system crash1重复，暂时注释掉,优先取system crash1
-            native_crash_pattern = (
-                r"pid: \d+, tid: \d+, name: .*>>> " + "(" + proc + ")" + r" <<<"
-            )
-            new_pattern_list.append(
-                (r"/system/bin/debuggerd", r"DEBUG", native_crash_pattern)
-            )  # system crash2:native crash
-        # new_pattern_list.append((r'/system/bin/debuggerd', r'DEBUG', r'signal \d+ \(.*\), code \d+ \(.*\), fault addr.*')) #fault addr crash与上一行的system crash2重复，优先取system crash2
+            process_list.append(proc)
+        if not process_list:
+            return None, None
 
-        if new_pattern_list == []:  # 因为可能随着需求变更，没有规则写入
+        event_list = crash_detector.get_events(process_list)
+        if not event_list:
             return None, None
 
-        crash_info = ""
-        pattern = r"\[(.*)\(\d+\)\] \[.*\] (.)/(.*)\((\d+)\): (.*)"
-        form_log_dict = {}
-        regex = re.compile(pattern)
-        for log in log_list:
-            res = regex.match(log)
-            if res:
-                cur_line = {
-                    "process_name": res.group(1),
-                    "level": res.group(2),
-                    "tag": res.group(3),
-                    "part_log": res.group(5),
-                    "line_log": log,
-                }  # res.group(1)是进程名process_name的正则表达式，res.group(2)是错误级别level的正则表达式，res.group(3)是标签tag的正则表达式，res.group(4)是线程id的正则表达式，res.group(5)是线程id后的冒号后开始到本行结尾内容的正则表达式，line_log存储整行日志log。
-                if res.group(4) in form_log_dict:
-                    form_log_dict[res.group(4)].append(cur_line)
-                else:
-                    form_log_dict[res.group(4)] = [cur_line]
-            else:
-                qt4a_logger.warn("提取crash日志时，log:%s无法按格式%s解析" % (log, pattern))
         crash_list = []
-        for tlog_list in form_log_dict.values():
-            is_crashed = False
-            tag = ""
-            last_pattern_list = []
-            for tlog_dict in tlog_list:
-                if is_crashed == True and tag == tlog_dict["tag"]:
-                    crash_info += tlog_dict["line_log"] + "\n"
-                    crash_list.append(tlog_dict)
-                    continue
-                if not last_pattern_list:
-                    for pat_tuple in new_pattern_list:
-                        process_name_reg = re.compile(pat_tuple[0])
-                        if not process_name_reg.match(tlog_list[0]["process_name"]):
-                            continue
-                        last_pattern_list.append(pat_tuple)
-                    if len(last_pattern_list) == 0:
-                        break
-                is_crashed = False
-                for pat_tuple in last_pattern_list:
-                    tag_reg = re.compile(pat_tuple[1])
-                    tag = tlog_dict["tag"]
-                    if not tag_reg.match(tag):
-                        continue
-                    part_log_reg = re.compile(pat_tuple[2])
-                    if not part_log_reg.match(tlog_dict["part_log"]):
-                        continue
-                    is_crashed = True
-                    crash_list.append(tlog_dict)
-                    crash_info += tlog_dict["line_log"] + "\n"
-                    break
-        if crash_info:
-            crash_type = self.check_crash_type(crash_list)
-            crash_path = "%s_%s.crash.log" % (self.__class__.__name__, int(time.time()))
-            with open(crash_path, "w") as fd:
-                fd.write(crash_info)
-            return crash_type, crash_path
-        return None, None
+        for event in event_list:
+            for record in event.records:
+                crash_list.append(
+                    {
+                        "kind": event.kind,
+                        "process_name": event.process_name,
+                        "level": record.level,
+                        "tag": record.tag,
+                        "part_log": record.message,
+                        "line_log": record.format().decode("utf8"),
+                    }
+                )
+        crash_type = self.check_crash_type(crash_list)
+        crash_path = "%s_%s.crash.log" % (self.__class__.__name__, int(time.time()))
+        if device_id:
+            crash_path = "%s_%s_%s.crash.log" % (
+                self.__class__.__name__,
+                get_valid_file_name(device_id),
+                int(time.time()),
+            )
+        with open(crash_path, "wb") as fd:
+            fd.write(
+                "".join(it["line_log"] + "\n" for it in crash_list).encode("utf8")
+            )
+        return crash_type, crash_path
 
     def check_crash_type(self, crash_list):
         system_so_cnt = 3
@@ -453,7 +464,9 @@ class AndroidTestBase(tc.TestCase):
         )
         system_crash_reg = re.compile(system_crash_pattern)
         system_so_set = set([])
+        kind_set = set([])
         for tlog_dict in crash_list:
+            kind_set.add(tlog_dict.get("kind"))
             if tlog_dict["tag"] == "native_eup":
                 res = system_crash_reg.match(tlog_dict["part_log"])
                 if match_backtrace_begin and res:
@@ -465,6 +478,10 @@ class AndroidTestBase(tc.TestCase):
                 elif "unwinded end stack_depth" in tlog_dict["part_log"]:
                     match_backtrace_begin = False
                     system_so_set = set([])
+        if EnumCrashKind.JAVA in kind_set:
+            return EnumCrashType.JAVA_CRASH
+        elif EnumCrashKind.NATIVE in kind_set:
+            return EnumCrashType.NATIVE_NONE_SYSTEM_CRASH
         return EnumCrashType.OTHER_CRASH
 
     def extract_crash_by_patterns(self):
@@ -19,13 +19,11 @@ Android 设备模块
 
 import six
 import os
-import re
 import socket
 import struct
 import time
 import tempfile
 import threading
-import zipfile
 from io import BytesIO
 from pkg_resources import iter_entry_points
 
@@ -33,7 +31,13 @@ from testbase import logger as qta_logger
 from testbase.conf import settings
 from testbase.resource import LocalResourceHandler, LocalResourceManagerBackend
 from qt4a.androiddriver.adb import ADB, LocalADBBackend
-from qt4a.androiddriver.util import Singleton, logger, static_property, get_file_md5
+from qt4a.androiddriver.util import (
+    Singleton,
+    logger,
+    static_property,
+    get_file_md5,
+    parallel_map,
+)
 from qt4a.androiddriver.devicedriver import DeviceDriver
 
 
@@ -168,6 +172,23 @@ class Device(object):
     """
 
     device_list = []
+    compress_threshold = 5 * 1024 * 1024  # 超过该大小的文件上传时进行流式压缩
+    compressed_exts = (
+        ".apk",
+        ".jar",
+        ".zip",
+        ".gz",
+        ".tgz",
+        ".bz2",
+        ".xz",
+        ".7z",
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".webp",
+        ".mp3",
+        ".mp4",
+    )  # 本身已压缩的文件格式，再次压缩收益很小
 
     def __init__(self, id_or_adb_backend=None):
         """获取一个Android设备，获取成功后则独占该设备。
@@ -409,33 +430,17 @@ class Device(object):
 
         if not os.path.exists(src_path):
             raise RuntimeError("File: %s not exist" % src_path)
-        file_size = os.path.getsize(src_path)
-        is_zip = False
-        if file_size >= 5 * 1024 * 1024:
-            is_zip = True
-            zip_file_path = src_path + ".zip"
-            zip_file = zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED)
-            if dst_path[-1] == "/":
-                # filename not specified
-                filename = os.path.split(src_path)[-1]
-            else:
-                filename = dst_path.split("/")[-1]
-            zip_file.write(src_path, filename)
-            zip_file.close()
-            src_path = zip_file_path
-            dst_path += ".zip"
-        ret = self.adb.push_file(src_path, dst_path)
-        if is_zip:
-            os.remove(src_path)
-            if not self._device_driver.unzip_file(
-                dst_path, dst_path[: dst_path.rfind("/")]
-            ):
-                logger.warn("unzip file %s failed" % dst_path)
-                ret = self.adb.push_file(src_path[:-4], dst_path[:-4])
-            elif dst_path.startswith("/data/"):
-                self.adb.chmod(dst_path[:-4], "744")
-            self.delete_file(dst_path)
-            dst_path = dst_path[:-4]
+        if dst_path[-1] == "/":
+            # filename not specified
+            dst_path += os.path.split(src_path)[-1]
+        ret = None
+        if (
+            os.path.getsize(src_path) >= self.compress_threshold
+            and os.path.splitext(src_path)[-1].lower() not in self.compressed_exts
+        ):
+            ret = self.adb.push_file_compressed(src_path, dst_path)
+        if ret is None:
+            ret = self.adb.push_file(src_path, dst_path)
         try:
             self.run_shell_cmd('touch "%s"' % dst_path)  # 修改文件修改时间
         except:
@@ -452,10 +457,115 @@ class Device(object):
         """
         if not os.path.exists(src_path):
             raise RuntimeError("Directory %s not exist" % src_path)
-        for file in os.listdir(src_path):
-            file_src_path = os.path.join(src_path, file)
-            file_dst_path = dst_path + "/" + file
-            self.push_file(file_src_path, file_dst_path)
+        self.sync_tree(src_path, dst_path)
+
+    def sync_tree(self, src_path, dst_path, workers=4, pull=False, incremental=True):
+        """同步整个目录树
+
+        文件按大小均分到多个sync会话中并行传输，传输完成后通过一次批量查询校验文件大小，
+        校验失败的文件会逐个重新传输
+
+        :param src_path: 源目录路径，上传时为PC上的路径，下载时为手机上的路径
+        :type src_path:  string
+        :param dst_path: 目的目录路径
+        :type dst_path:  string
+        :param workers:  并行的sync会话数
+        :type workers:   int
+        :param pull:     是否为从手机下载到PC
+        :type pull:      bool
+        :param incremental: 上传时是否跳过设备中已存在且大小、修改时间一致的文件
+        :type incremental:  bool
+        :return: 实际传输的文件数
+        """
+        file_list = []  # [(源路径, 目标路径, 文件大小), ...]
+        if not pull:
+            if not os.path.isdir(src_path):
+                raise RuntimeError("Directory %s not exist" % src_path)
+            empty_dir_list = []
+            for root, dirs, files in os.walk(src_path):
+                rel_path = os.path.relpath(root, src_path).replace(os.sep, "/")
+                remote_dir = dst_path.rstrip("/")
+                if rel_path != ".":
+                    remote_dir += "/" + rel_path
+                if not dirs and not files:
+                    empty_dir_list.append(remote_dir)
+                for name in files:
+                    local_path = os.path.join(root, name)
+                    file_list.append(
+                        (local_path, remote_dir + "/" + name, os.path.getsize(local_path))
+                    )
+            if empty_dir_list:
+                self.run_shell_cmd(
+                    "mkdir -p %s" % " ".join(['"%s"' % it for it in empty_dir_list])
+                )
+            if incremental:
+                changed_set = set(
+                    [
+                        it[1]
+                        for it in self.adb.get_changed_files(
+                            [it[:2] for it in file_list]
+                        )
+                    ]
+                )
+                file_list = [it for it in file_list if it[1] in changed_set]
+            transfer = self.adb.push_files
+        else:
+            entry_list = self.adb.list_tree(src_path)
+            if entry_list is None:
+                raise RuntimeError("List directory %s failed" % src_path)
+            for rel_path, _, size, _ in entry_list:
+                local_path = os.path.join(dst_path, *rel_path.split("/"))
+                file_list.append((src_path.rstrip("/") + "/" + rel_path, local_path, size))
+                local_dir = os.path.dirname(local_path)
+                if not os.path.isdir(local_dir):
+                    os.makedirs(local_dir)
+            transfer = self.adb.pull_files
+
+        if not file_list:
+            return 0
+        # 按文件大小贪心分配，使各个会话的传输量接近
+        chunk_list = [[] for _ in range(max(1, min(workers, len(file_list))))]
+        chunk_size_list = [0] * len(chunk_list)
+        for it in sorted(file_list, key=lambda it: it[2], reverse=True):
+            index = chunk_size_list.index(min(chunk_size_list))
+            chunk_list[index].append(it[:2])
+            chunk_size_list[index] += it[2]
+        parallel_map(transfer, chunk_list, workers)
+
+        error_list = self._verify_tree(file_list, pull)
+        if error_list:
+            logger.warn("sync %d files failed, retry one by one" % len(error_list))
+            for src_file, dst_file, _ in error_list:
+                if pull:
+                    self.pull_file(src_file, dst_file)
+                else:
+                    self.adb.push_file(src_file, dst_file)
+            error_list = self._verify_tree(error_list, pull)
+            if error_list:
+                raise RuntimeError(
+                    "Sync files failed: %s" % ", ".join([it[0] for it in error_list])
+                )
+        if not pull and incremental:
+            self.adb.record_pushed_files([it[:2] for it in file_list])
+        return len(file_list)
+
+    def _verify_tree(self, file_list, pull):
+        """校验同步后的文件大小，返回校验失败的文件列表
+        """
+        if pull:
+            return [
+                it
+                for it in file_list
+                if not os.path.isfile(it[1]) or os.path.getsize(it[1]) != it[2]
+            ]
+        stat_list = self.adb.stat_files([it[1] for it in file_list])
+        if stat_list is None:
+            return []
+        return [
+            it
+            for it, (mode, size, _) in zip(file_list, stat_list)
+            if mode == 0 or size != it[2] & 0xFFFFFFFF  # STAT返回的大小为32位
+        ]
 
     def pull_file(self, src_path, dst_path):
         """将手机中的文件拷贝到PC中
@@ -493,10 +603,12 @@ class Device(object):
         if not os.path.exists(dst_path):
             os.mkdir(dst_path)
         subdirs, files = self.adb.list_dir(src_path)
-        for file in files:
-            self.pull_file(
-                src_path + "/" + file["name"], os.path.join(dst_path, file["name"])
-            )
+        file_list = [
+            (src_path + "/" + file["name"], os.path.join(dst_path, file["name"]))
+            for file in files
+        ]
+        for src_file, dst_file, _ in self.adb.pull_files(file_list):
+            self.pull_file(src_file, dst_file)  # 可能需要root权限
         for subdir in subdirs:
             self.pull_dir(
                 src_path + "/" + subdir["name"], os.path.join(dst_path, subdir["name"])
@@ -815,38 +927,46 @@ class Device(object):
         :param num:  返回满足条件的日志条数
         :type num:   int
         """
-        from qt4a.androiddriver.util import logger
+        if not process_name_pattern:
+            return []
+        record_list = self.adb.query_log(
+            tag=tag,
+            process_name=process_name_pattern,
+            pattern=pattern,
+            limit=num or None,
+            reverse=True,
+        )
+        if num == 1 and record_list:
+            return record_list[0].message
+        return [it.message for it in record_list]
 
-        pat = re.compile(r"^\[(.+)\(\d+\)\]\s+\[.+\]\s+\w/(.+)\(\s*\d+\):\s+(.+)$")
-        log_pat = re.compile(pattern)
-        log_list = self.adb.get_log(False)
-        log_list = [i.decode("utf-8") for i in log_list]
-        result_list = []
-        k = 0
-        for i in range(len(log_list) - 1, -1, -1):
-            ret = pat.match(log_list[i])
-            if not ret:
-                logger.info(
-                    "read_logcat:%s not match ^\[(.+)\(\d+\)\]\s+\[.+\]\s+\w/(.+)\(\s*\d+\):\s+(.+)$"
-                    % log_list[i]
-                )
-                continue
-            if not process_name_pattern:
-                continue
-            process_pat = re.compile(process_name_pattern)
-            if not process_pat.match(ret.group(1)):
-                continue
-            if ret.group(2) != tag:
-                continue
-            if log_pat.search(ret.group(3)):
-                if num == 1:
-                    return ret.group(3)
-                elif num == 0 or k < num:
-                    k += 1
-                    result_list.append(ret.group(3))
-                else:
-                    break
-        return result_list
+    def wait_for_logcat(
+        self, tag, pattern, process_name_pattern=None, since=None, timeout=10
+    ):
+        """等待满足条件的log出现
+
+        :param tag: 期望的Tag
+        :type tag:  string
+        :param pattern:  期望匹配的格式
+        :type pattern:   Pattern
+        :param process_name_pattern: 期望的进程名，传入正则表达式
+        :type process_name_pattern:  string
+        :param since:   从该位置之后开始查找，通过adb.get_log_cursor获取，为None时只等待新日志
+        :type since:    int
+        :param timeout: 超时时间（秒）
+        :type timeout:  int/float
+        :return: 日志内容，超时返回None
+        :rtype:  string
+        """
+        record = self.adb.wait_for_log(
+            tag=tag,
+            process_name=process_name_pattern,
+            pattern=pattern,
+            since=since,
+            timeout=timeout,
+        )
+        if record:
+            return record.message
 
     def get_clipboard_text(self):
         """获取剪切板内容
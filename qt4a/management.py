@@ -27,7 +27,7 @@ import time
 
 from qt4a.androiddriver.adb import ADB
 from qt4a.androiddriver.androiddriver import copy_android_driver
-from qt4a.androiddriver.util import OutStream, get_command_path
+from qt4a.androiddriver.util import OutStream, get_command_path, parallel_map
 from qt4a.apktool import repack
 from qt4a.apktool.manifest import AndroidManifest
 
@@ -37,9 +37,68 @@ except NameError:
     raw_input = input
 
 
+def install_qt4a_driver_to_devices(device_list, force=False, workers=4):
+    """并发向多个设备安装驱动
+
+    :param device_list: 设备序列号列表
+    :type  device_list: list
+    :param force:       是否强制安装
+    :type  force:       bool
+    :param workers:     最大并发数
+    :type  workers:     int
+    :return: [(设备序列号, 耗时, 错误信息), ...]，安装成功时错误信息为None
+    """
+
+    def _install(device_id):
+        time0 = time.time()
+        try:
+            copy_android_driver(device_id, force)
+        except Exception as e:
+            return device_id, time.time() - time0, "%s: %s" % (type(e).__name__, e)
+        return device_id, time.time() - time0, None
+
+    return parallel_map(_install, device_list, workers)
+
+
+def _install_qt4a_driver_to_devices(device_list, force, workers):
+    print("%d devices will install driver..." % len(device_list))
+    time0 = time.time()
+    result = install_qt4a_driver_to_devices(device_list, force, workers)
+    print("\n%-24s %-8s %8s" % ("Device", "Result", "Time(s)"))
+    for device_id, elapsed, error in result:
+        print(
+            "%-24s %-8s %8.2f%s"
+            % (
+                device_id,
+                "FAILED" if error else "OK",
+                elapsed,
+                "  %s" % error if error else "",
+            )
+        )
+    failed_list = [it[0] for it in result if it[2]]
+    print(
+        "\n%d succeeded, %d failed, total time %.2fs"
+        % (len(result) - len(failed_list), len(failed_list), time.time() - time0)
+    )
+    if failed_list:
+        raise RuntimeError("Install QT4A driver to %s failed" % ", ".join(failed_list))
+
+
 def install_qt4a_driver(args):
     device_id = None
     device_list = ADB.list_device()
+    if args.all or args.serials:
+        if args.serials:
+            serial_list = [it.strip() for it in args.serials.split(",") if it.strip()]
+            for serialno in serial_list:
+                if serialno not in device_list:
+                    raise RuntimeError("Device %s not found" % serialno)
+            device_list = serial_list
+        elif len(device_list) == 0:
+            raise RuntimeError("No Android device found")
+        _install_qt4a_driver_to_devices(device_list, args.force, args.workers)
+        return
+
     if args.serialno and args.serialno not in device_list:
         raise RuntimeError("Device %s not found" % args.serialno)
     elif args.serialno:
@@ -200,6 +259,19 @@ def qt4a_manage_main():
     install_driver_parser.add_argument(
         "-f", "--force", action="store_true", help="force install qt4a driver"
     )
+    install_driver_parser.add_argument(
+        "-a", "--all", action="store_true", help="install to all connected devices"
+    )
+    install_driver_parser.add_argument(
+        "--serials", help="comma separated serialnos of devices to install"
+    )
+    install_driver_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=4,
+        help="max devices to install concurrently",
+    )
     install_driver_parser.set_defaults(func=install_qt4a_driver)
 
     repack_parser = subparsers.add_parser("repack-apk", help="repack apk file")
@@ -23,14 +23,19 @@ except:
 import copy
 import os
 import shlex
+import shutil
+import socket
+import subprocess
 import sys
 import tempfile
 import threading
 import time
 import unittest
 
-from qt4a.androiddriver.adb import ADB, LocalADBBackend
-from qt4a.androiddriver.adbclient import Pipe
+from qt4a.androiddriver.adb import ADB, EnumRootState, LocalADBBackend, ShellSession
+from qt4a.androiddriver.adbclient import ADBPopen, Pipe
+from qt4a.androiddriver.cache import DeviceCache
+from qt4a.androiddriver.util import InstallPackageFailedError, TimeoutError
 
 
 class MockPopen(object):
@@ -55,6 +60,19 @@ class MockPopen(object):
         return 0
 
 
+properties = {
+    'ro.build.version.sdk': '21',
+    'ro.build.version.release': '5.0.2',
+    'ro.product.cpu.abi': 'armeabi-v7a',
+    'ro.product.model': 'MI 4C',
+    'ro.product.brand': 'Xiaomi',
+    'ro.sf.lcd_density': '320',
+    'ro.kernel.android.qemud': '0',
+    'ro.secure': '1',
+    'ro.debuggable': '0',
+}
+
+
 def mock_run_shell_cmd(cmd_line, root=False, **kwds):
     args = shlex.split(cmd_line)
     if args[0] == 'ls':
@@ -158,24 +176,10 @@ drwxr-x--x u0_a47   u0_a47            2017-06-20 09:44 org.cyanogenmod.wallpaper
             else:
                 raise NotImplementedError(path)
     elif args[0] == 'getprop':
-        if args[1] == 'ro.build.version.sdk':
-            return '21'
-        elif args[1] == 'ro.build.version.release':
-            return '5.0.2'
-        elif args[1] == 'ro.product.cpu.abi':
-            return 'armeabi-v7a'
-        elif args[1] == 'ro.product.model':
-            return 'MI 4C'
-        elif args[1] == 'ro.product.brand':
-            return 'Xiaomi'
-        elif args[1] == 'ro.sf.lcd_density':
-            return '320'
-        elif args[1] == 'ro.kernel.android.qemud':
-            return '0'
-        elif args[1] == 'ro.secure':
-            return '1'
-        elif args[1] == 'ro.debuggable':
-            return '0'
+        if len(args) == 1:
+            return '\n'.join('[%s]: [%s]' % it for it in sorted(properties.items()))
+        elif args[1] in properties:
+            return properties[args[1]]
         else:
             raise NotImplementedError('Not supported property: %s' % args[1])
     elif args[0] == 'id':
@@ -412,6 +416,124 @@ class TestADB(unittest.TestCase):
         adb_backend = LocalADBBackend('127.0.0.1', '')
         adb = ADB(adb_backend)
         self.assertEqual(adb.get_sdk_version(), 21)
+
+    def test_get_properties(self):
+        output = '[ro.build.version.sdk]: [21]\n[ro.product.model]: [MI 4C]\n[ro.multiline]: [a\nb]\n[sys.boot_completed]: [1]'
+        with mock.patch.object(ADB, 'run_shell_cmd', return_value=output) as mock_run_shell_cmd:
+            adb = ADB(LocalADBBackend('127.0.0.1', ''))
+            properties = adb.get_properties()
+            self.assertEqual(properties['ro.product.model'], 'MI 4C')
+            self.assertEqual(properties['ro.multiline'], 'a\nb')
+            self.assertEqual(adb.get_sdk_version(), 21)
+            self.assertEqual(adb.get_property('ro.product.model'), 'MI 4C')
+            # 快照中不存在的只读属性未设置
+            self.assertEqual(adb.get_property('ro.vendor.absent'), '')
+            self.assertEqual(mock_run_shell_cmd.call_count, 1)
+            # 非只读属性每次从设备读取
+            adb.get_property('sys.boot_completed')
+            mock_run_shell_cmd.assert_called_with('getprop sys.boot_completed')
+            with mock.patch.object(ADB, 'is_rooted', return_value=False):
+                adb.set_property('ro.test', '1')
+            adb.get_property('ro.product.model')
+            self.assertEqual(mock_run_shell_cmd.call_args_list[-1], mock.call('getprop'))
+
+    def test_get_page_size(self):
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        with mock.patch.object(ADB, 'run_shell_cmd', return_value='16384') as mock_run_shell_cmd:
+            self.assertEqual(adb.get_page_size(), 16384)
+            self.assertEqual(adb.get_page_size(), 16384)
+            mock_run_shell_cmd.assert_called_once_with('getconf PAGESIZE')
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        with mock.patch.object(ADB, 'run_shell_cmd', return_value='/system/bin/sh: getconf: not found'):
+            self.assertEqual(adb.get_page_size(), 4096)
+
+    def test_install_apk_streamed(self):
+        apk_path = tempfile.mktemp('.apk')
+        with open(apk_path, 'wb') as fp:
+            fp.write(b'1' * 100)
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        with mock.patch.object(ADB, '_get_package_name', return_value='com.qta.qt4a'), \
+             mock.patch.object(ADB, 'uninstall_app'), \
+             mock.patch.object(ADB, 'get_sdk_version', return_value=24), \
+             mock.patch.object(ADB, 'is_rooted', return_value=False), \
+             mock.patch.object(ADB, 'push_file') as mock_push_file, \
+             mock.patch.object(ADB, '_install_apk_streamed', side_effect=['Success', 'Failure [INSTALL_FAILED_INVALID_APK]', 'Error: closed', 'Failure [INSTALL_FAILED_CANCELLED_BY_USER]']) as mock_install, \
+             mock.patch.object(ADB, 'run_shell_cmd', return_value='Success'), \
+             mock.patch.object(ADB, 'delete_file'):
+            adb.install_apk(apk_path)
+            self.assertEqual(mock_install.call_args[0][0], [apk_path])
+            self.assertEqual(mock_push_file.call_count, 0)
+            self.assertRaises(InstallPackageFailedError, adb.install_apk, apk_path)
+            self.assertEqual(mock_push_file.call_count, 0)
+            # 非安装错误时改为上传后安装
+            adb.install_apk(apk_path, True)
+            mock_push_file.assert_called_once_with(apk_path, '/data/local/tmp/com.qta.qt4a.apk')
+            # 需要手动确认安装时改为上传后安装
+            adb.install_apk(apk_path, True)
+            self.assertEqual(mock_push_file.call_count, 2)
+            self.assertEqual(mock_install.call_count, 4)
+        os.remove(apk_path)
+
+    def test_install_apk_rooted(self):
+        apk_path = tempfile.mktemp('.apk')
+        with open(apk_path, 'wb') as fp:
+            fp.write(b'1' * 100)
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        with mock.patch.object(ADB, '_get_package_name', return_value='com.qta.qt4a'), \
+             mock.patch.object(ADB, 'get_sdk_version', return_value=24), \
+             mock.patch.object(ADB, 'is_rooted', return_value=True), \
+             mock.patch.object(ADB, 'push_file') as mock_push_file, \
+             mock.patch.object(ADB, '_install_apk', return_value=(True, 'Success')) as mock_install, \
+             mock.patch.object(ADB, 'delete_file'), \
+             mock.patch.object(ADB, 'record_installed_apk'):
+            # root设备需要处理安装弹窗，不使用流式安装
+            adb.install_apk(apk_path, True)
+            mock_push_file.assert_called_once_with(apk_path, '/data/local/tmp/com.qta.qt4a.apk')
+            mock_install.assert_called_once_with('/data/local/tmp/com.qta.qt4a.apk', 'com.qta.qt4a', True)
+        os.remove(apk_path)
+
+    def test_is_apk_installed(self):
+        os.environ['QT4A_CACHE_PATH'] = tempfile.mkdtemp()
+        apk_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'qt4a', 'androiddriver', 'tools', 'QT4AHelper.apk')
+        dumpsys_result = {'update_time': '2021-01-01 10:00:00'}
+
+        def run_shell_cmd(cmd_line, root=False, **kwds):
+            self.assertEqual(cmd_line, 'dumpsys package com.test.androidspy')
+            return """Packages:
+  Package [com.test.androidspy] (6f8ba9c):
+    userId=10086
+    codePath=/data/app/com.test.androidspy-1
+    versionCode=1 minSdk=14 targetSdk=19
+    versionName=1.0.10
+    lastUpdateTime=%s
+""" % dumpsys_result['update_time']
+
+        with mock.patch.object(ADB, 'run_shell_cmd', side_effect=run_shell_cmd), \
+             mock.patch.object(ADB, 'stat_files', return_value=[(0o100644, 296564, 0)]) as mock_stat_files:
+            adb = ADB(LocalADBBackend('127.0.0.1', 'install_test'))
+            self.assertFalse(adb.is_apk_installed(apk_path))
+            self.assertTrue(adb.record_installed_apk(apk_path))
+            mock_stat_files.assert_called_with(['/data/app/com.test.androidspy-1/base.apk'])
+            self.assertTrue(adb.is_apk_installed(apk_path))
+            # 应用被重新安装
+            dumpsys_result['update_time'] = '2021-01-02 10:00:00'
+            self.assertFalse(adb.is_apk_installed(apk_path))
+        shutil.rmtree(os.environ.pop('QT4A_CACHE_PATH'))
+
+    def test_persist_properties(self):
+        os.environ['QT4A_CACHE_PATH'] = tempfile.mkdtemp()
+        with mock.patch.object(ADB, 'run_shell_cmd', side_effect=mock_run_shell_cmd) as mock_shell_cmd, \
+             mock.patch.object(ADB, 'get_boot_id', return_value='boot_id'), \
+             mock.patch.object(ADB, 'persist_properties', True):
+            adb = ADB(LocalADBBackend('127.0.0.1', 'properties_test'))
+            self.assertEqual(adb.get_system_version(), '5.0.2')
+            self.assertEqual(mock_shell_cmd.call_count, 1)
+            DeviceCache.instance_dict.clear()
+            adb = ADB(LocalADBBackend('127.0.0.1', 'properties_test'))
+            self.assertEqual(adb.get_system_version(), '5.0.2')
+            self.assertEqual(adb.get_sdk_version(), 21)
+            self.assertEqual(mock_shell_cmd.call_count, 1)
+        shutil.rmtree(os.environ.pop('QT4A_CACHE_PATH'))
     
     def test_list_process(self):
         ADB.run_shell_cmd = mock.Mock(side_effect=mock_run_shell_cmd)
@@ -466,6 +588,68 @@ class TestADB(unittest.TestCase):
         self.assertEqual(len(file_list), 0)
         self.assertEqual(dir_list[0]['name'], 'com.android.apps.tag')
         self.assertEqual(dir_list[0]['attr'], 'rwxr-x--x')
+
+    def test_list_dir_formats(self):
+        output_dict = {
+            'toybox': '''total 16
+drwxrwx--x 4 system sdcard_rw 4096 2017-06-20 09:44 Android
+-rw-rw---- 1 root sdcard_rw 1234 2017-06-20 11:07 a b.txt
+lrwxrwxrwx 1 root root 21 2017-06-20 09:45 sdcard -> /storage/self/primary
+''',
+            'toolbox': '''drwxrwx--x system   sdcard_rw          2017-06-20 09:44 Android
+-rw-rw---- root     sdcard_rw     1234 2017-06-20 11:07 a b.txt
+lrwxrwxrwx root     root              2017-06-20 09:45 sdcard -> /storage/self/primary
+''',
+            'busybox': '''drwxrwx--x    4 system   sdcard_r     4096 Jun 20 09:44 /sdcard/Android
+-rw-rw----    1 root     sdcard_r     1234 Jun 20 11:07 /sdcard/a
+lrwxrwxrwx    1 root     root           21 Jun 20 09:45 /sdcard/sdcard -> /storage/self/primary
+''',
+        }
+        for list_format, output in output_dict.items():
+            adb = ADB(LocalADBBackend('127.0.0.1', ''))
+            with mock.patch.object(ADB, 'run_shell_cmd', return_value=output), \
+                 mock.patch.object(ADB, 'is_rooted', return_value=False):
+                dir_list, file_list = adb.list_dir('/sdcard')
+            self.assertEqual(adb._list_dir_format, list_format)
+            self.assertEqual(dir_list, [{'name': 'Android', 'attr': 'rwxrwx--x'}])
+            self.assertEqual(file_list[0]['size'], 1234)
+            self.assertEqual(file_list[1]['name'], 'sdcard')
+            self.assertEqual(file_list[1]['link'], '/storage/self/primary')
+            if list_format == 'busybox':
+                self.assertEqual(file_list[0]['name'], 'a')
+                self.assertEqual(file_list[0]['last_modify_time'], '11:07')
+            else:
+                self.assertEqual(file_list[0]['name'], 'a b.txt')
+                self.assertEqual(file_list[0]['last_modify_time'], time.strptime('2017-06-20 11:07:00', '%Y-%m-%d %X'))
+
+    def test_list_dir_cache(self):
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        output = '-rw-rw---- 1 root sdcard_rw 1234 2017-06-20 11:07 a.txt\n'
+        with mock.patch.object(ADB, 'run_shell_cmd', return_value=output) as mock_run_shell_cmd, \
+             mock.patch.object(ADB, 'run_adb_cmd', return_value='1 file pushed. 1234 bytes in 0.1s'), \
+             mock.patch.object(ADB, 'is_rooted', return_value=False):
+            adb.list_dir('/sdcard', cache_ttl=60)
+            adb.list_dir('/sdcard', cache_ttl=60)
+            self.assertEqual(mock_run_shell_cmd.call_count, 1)
+            adb.list_dir('/sdcard', cache_ttl=0)
+            self.assertEqual(mock_run_shell_cmd.call_count, 2)
+            # 上传文件后目录缓存失效
+            adb._push_file(__file__, '/sdcard/b.txt')
+            adb.list_dir('/sdcard', cache_ttl=60)
+            self.assertEqual(mock_run_shell_cmd.call_count, 3)
+
+    def test_list_dir_benchmark(self):
+        count = 10000
+        output = '\n'.join(['-rw-rw---- 1 u0_a100 sdcard_rw %d 2021-01-01 10:%02d IMG_%05d.jpg' % (i, i % 60, i) for i in range(count)])
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        with mock.patch.object(ADB, 'run_shell_cmd', return_value=output), \
+             mock.patch.object(ADB, 'is_rooted', return_value=False):
+            time0 = time.time()
+            _, file_list = adb.list_dir('/sdcard/DCIM')
+            cost = time.time() - time0
+        self.assertEqual(len(file_list), count)
+        self.assertEqual(file_list[-1]['name'], 'IMG_%05d.jpg' % (count - 1))
+        print('list_dir: %d files in %.3fs' % (count, cost))
         
     def test_save_log(self):
         adb_backend = LocalADBBackend('127.0.0.1', '')
@@ -512,9 +696,235 @@ class TestADB(unittest.TestCase):
                  return [proc]
             else:
                 return [process]
-        ADB.list_process = mock.Mock(side_effect=mock_list_process)
-        adb._logcat_thread_func([])
+        with mock.patch.object(ADB, '_list_process', side_effect=mock_list_process):
+            adb._logcat_thread_func([])
+        log_list = adb.get_log()
+        self.assertEqual(len(log_list), 1)
+        self.assertTrue(log_list[0].startswith(b'[com.qta.qt4a(100)]'))
+
+    def test_logcat_filter(self):
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+
+        def run_shell_cmd(cmd_line, root=False, **kwds):
+            if cmd_line.startswith('pm list packages -U'):
+                return 'package:com.qta.qt4a.test uid:10087\npackage:com.qta.qt4a uid:10086\n'
+            raise NotImplementedError(cmd_line)
 
+        with mock.patch.object(ADB, 'run_shell_cmd', side_effect=run_shell_cmd), \
+             mock.patch.object(ADB, 'get_pid', return_value=1234):
+            with mock.patch.object(ADB, 'get_sdk_version', return_value=28):
+                adb._logcat_filter = adb._build_logcat_filter(['com.qta.qt4a:service'], ['ActivityManager:I'], ['main', 'crash'])
+                self.assertEqual(adb._get_logcat_cmdline(), 'logcat -v threadtime -b main -b crash --uid=10086 ActivityManager:I')
+            with mock.patch.object(ADB, 'get_sdk_version', return_value=24):
+                adb._logcat_filter = adb._build_logcat_filter(['com.qta.qt4a'], None, ['main', 'stats'])
+                self.assertEqual(adb._get_logcat_cmdline(), 'logcat -v threadtime -b main --pid=1234')
+                adb._logcat_last_time = '08-05 10:46:13.395'
+                self.assertEqual(adb._get_logcat_cmdline(restart=True), "logcat -v threadtime -b main --pid=1234 -T '08-05 10:46:13.395'")
+            with mock.patch.object(ADB, 'get_sdk_version', return_value=21):
+                adb._logcat_filter = adb._build_logcat_filter(['com.qta.qt4a'])
+                self.assertEqual(adb._get_logcat_cmdline(), 'logcat -v threadtime')
+
+    def test_logcat_stats(self):
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        adb._logcat_running = True
+        adb._log_pipe = MockPopen()
+        adb._log_pipe.stdout.write(b'08-05 10:46:13.395 100 100 I Test: line 1\n')
+        adb._log_pipe.stdout.write(b'08-05 10:46:13.396 200 200 I Test: line 2\n')
+        adb._log_pipe.stdout.write(b'08-05 10:46:13.397 100 100 I Test: line 3\n')
+
+        def stop_thread():
+            time.sleep(0.5)
+            adb._logcat_running = False
+            adb._log_pipe.stdout.write(b'\n')
+
+        t = threading.Thread(target=stop_thread)
+        t.daemon = True
+        t.start()
+        process_list = [{'pid': 100, 'ppid': 1, 'proc_name': 'com.qta.qt4a'}, {'pid': 200, 'ppid': 1, 'proc_name': 'com.qta.other'}]
+        with mock.patch.object(ADB, '_list_process', return_value=process_list):
+            adb._logcat_thread_func(['com.qta.qt4a'])
+        self.assertEqual(adb.get_logcat_stats(), {'received': 3, 'kept': 2, 'restarts': 0})
+
+    def test_binary_logcat(self):
+        from test.test_androiddriver.test_logcat import pack_entry
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        adb._logcat_running = True
+        adb._logcat_binary = True
+        adb._log_pipe = MockPopen()
+        adb._log_pipe.stdout.write(pack_entry(100, 101, 1609469982, 899000000, 6, b'AndroidRuntime', b'FATAL EXCEPTION: main\njava.lang.NullPointerException\n'))
+        adb._log_pipe.stdout.write(pack_entry(200, 200, 1609469982, 900000000, 4, b'Test', b'other'))
+
+        def stop_thread():
+            time.sleep(0.5)
+            adb._logcat_running = False
+            adb._log_pipe.stdout.write(b'\n')
+
+        t = threading.Thread(target=stop_thread)
+        t.daemon = True
+        t.start()
+        with mock.patch.object(ADB, '_list_process', return_value=[{'pid': 100, 'ppid': 1, 'proc_name': 'com.qta.qt4a'}]), \
+             mock.patch.object(ADB, '_get_device_utc_offset', return_value=8 * 3600):
+            adb._logcat_thread_func([])
+        self.assertEqual(adb.get_log(), [
+            b'[com.qta.qt4a(100)] [2021-01-01 10:59:42.899] E/AndroidRuntime(101): FATAL EXCEPTION: main',
+            b'[com.qta.qt4a(100)] [2021-01-01 10:59:42.899] E/AndroidRuntime(101): java.lang.NullPointerException',
+        ])
+        self.assertEqual(adb.get_logcat_stats(), {'received': 3, 'kept': 2, 'restarts': 0})
+
+    def test_logcat_callback(self):
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        result = []
+        event = threading.Event()
+
+        def callback(pid, process_name, date, timestamp, level, tag, tid, content):
+            result.append((pid, process_name, date, timestamp, level, tag, tid, content))
+            event.set()
+
+        adb.add_logcat_callback(callback)
+        subscription = adb.subscribe_logcat(level='E')
+        adb.insert_logcat('com.qta.qt4a(100)', 2021, '01-01', '10:59:42.899', 'I', 'test', 101, 'info')
+        adb.insert_logcat('com.qta.qt4a(100)', 2021, '01-01', '10:59:42.899', 'E', 'test', 101, 'error')
+        event.wait(5)
+        self.assertEqual(result[0], (100, 'com.qta.qt4a', '2021-01-01', '10:59:42.899', 'I', 'test', 101, 'info'))
+        self.assertEqual(subscription.get(1).message, 'error')
+        self.assertEqual(subscription.lag, 0)
+        adb.remove_logcat_callback(callback)
+        adb.unsubscribe_logcat(subscription)
+        self.assertEqual(adb._logcat_subscriptions, [])
+
+    def test_process_table(self):
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        event = threading.Event()
+
+        def list_process():
+            event.wait(1)
+            return [{'pid': 100, 'ppid': 1, 'proc_name': 'com.qta.qt4a'}]
+
+        with mock.patch.object(ADB, '_list_process', side_effect=list_process) as mock_list_process:
+            result = []
+            thread_list = [threading.Thread(target=lambda: result.append(adb.get_pid('com.qta.qt4a'))) for _ in range(5)]
+            for t in thread_list:
+                t.start()
+            time.sleep(0.2)
+            event.set()
+            for t in thread_list:
+                t.join()
+            self.assertEqual(result, [100] * 5)
+            # 并发的刷新请求被合并
+            self.assertTrue(mock_list_process.call_count <= 2)
+            call_count = mock_list_process.call_count
+            self.assertEqual(adb._process_table.get(100)['proc_name'], 'com.qta.qt4a')
+            self.assertEqual(mock_list_process.call_count, call_count)
+
+    def test_sync_files(self):
+        os.environ['QT4A_CACHE_PATH'] = tempfile.mkdtemp()
+        src_dir = tempfile.mkdtemp()
+        file_list = []
+        for name in ('a.txt', 'b.txt'):
+            file_path = os.path.join(src_dir, name)
+            with open(file_path, 'w') as fp:
+                fp.write('1' * 10)
+            file_list.append((file_path, '/data/local/tmp/' + name))
+        st = os.stat(file_list[0][0])
+
+        def stat_files(path_list):
+            # a.txt已存在于设备中
+            return [(0o100644, 10, int(st.st_mtime)) if it.endswith('a.txt') else (0, 0, 0) for it in path_list]
+
+        adb_backend = LocalADBBackend('127.0.0.1', 'sync_test')
+        adb = ADB(adb_backend)
+        with mock.patch.object(ADB, 'stat_files', side_effect=stat_files), \
+             mock.patch.object(ADB, 'push_files', return_value=[]) as mock_push_files, \
+             mock.patch.object(ADB, 'get_boot_id', return_value='boot_id'):
+            self.assertEqual(adb.sync_files(file_list), [file_list[1]])
+            mock_push_files.assert_called_once_with([file_list[1]])
+            self.assertEqual(adb.sync_files(file_list), [])
+            adb.invalidate_file_cache('/data/local/tmp/b.txt')
+            self.assertEqual(adb.sync_files(file_list), [file_list[1]])
+            manifest = DeviceCache.get_cache('sync_test', 'manifest')
+            self.assertEqual(len(manifest.get('files')), 2)
+            adb.invalidate_file_cache('/data/local/tmp/*.txt')
+            self.assertEqual(manifest.get('files'), {})
+        shutil.rmtree(src_dir)
+        shutil.rmtree(os.environ.pop('QT4A_CACHE_PATH'))
+
+    def test_invalidate_file_cache(self):
+        cache_dir = os.path.join(tempfile.mkdtemp(), 'cache')
+        os.environ['QT4A_CACHE_PATH'] = cache_dir
+        adb = ADB(LocalADBBackend('127.0.0.1', 'invalidate_test'))
+        # 没有缓存时不创建缓存目录
+        adb.invalidate_file_cache('/data/local/tmp/a.txt')
+        self.assertFalse(os.path.exists(cache_dir))
+        shutil.rmtree(os.path.dirname(os.environ.pop('QT4A_CACHE_PATH')))
+
+    @unittest.skipIf(sys.platform == 'win32', 'sh is required')
+    def test_run_shell_batch(self):
+        def run_shell_cmd(cmd_line, root=False, **kwds):
+            return subprocess.check_output(['sh', '-c', cmd_line]).decode('utf8').strip()
+
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        cmd_list = ['echo hello', 'printf "a\\nb"', 'true', 'exit_code() { return $1; }; exit_code 3']
+        with mock.patch.object(ADB, 'run_shell_cmd', side_effect=run_shell_cmd) as mock_run_shell_cmd:
+            result = adb.run_shell_batch(cmd_list)
+            self.assertEqual(result, [('hello', 0), ('a\nb', 0), ('', 0), ('', 3)])
+            self.assertEqual(mock_run_shell_cmd.call_count, 1)
+            result = adb.run_shell_batch(['echo %s' % ('1' * 1000)] * 5)
+            self.assertEqual(result, [('1' * 1000, 0)] * 5)
+            self.assertEqual(mock_run_shell_cmd.call_count, 4)
+
+        def run_su_cmd(cmd_line, root=False, **kwds):
+            # 模拟su -c执行脚本
+            return subprocess.check_output(['sh', '-c', 'su() { shift; sh -c "$1"; }; ' + cmd_line]).decode('utf8').strip()
+
+        adb._root_state = EnumRootState.SuRoot
+        with mock.patch.object(ADB, 'run_shell_cmd', side_effect=run_su_cmd) as mock_run_shell_cmd:
+            result = adb.run_shell_batch(["echo 'a b'", 'id -u', 'exit_code() { return $1; }; exit_code 3'], True)
+            self.assertEqual(result, [('a b', 0), (str(os.getuid()), 0), ('', 3)])
+            # 整批命令只启动一次su
+            self.assertEqual(mock_run_shell_cmd.call_count, 1)
+            self.assertTrue(mock_run_shell_cmd.call_args[0][0].startswith("su -c '"))
+
+    @unittest.skipIf(sys.platform == 'win32', 'sh is required')
+    def test_shell_session(self):
+        proc_list = []
+        def run_adb_cmd(cmd, *args, **kwds):
+            # 使用本地的sh模拟设备端shell
+            sock1, sock2 = socket.socketpair()
+            proc_list.append(subprocess.Popen(['sh'], stdin=sock1.fileno(), stdout=sock1.fileno(), stderr=subprocess.STDOUT))
+            sock1.close()
+            return ADBPopen(sock2)
+
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        session = ShellSession(adb)
+        with mock.patch.object(ADB, 'run_adb_cmd', side_effect=run_adb_cmd):
+            self.assertEqual(session.run('echo hello'), (b'hello', 0))
+            self.assertEqual(session.run('printf "a\\nb"; exit 2'), (b'a\nb', 2))
+            self.assertEqual(session.run('cd /; echo $(pwd) >&2'), (b'/', 0))
+            self.assertEqual(len(proc_list), 1)
+            self.assertRaises(TimeoutError, session.run, 'sleep 10', 0.5)
+            self.assertEqual(session.run('echo test', 10), (b'test', 0))
+            self.assertEqual(len(proc_list), 2)
+            session.close()
+        for proc in proc_list:
+            proc.kill()
+            proc.wait()
+
+    def test_shell_session_timeout(self):
+        adb_backend = LocalADBBackend('127.0.0.1', '')
+        adb = ADB(adb_backend)
+        session = adb.get_shell_session(False)
+        with mock.patch.object(session, 'run', side_effect=TimeoutError('timeout')):
+            # 会话超时后需要使用普通方式执行
+            self.assertEqual(adb._run_in_shell_session('echo hello', False, {}), (False, None))
+        with mock.patch.object(session, 'run', return_value=(b'hello\n', 0)):
+            self.assertEqual(adb._run_in_shell_session('echo hello', False, {}), (True, b'hello'))
 
 if __name__ == '__main__':
     unittest.main()
@@ -16,7 +16,9 @@
 '''adbclient模块单元测试
 '''
 
+import os
 import random
+import re
 import select
 import socket
 import struct
@@ -24,12 +26,46 @@ import tempfile
 import time
 import threading
 import unittest
+import zlib
 try:
     from unittest import mock
 except:
     import mock
 
-from qt4a.androiddriver.adbclient import ADBClient
+from qt4a.androiddriver.adbclient import ADBClient, ADBConnectionPool, ADBPopen, AdbError, Pipe, SYNC_DATA_MAX
+from qt4a.androiddriver.util import TimeoutError
+
+
+def gen_sync_data(size):
+    '''生成sync协议的文件数据包
+    '''
+    chunk = b'DATA' + struct.pack('I', SYNC_DATA_MAX) + b'\x00' * SYNC_DATA_MAX
+    while size >= SYNC_DATA_MAX:
+        yield chunk
+        size -= SYNC_DATA_MAX
+    if size > 0:
+        yield b'DATA' + struct.pack('I', size) + b'\x00' * size
+    yield b'DONE\x00\x00\x00\x00'
+
+
+def iter_chunks(response_list):
+    '''依次输出所有数据块
+    '''
+    for response in response_list:
+        if isinstance(response, bytes):
+            yield response
+        else:
+            for chunk in response:
+                yield chunk
+
+
+def gen_framebuffer(width, height):
+    '''生成RGBA格式的framebuffer数据
+    '''
+    size = width * height * 4
+    header = struct.pack('13I', 1, 32, size, width, height, 0, 8, 16, 8, 8, 8, 24, 8)
+    return header + b'\xff\x00\x00\xff' * (width * height)
+
 
 class Context(object):
     '''上下文
@@ -38,6 +74,14 @@ class Context(object):
     def __init__(self):
         self._device_id = None
         self._file_path = None
+        self.sync_mode = False
+        self.buffer = b''
+        self.file_mode = 0
+        self.file_size = 0
+        self.shell_v2_cmdline = None
+        self.stdin_data = []
+        self.exec_cmdline = None
+        self.exec_size = 0
         
     @property
     def device_id(self):
@@ -61,6 +105,8 @@ class MockADBServer(object):
     
     def __init__(self, port=5037):
         self._port = port
+        self._files = {}  # 通过sync协议上传的文件: path -> (mode, size, mtime)
+        self._installs = []  # 通过exec:服务流式安装的命令: (命令行, 收到的数据长度)
         self._serv = socket.socket()
         self._serv.bind(('127.0.0.1', self._port))
         self._serv.listen(1)
@@ -101,7 +147,11 @@ class MockADBServer(object):
                                 fds.remove(fd)
                             else:
                                 response, close_conn = self.handle_input(context_dict[fd], data)
-                                if response: fd.send(response)
+                                if isinstance(response, bytes):
+                                    fd.sendall(response)
+                                else:
+                                    for chunk in response:
+                                        fd.sendall(chunk)
                                 if close_conn: 
                                     fd.close()
                                     fds.remove(fd)
@@ -110,6 +160,12 @@ class MockADBServer(object):
     def handle_input(self, context, data):
         '''处理输入数据
         '''
+        if context.sync_mode:
+            return self.handle_sync_input(context, data)
+        if context.shell_v2_cmdline is not None:
+            return self.handle_shell_v2_input(context, data)
+        if context.exec_cmdline is not None:
+            return self.handle_exec_input(context, data)
         try:
             data_len = int(data[:4], 16)
         except ValueError:
@@ -135,6 +191,8 @@ class MockADBServer(object):
             pos = data.find(b':get-state')
             if pos > 0:
                 response += b'0006device'
+            if data.endswith(b':features'):
+                response += b'000dshell_v2,cmd'
             close_conn = True
         elif data.startswith(b'host:connect:'):
             data = data[13:]
@@ -156,42 +214,130 @@ class MockADBServer(object):
             else:
                 raise NotImplementedError(cmdline)
             close_conn = True
-        elif data == b'sync:':
-            pass
-        elif data.startswith(b'STAT'):
-            data_len = struct.unpack('I', data[4:8])[0]
-            assert(len(data) == data_len + 8)
-            file_path = data[8:]
-            context.file_path = file_path
-            response = b'STAT\x01\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00'
-        elif data.startswith(b'SEND'):
-            data_len = struct.unpack('I', data[4:8])[0]
-            # assert(len(data) == data_len + 8)
-            response = b''
-        elif data.startswith(b'DATA'):
-            data = data[-8:-4]
-            if data == b'DONE':
-                response += b'\x00\x00\x00\x00'
+        elif data.startswith(b'shell,v2,raw:'):
+            context.shell_v2_cmdline = data[13:]
+        elif data.startswith(b'exec:'):
+            cmdline = data[5:]
+            result = re.search(br' -S (\d+)', cmdline)
+            if result and b' install-create ' not in cmdline:
+                context.exec_cmdline = cmdline
+                context.exec_size = int(result.group(1))
+            elif b' install-create ' in cmdline:
+                self._installs.append((cmdline, 0))
+                response += b'Success: created install session [1234]'
                 close_conn = True
             else:
-                response = b''
-        elif data.startswith(b'RECV'):
-            response = b'DATA\x04\x00\x00\x001234'
-            response += b'DONE\x00\x00\x00\x00'
-        elif data.startswith(b'DONE'):
-            response += b'\x00\x00\x00\x00'
-            close_conn = True
-        elif data.startswith(b'QUIT'):
-            response = b''
-            close_conn = True
+                self._installs.append((cmdline, 0))
+                response += b'Success'
+                close_conn = True
+        elif data == b'sync:':
+            context.sync_mode = True
         elif data == b'framebuffer:':
-            pass
+            response += gen_framebuffer(4, 2)
+            close_conn = True
         else:
             print(repr(data))
             raise
         return response, close_conn
         
 
+    def handle_shell_v2_input(self, context, data):
+        '''处理shell v2协议数据，stdin关闭后按命令行将解压后的数据写入文件
+        '''
+        context.buffer += data
+        while len(context.buffer) >= 5:
+            packet_id, size = struct.unpack('<BI', context.buffer[:5])
+            if len(context.buffer) < 5 + size:
+                break
+            payload = context.buffer[5:5 + size]
+            context.buffer = context.buffer[5 + size:]
+            if packet_id == 0:
+                if b'/readonly/' in context.shell_v2_cmdline:
+                    # 模拟设备端命令提前退出
+                    message = b'Read-only file system'
+                    return b'\x02' + struct.pack('<I', len(message)) + message + b'\x03\x01\x00\x00\x00\x01', True
+                context.stdin_data.append(payload)
+            elif packet_id == 4:
+                result = re.search(br'-c > "(.+)" && chmod (\d+) ', context.shell_v2_cmdline)
+                file_data = zlib.decompress(b''.join(context.stdin_data), 31)
+                self._files[result.group(1)] = (0o100000 | int(result.group(2), 8), len(file_data), int(time.time()))
+                return b'\x03\x01\x00\x00\x00\x00', True
+        return b'', False
+
+    def handle_exec_input(self, context, data):
+        '''处理写入exec:服务标准输入的数据，收到-S指定长度的数据后返回结果
+        '''
+        context.stdin_data.append(data)
+        size = sum(len(it) for it in context.stdin_data)
+        if size < context.exec_size:
+            return b'', False
+        self._installs.append((context.exec_cmdline, size))
+        return b'Success', True
+
+    def handle_sync_input(self, context, data):
+        '''处理sync协议数据，一次收到的数据中可能包含多个请求
+        '''
+        context.buffer += data
+        response_list = []
+        close_conn = False
+        while len(context.buffer) >= 8:
+            cmd = context.buffer[:4]
+            size = struct.unpack('I', context.buffer[4:8])[0]
+            if cmd in (b'STAT', b'SEND', b'RECV', b'LIST', b'DATA'):
+                if len(context.buffer) < 8 + size:
+                    break
+                payload = context.buffer[8:8 + size]
+                context.buffer = context.buffer[8 + size:]
+            else:
+                payload = None
+                context.buffer = context.buffer[8:]
+
+            if cmd == b'STAT':
+                context.file_path = payload
+                if payload in self._files:
+                    response_list.append(b'STAT' + struct.pack('III', *self._files[payload]))
+                else:
+                    response_list.append(b'STAT\x01\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00')
+            elif cmd == b'SEND':
+                path, mode = payload.rsplit(b',', 1)
+                context.file_path = path
+                context.file_mode = int(mode)
+                context.file_size = 0
+            elif cmd == b'DATA':
+                context.file_size += size
+            elif cmd == b'DONE':
+                self._files[context.file_path] = (context.file_mode, context.file_size, size)
+                response_list.append(b'OKAY\x00\x00\x00\x00')
+            elif cmd == b'RECV':
+                result = re.search(br'bench_(\d+)', payload)
+                if result:
+                    response_list.append(gen_sync_data(int(result.group(1))))
+                elif payload in self._files:
+                    response_list.append(gen_sync_data(self._files[payload][1]))
+                else:
+                    response_list.append(b'DATA\x04\x00\x00\x001234DONE\x00\x00\x00\x00')
+            elif cmd == b'LIST':
+                dir_path = payload.rstrip(b'/') + b'/'
+                entry_dict = {}
+                for path, (mode, size, mtime) in self._files.items():
+                    if path.startswith(dir_path):
+                        name = path[len(dir_path):]
+                        if b'/' in name:
+                            entry_dict[name.split(b'/')[0]] = (0o40755, 0, 0)
+                        else:
+                            entry_dict[name] = (mode, size, mtime)
+                for name in [b'.', b'..'] + sorted(entry_dict.keys()):
+                    mode, size, mtime = entry_dict.get(name, (0o40755, 0, 0))
+                    response_list.append(b'DENT' + struct.pack('IIII', mode, size, mtime, len(name)) + name)
+                response_list.append(b'DONE' + b'\x00' * 16)
+            elif cmd == b'QUIT':
+                close_conn = True
+                break
+            else:
+                raise NotImplementedError(cmd)
+        return iter_chunks(response_list), close_conn
+
+
 class TestADBClient(unittest.TestCase):
     '''ADBClient类测试用例
     '''
@@ -238,6 +384,85 @@ class TestADBClient(unittest.TestCase):
             text = fp.read()
             self.assertEqual(text.strip(), '1234')
         
+    def test_push_files(self):
+        client = self.get_client()
+        file_list = []
+        for i in range(5):
+            file_path = tempfile.mktemp('.txt')
+            with open(file_path, 'w') as fp:
+                fp.write('1' * (i + 1) * 100)
+            file_list.append((file_path, '/data/local/tmp/test/%d.txt' % i))
+        file_list.append((tempfile.mktemp('.txt'), '/data/local/tmp/test/notexist.txt'))
+        error_list = client.push_files(self.get_device_name(), file_list)
+        self.assertEqual(error_list[:5], [''] * 5)
+        self.assertIn('No such file', error_list[5])
+        stat_list = client.stat_files(self.get_device_name(), [it[1] for it in file_list[:5]])
+        self.assertEqual([it[1] for it in stat_list], [100, 200, 300, 400, 500])
+        entry_list = client.list_tree(self.get_device_name(), '/data/local/tmp')
+        self.assertEqual(sorted([it[0] for it in entry_list]), ['test/%d.txt' % i for i in range(5)])
+        self.assertEqual(client.get_pool_stats()['hit'], 2)
+
+    def test_features(self):
+        client = self.get_client()
+        result = client.features(self.get_device_name())
+        self.assertEqual(result.split(','), ['shell_v2', 'cmd'])
+
+    def test_push_compressed(self):
+        client = self.get_client()
+        file_path = tempfile.mktemp('.txt')
+        with open(file_path, 'wb') as fp:
+            fp.write(b'1234567890' * 100000)
+        result = client.push_compressed(self.get_device_name(), file_path, '/data/local/tmp/test.txt', 'gzip -d -c')
+        self.assertIn('(1000000 bytes in', result)
+        stat_list = client.stat_files(self.get_device_name(), ['/data/local/tmp/test.txt'])
+        self.assertEqual(stat_list[0][1], 1000000)
+        os.remove(file_path)
+
+    def test_push_compressed_failed(self):
+        client = self.get_client()
+        file_path = tempfile.mktemp('.txt')
+        with open(file_path, 'wb') as fp:
+            fp.write(os.urandom(4 * 1024 * 1024))
+        # 设备端命令退出后不应作为连接错误重试
+        time0 = time.time()
+        self.assertRaises(RuntimeError, client.call, 'push_compressed', self.get_device_name(), file_path, '/readonly/test.txt', 'gzip -d -c', retry_count=1)
+        self.assertTrue(time.time() - time0 < 5)
+        self.assertRaises(AdbError, client.push_compressed, self.get_device_name(), file_path, '/readonly/test.txt', 'gzip -d -c')
+        os.remove(file_path)
+
+    def test_install_streamed(self):
+        client = self.get_client()
+        apk_list = []
+        for size in (100000, 1000):
+            file_path = tempfile.mktemp('.apk')
+            with open(file_path, 'wb') as fp:
+                fp.write(b'1' * size)
+            apk_list.append(file_path)
+        progress_list = []
+        result = client.install_streamed(self.get_device_name(), apk_list[:1], '-r', progress_callback=lambda *args: progress_list.append(args))
+        self.assertEqual(result, 'Success')
+        self.assertEqual(self._mock_server._installs, [(b'cmd package install -r -S 100000', 100000)])
+        self.assertEqual(progress_list[-1], (100000, 100000))
+
+        del self._mock_server._installs[:]
+        result = client.install_streamed(self.get_device_name(), apk_list, use_cmd=False)
+        self.assertEqual(result, 'Success')
+        self.assertEqual([it[0].split(b' -S')[0] for it in self._mock_server._installs], [b'pm install-create', b'pm install-write', b'pm install-write', b'pm install-commit 1234'])
+        self.assertEqual([it[1] for it in self._mock_server._installs], [0, 100000, 1000, 0])
+
+        def exec_with_input(device_id, cmdline, *args, **kwds):
+            if 'install-create' in cmdline:
+                return 'Success: created install session [1234]'
+            raise socket.error('%s failed' % cmdline.split()[1])
+
+        with mock.patch.object(ADBClient, '_exec_with_input', side_effect=exec_with_input):
+            # 放弃会话失败时不掩盖原始异常
+            with self.assertRaises(socket.error) as context:
+                client.install_streamed(self.get_device_name(), apk_list, use_cmd=False)
+            self.assertEqual(str(context.exception), 'install-write failed')
+        for file_path in apk_list:
+            os.remove(file_path)
+
     def test_uninstall(self):
         client = self.get_client()
         result = client.uninstall(self.get_device_name(), 'com.tencent.demo', timeout=20)
@@ -270,11 +495,273 @@ class TestADBClient(unittest.TestCase):
         result = client.disconnect('127.0.0.1:12345')
         self.assertEqual(result, True)
  
-    #def test_snapshot_screen(self):
-    #    from PIL import Image
-    #    client = self.get_client()
-    #    result = client.snapshot_screen(self.get_device_name())
-    #    self.assertIsInstance(result, Image.Image)
+    def test_concurrent_shell(self):
+        client = self.get_client()
+        result_list = []
+        def shell():
+            result_list.append(client.call('shell', self.get_device_name(), 'id', retry_count=1, timeout=10))
+        thread_list = [threading.Thread(target=shell) for _ in range(8)]
+        for t in thread_list: t.start()
+        for t in thread_list: t.join()
+        self.assertEqual(len(result_list), 8)
+        for stdout, _ in result_list:
+            self.assertIn(b'uid=0(root)', stdout)
+        stats = client.get_pool_stats()
+        self.assertEqual(stats['active'], 0)
+        self.assertGreaterEqual(stats['miss'], 8)
+
+    def test_async_transport_failed(self):
+        client = self.get_client()
+        active = client.get_pool_stats()['active']
+        with mock.patch.object(ADBClient, '_send_command', side_effect=socket.error('mock error')):
+            self.assertRaises(socket.error, client.call, 'shell', self.get_device_name(), 'id', sync=False)
+        # 失败时释放租用的连接
+        self.assertEqual(client.get_pool_stats()['active'], active)
+        self.assertEqual(client._sock, None)
+
+    def test_snapshot_screen(self):
+        from PIL import Image
+        client = self.get_client()
+        result = client.snapshot_screen(self.get_device_name())
+        self.assertIsInstance(result, Image.Image)
+        self.assertEqual(result.size, (4, 2))
+        self.assertEqual(result.getpixel((0, 0)), (255, 0, 0, 255))
+
+    def test_pull_large_file(self):
+        client = self.get_client()
+        file_path = tempfile.mktemp('.bin')
+        size = 3 * SYNC_DATA_MAX + 100
+        client.pull(self.get_device_name(), '/data/local/tmp/bench_%d.bin' % size, file_path)
+        self.assertEqual(os.path.getsize(file_path), size)
+        os.remove(file_path)
  
+class TestADBClientBenchmark(unittest.TestCase):
+    '''ADBClient传输性能测试，默认只测试1MB，设置环境变量QT4A_BENCHMARK=1时同时测试50MB和500MB
+    '''
+
+    def setUp(self):
+        self._port = random.randint(10000, 60000)
+        self._mock_server = MockADBServer(self._port)
+
+    def tearDown(self):
+        self._mock_server.stop()
+
+    def test_pull_throughput(self):
+        client = ADBClient.get_client('127.0.0.1', self._port)
+        size_list = [1]
+        if os.environ.get('QT4A_BENCHMARK') == '1':
+            size_list += [50, 500]
+        for size in size_list:
+            file_path = tempfile.mktemp('.bin')
+            time0 = time.time()
+            client.pull('127.0.0.1:21369', '/data/local/tmp/bench_%d.bin' % (size * 1024 * 1024), file_path)
+            time_cost = time.time() - time0
+            self.assertEqual(os.path.getsize(file_path), size * 1024 * 1024)
+            os.remove(file_path)
+            print('pull %d MB: %.2f MB/s' % (size, size / max(time_cost, 1e-6)))
+
+
+class TestADBConnectionPool(unittest.TestCase):
+    '''ADBConnectionPool类测试用例
+    '''
+
+    def setUp(self):
+        self._port = random.randint(10000, 60000)
+        self._mock_server = MockADBServer(self._port)
+
+    def tearDown(self):
+        self._mock_server.stop()
+
+    def test_max_connections(self):
+        pool = ADBConnectionPool('127.0.0.1', self._port, max_connections=1)
+        sock, reused = pool.acquire('device1')
+        self.assertFalse(reused)
+        result = []
+        def acquire():
+            result.append(pool.acquire('device1')[0])
+        t = threading.Thread(target=acquire)
+        t.start()
+        time.sleep(0.2)
+        self.assertEqual(result, [])
+        pool.release(sock)
+        t.join(5)
+        self.assertEqual(len(result), 1)
+        pool.release(result[0])
+        stats = pool.get_stats()
+        self.assertEqual(stats['wait_count'], 1)
+        self.assertEqual(stats['active'], 0)
+
+    def test_reuse_idle(self):
+        pool = ADBConnectionPool('127.0.0.1', self._port)
+        sock, _ = pool.acquire('device1', 'sync:')
+        pool.release(sock, 'sync:')
+        sock2, reused = pool.acquire('device1', 'sync:')
+        self.assertTrue(reused)
+        self.assertIs(sock2, sock)
+        pool.release(sock2)
+        stats = pool.get_stats()
+        self.assertEqual(stats['hit'], 1)
+        self.assertEqual(stats['miss'], 1)
+        self.assertEqual(stats['idle'], 0)
+
+class TestPipe(unittest.TestCase):
+    '''Pipe类测试用例
+    '''
+
+    def test_readline(self):
+        pipe = Pipe(capacity=16)
+        pipe.write(b'1234567890\n')
+        self.assertEqual(pipe.readline(), b'1234567890\n')
+        pipe.write(b'abcdef\nghi')  # 跨越缓冲区尾部
+        self.assertEqual(pipe.readline(), b'abcdef\n')
+        pipe.write(b'\n')
+        self.assertEqual(pipe.readline(), b'ghi\n')
+        pipe.write(b'end')
+        pipe.close()
+        self.assertEqual(list(pipe), [b'end'])
+        self.assertEqual(pipe.readline(), b'')
+
+    def test_readline_wakeup(self):
+        pipe = Pipe()
+        def write():
+            time.sleep(0.2)
+            pipe.write(b'line\n')
+        t = threading.Thread(target=write)
+        t.start()
+        self.assertEqual(pipe.readline(), b'line\n')
+        t.join()
+
+    def test_block(self):
+        pipe = Pipe(capacity=8)
+        def write():
+            pipe.write(b'0123456789abcdef\n')
+            pipe.close()
+        t = threading.Thread(target=write)
+        t.start()
+        self.assertEqual(b''.join(pipe), b'0123456789abcdef\n')
+        t.join()
+
+    def test_drop_oldest(self):
+        pipe = Pipe(capacity=16, overflow=Pipe.OVERFLOW_DROP_OLDEST)
+        pipe.write(b'line1\nline2\n')
+        pipe.write(b'line3\nline4\n')
+        self.assertEqual(pipe.read(), b'line3\nline4\n')
+        self.assertEqual(pipe.dropped_bytes, 12)
+
+    def test_spill(self):
+        pipe = Pipe(capacity=16, overflow=Pipe.OVERFLOW_SPILL)
+        line_list = [b'line%d\n' % i for i in range(100)]
+        for line in line_list:
+            pipe.write(line)
+        pipe.close()
+        self.assertGreater(pipe.spilled_bytes, 0)
+        self.assertEqual(list(pipe), line_list)
+
+    def test_read_lines(self):
+        pipe = Pipe(capacity=16)
+        event_list = []
+        pipe.data_callback = lambda: event_list.append(1)
+        pipe.write(b'line1\nlin')
+        self.assertEqual(pipe.read_lines(), [b'line1'])
+        self.assertEqual(pipe.read_lines(), [])
+        pipe.write(b'e2\n\nline3')
+        self.assertEqual(pipe.read_lines(), [b'line2', b''])
+        pipe.close()
+        self.assertEqual(pipe.read_lines(), [b'line3'])
+        self.assertEqual(pipe.read_lines(), [])
+        self.assertEqual(len(event_list), 3)
+
+
+class TestADBPopen(unittest.TestCase):
+    '''ADBPopen类测试用例
+    '''
+
+    def test_shared_thread(self):
+        thread_count = threading.active_count()
+        sock_list = []
+        proc_list = []
+        for _ in range(20):
+            sock1, sock2 = socket.socketpair()
+            sock_list.append(sock1)
+            proc_list.append(ADBPopen(sock2))
+        self.assertLessEqual(threading.active_count(), thread_count + 1)
+        for i, sock in enumerate(sock_list):
+            sock.sendall(b'line%d\n' % i)
+        for i, proc in enumerate(proc_list):
+            self.assertEqual(proc.stdout.readline(), b'line%d\n' % i)
+            self.assertEqual(proc.poll(), None)
+        for sock in sock_list:
+            sock.close()
+        for proc in proc_list:
+            self.assertEqual(proc.communicate(), (b'', b''))
+            self.assertEqual(proc.poll(), 0)
+
+    def test_pause(self):
+        sock1, sock2 = socket.socketpair()
+        proc = ADBPopen(sock2, overflow=Pipe.OVERFLOW_BLOCK)
+        data = b'1234567\n' * 1024 * 256
+        t = threading.Thread(target=lambda: (sock1.sendall(data), sock1.close()))
+        t.start()
+        self.assertEqual(b''.join(proc.stdout), data)
+        t.join()
+
+    def test_timeout(self):
+        sock1, sock2 = socket.socketpair()
+        proc = ADBPopen(sock2, timeout=0.5)
+        self.assertRaises(TimeoutError, proc.communicate)
+        sock1.close()
+
+    def test_terminate(self):
+        sock1, sock2 = socket.socketpair()
+        proc = ADBPopen(sock2)
+        proc.terminate()
+        self.assertEqual(proc.poll(), 0)
+        self.assertEqual(proc.stdout.readline(), b'')
+        sock1.close()
+
+
+class TestPipeBenchmark(unittest.TestCase):
+    '''Pipe吞吐量与唤醒延迟测试
+    '''
+
+    line = b'10-17 10:46:13.395  1000  2287 I ActivityManager: ' + b'x' * 60 + b'\n'
+
+    def test_throughput(self):
+        count = 100000
+        pipe = Pipe(overflow=Pipe.OVERFLOW_SPILL)
+        def write():
+            for _ in range(count):
+                pipe.write(self.line)
+            pipe.close()
+        time0 = time.time()
+        t = threading.Thread(target=write)
+        t.start()
+        read_count = 0
+        for _ in pipe:
+            read_count += 1
+        time_cost = max(time.time() - time0, 1e-6)
+        t.join()
+        self.assertEqual(read_count, count)
+        print('pipe throughput: %.2f MB/s, %d lines/s' % (count * len(self.line) / time_cost / 1e6, count / time_cost))
+
+    def test_latency(self):
+        pipe = Pipe()
+        latency_list = []
+        for _ in range(20):
+            time_list = []
+            def write():
+                time.sleep(0.01)
+                time_list.append(time.time())
+                pipe.write(self.line)
+            t = threading.Thread(target=write)
+            t.start()
+            pipe.readline()
+            latency_list.append(time.time() - time_list[0])
+            t.join()
+        avg_latency = sum(latency_list) / len(latency_list)
+        self.assertLess(avg_latency, 0.05)
+        print('pipe latency: %.3f ms' % (avg_latency * 1000))
+
+
 if __name__ == '__main__':
     unittest.main()
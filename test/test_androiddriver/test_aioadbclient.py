@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+'''aioadbclient模块单元测试
+'''
+
+import os
+import random
+import tempfile
+import unittest
+
+import six
+
+from qt4a.androiddriver.adbclient import ADBClient
+from test.test_androiddriver.test_adbclient import MockADBServer
+
+if not six.PY2:
+    import asyncio
+    from qt4a.androiddriver.aioadbclient import AsyncADBClient
+
+
+@unittest.skipIf(six.PY2, 'asyncio is not supported')
+class TestAsyncADBClient(unittest.TestCase):
+    '''AsyncADBClient类测试用例
+    '''
+
+    def setUp(self):
+        self._port = random.randint(10000, 60000)
+        self._mock_server = MockADBServer(self._port)
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self._loop.close()
+        self._mock_server.stop()
+
+    def get_client(self):
+        return AsyncADBClient('127.0.0.1', self._port)
+
+    def get_device_name(self):
+        return '127.0.0.1:21369'
+
+    def run_coroutine(self, coro):
+        return self._loop.run_until_complete(coro)
+
+    def test_devices(self):
+        client = self.get_client()
+        result = self.run_coroutine(client.devices())
+        self.assertEqual(result, ADBClient.get_client('127.0.0.1', self._port).devices())
+
+    def test_shell(self):
+        client = self.get_client()
+        stdout, stderr = self.run_coroutine(client.shell(self.get_device_name(), 'id'))
+        self.assertEqual((stdout, stderr), ADBClient.get_client('127.0.0.1', self._port).shell(self.get_device_name(), 'id', timeout=10))
+
+    def test_shell_gather(self):
+        client = AsyncADBClient('127.0.0.1', self._port, max_connections=2)
+        coro_list = [client.shell('device%d' % (i % 3), 'id') for i in range(12)]
+        result_list = self.run_coroutine(asyncio.gather(*coro_list))
+        self.assertEqual(len(result_list), 12)
+        for stdout, _ in result_list:
+            self.assertIn(b'uid=0(root)', stdout)
+
+    def test_open_shell(self):
+        client = self.get_client()
+        stream = self.run_coroutine(client.open_shell(self.get_device_name(), 'id'))
+        line_list = []
+
+        async_iter = stream.__aiter__()
+        while True:
+            try:
+                line_list.append(self.run_coroutine(async_iter.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(len(line_list), 1)
+        self.assertTrue(line_list[0].startswith(b'uid=0(root)'))
+
+    def test_push_pull(self):
+        client = self.get_client()
+        file_path = tempfile.mktemp('.txt')
+        with open(file_path, 'wb') as fp:
+            fp.write(b'1' * 100000)
+        result = self.run_coroutine(client.push(self.get_device_name(), file_path, '/data/local/tmp/1.txt'))
+        self.assertIn('(100000 bytes in', result)
+        stat = self.run_coroutine(client.stat(self.get_device_name(), '/data/local/tmp/1.txt'))
+        self.assertEqual(stat[1], 100000)
+        result = self.run_coroutine(client.pull(self.get_device_name(), '/data/local/tmp/1.txt', file_path))
+        self.assertIn('(100000 bytes in', result)
+        self.assertEqual(os.path.getsize(file_path), 100000)
+        os.remove(file_path)
+
+    def test_snapshot_screen(self):
+        client = self.get_client()
+        image = self.run_coroutine(client.snapshot_screen(self.get_device_name()))
+        self.assertEqual(image.size, (4, 2))
+        self.assertEqual(image.getpixel((0, 0)), (255, 0, 0, 255))
+
+
+if __name__ == '__main__':
+    unittest.main()
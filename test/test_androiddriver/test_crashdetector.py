@@ -0,0 +1,112 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+'''crashdetector模块单元测试
+'''
+
+import unittest
+
+from qt4a.androiddriver.adb import ADB, LocalADBBackend
+from qt4a.androiddriver.crashdetector import CrashDetector, EnumCrashKind
+from qt4a.androiddriver.logcat import LogcatStore
+
+
+log_lines = [
+    ('com.qta.qt4a', 100, 100, 'I', 'test', 'before crash'),
+    ('com.qta.qt4a', 100, 100, 'E', 'AndroidRuntime', 'FATAL EXCEPTION: main'),
+    ('com.qta.qt4a', 100, 101, 'I', 'other', 'other thread'),
+    ('com.qta.qt4a', 100, 100, 'E', 'AndroidRuntime', 'java.lang.NullPointerException'),
+    ('com.qta.qt4a', 100, 100, 'E', 'AndroidRuntime', '\tat com.qta.qt4a.MainActivity.onCreate(MainActivity.java:10)'),
+    ('com.qta.qt4a', 100, 100, 'I', 'Process', 'Sending signal. PID: 100 SIG: 9'),
+    ('/system/bin/crash_dump64', 300, 300, 'F', 'DEBUG', '*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***'),
+    ('/system/bin/crash_dump64', 300, 300, 'F', 'DEBUG', 'pid: 200, tid: 200, name: Thread-2  >>> com.qta.other <<<'),
+    ('/system/bin/crash_dump64', 300, 300, 'F', 'DEBUG', 'signal 11 (SIGSEGV), code 1 (SEGV_MAPERR), fault addr 0x0'),
+    ('system_server', 1000, 1020, 'E', 'ActivityManager', 'ANR in com.qta.qt4a (com.qta.qt4a/.MainActivity)'),
+    ('system_server', 1000, 1020, 'E', 'ActivityManager', 'Reason: Input dispatching timed out'),
+    ('com.qta.qt4a', 100, 100, 'W', 'MyCrash', 'custom crash'),
+]
+
+
+class TestCrashDetector(unittest.TestCase):
+    '''CrashDetector类测试用例
+    '''
+
+    def feed(self, detector):
+        store = LogcatStore()
+        for process_name, pid, tid, level, tag, message in log_lines:
+            detector.feed(store.append(pid, process_name, '2021-01-01', '10:59:42.899', level, tag, tid, message))
+        return store
+
+    def test_detect(self):
+        event_list = []
+        detector = CrashDetector([('MyCrash', 'custom')], context_lines=2, callback=event_list.append)
+        self.feed(detector)
+        self.assertEqual([(it.kind, it.process_name) for it in event_list], [
+            (EnumCrashKind.JAVA, 'com.qta.qt4a'),
+            (EnumCrashKind.NATIVE, 'com.qta.other'),
+            (EnumCrashKind.ANR, 'com.qta.qt4a'),
+            (EnumCrashKind.CUSTOM, 'com.qta.qt4a'),
+        ])
+        java_crash = event_list[0]
+        self.assertEqual([it.message for it in java_crash.records], [
+            'FATAL EXCEPTION: main',
+            'java.lang.NullPointerException',
+            '\tat com.qta.qt4a.MainActivity.onCreate(MainActivity.java:10)',
+        ])
+        self.assertEqual([it.message for it in java_crash.context], ['before crash'])
+        self.assertEqual(len(event_list[1].records), 2)
+        self.assertEqual(len(event_list[1].context), 2)
+        self.assertEqual(len(event_list[2].records), 2)
+
+    def test_get_events(self):
+        detector = CrashDetector()
+        self.feed(detector)
+        self.assertEqual(len(detector.get_events()), 3)
+        self.assertEqual([it.kind for it in detector.get_events(['com.qta.qt4a'])], [EnumCrashKind.JAVA, EnumCrashKind.ANR])
+        self.assertEqual([it.kind for it in detector.get_events([r'com\.qta\.other'])], [EnumCrashKind.NATIVE])
+
+    def test_rename_after_crash(self):
+        store = LogcatStore()
+        detector = CrashDetector()
+        detector.feed(store.append(400, '<pre-initialized>', '2021-01-01', '10:59:42.899', 'E', 'AndroidRuntime', 400, 'FATAL EXCEPTION: main'))
+        self.assertEqual(detector.get_events(['com.qta.qt4a']), [])
+        # 进程名在crash日志之后才确定
+        store.rename_process(store.get_process(400), 'com.qta.qt4a:service')
+        event_list = detector.get_events(['com.qta.qt4a'])
+        self.assertEqual(len(event_list), 1)
+        self.assertEqual(event_list[0].process_name, 'com.qta.qt4a:service')
+
+    def test_feed_line(self):
+        detector = CrashDetector()
+        store = self.feed(CrashDetector())
+        for line in store.get_lines():
+            detector.feed_line(line)
+        event_list = detector.get_events(['com.qta.qt4a'])
+        self.assertEqual(len(event_list), 2)
+        self.assertEqual(event_list[0].lines[0], '[com.qta.qt4a(100)] [2021-01-01 10:59:42.899] E/AndroidRuntime(100): FATAL EXCEPTION: main')
+        self.assertEqual(event_list[0].tid, 100)
+
+    def test_attach(self):
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        detector = CrashDetector()
+        detector.attach(adb)
+        for process_name, pid, tid, level, tag, message in log_lines:
+            adb.insert_logcat('%s(%d)' % (process_name, pid), 2021, '01-01', '10:59:42.899', level, tag, tid, message)
+        detector.detach(adb)
+        self.assertEqual(len(detector.get_events()), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
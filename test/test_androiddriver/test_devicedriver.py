@@ -71,7 +71,9 @@ def mock_run_shell_cmd(cmd_line, root=False, **kwds):
             if not "-w" in args:
                 return "Starting: Intent { cmp=%s }" % activity
     elif args[0] == "getprop":
-        if args[1] == "ro.build.version.sdk":
+        if len(args) == 1:
+            return "[ro.build.version.sdk]: [25]"
+        elif args[1] == "ro.build.version.sdk":
             return 25
     elif args[0] == "dumpsys":
         if args[1] == "window":
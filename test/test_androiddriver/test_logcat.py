@@ -0,0 +1,416 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+'''logcat模块单元测试
+'''
+
+import gc
+import gzip
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import six
+
+from qt4a.androiddriver.adbclient import Pipe
+from qt4a.androiddriver.logcat import LogcatBinaryParser, LogcatSegmentWriter, LogcatStore, LogcatSubscription, threadtime_pattern
+from qt4a.androiddriver.util import enforce_utf8_decode
+
+
+def pack_entry(pid, tid, sec, nsec, priority, tag, message, version=4, lid=0):
+    '''构造logger_entry记录
+    '''
+    payload = struct.pack('B', priority) + tag + b'\0' + message + b'\0'
+    if version == 1:
+        header = struct.pack('<HHiiii', len(payload), 0, pid, tid, sec, nsec)
+    elif version == 4:
+        header = struct.pack('<HHiIIIII', len(payload), 28, pid, tid, sec, nsec, lid, 0)
+    else:
+        header = struct.pack('<HHiIIII', len(payload), 24, pid, tid, sec, nsec, lid)
+    return header + payload
+
+
+class TestLogcatStore(unittest.TestCase):
+    '''LogcatStore类测试用例
+    '''
+
+    def append(self, store, pid, process_name, index):
+        store.append(pid, process_name, '2021-01-01', '10:59:42.899', 'I', 'test', pid, 'line %d' % index)
+
+    def test_format(self):
+        store = LogcatStore()
+        store.append(100, 'com.tencent.demo', '2021-01-01', '10:59:42.899', 'I', 'test', 101, '中文'.encode('gbk'))
+        store.append(0, 'test', '2021-01-01', '10:59:42.899', 'D', 'test', 1, '测试')
+        self.assertEqual(store.get_lines(), [
+            '[com.tencent.demo(100)] [2021-01-01 10:59:42.899] I/test(101): 中文'.encode('utf8'),
+            '[test] [2021-01-01 10:59:42.899] D/test(1): 测试'.encode('utf8'),
+        ])
+
+    def test_rename_process(self):
+        store = LogcatStore()
+        self.append(store, 100, '<pre-initialized>', 0)
+        self.append(store, 100, '<pre-initialized>', 1)
+        self.append(store, 200, '<pre-initialized>', 2)
+        process = store.get_process(100)
+        store.rename_process(process, 'com.tencent.demo')
+        self.append(store, 100, 'com.tencent.demo', 3)
+        store.drop_process(store.get_process(200))
+        lines = store.get_lines()
+        self.assertEqual(len(lines), 3)
+        for line in lines:
+            self.assertTrue(line.startswith(b'[com.tencent.demo(100)]'))
+        # 进程ID被复用后不影响之前的日志
+        self.append(store, 100, 'com.tencent.other', 4)
+        lines = store.get_lines()
+        self.assertTrue(lines[2].startswith(b'[com.tencent.demo(100)]'))
+        self.assertTrue(lines[3].startswith(b'[com.tencent.other(100)]'))
+
+    def test_retention(self):
+        store = LogcatStore(max_lines=10)
+        store.segment_size = 4
+        for i in range(20):
+            self.append(store, 100, 'com.tencent.demo', i)
+        lines = store.get_lines()
+        self.assertTrue(10 <= len(lines) < 14)
+        self.assertEqual(store.evicted_lines + len(lines), 20)
+        self.assertTrue(lines[-1].endswith(b'line 19'))
+
+    def test_segment_files(self):
+        segment_dir = tempfile.mktemp()
+        save_path = tempfile.mktemp('.log')
+        store = LogcatStore(max_lines=10, segment_dir=segment_dir)
+        store.segment_size = 4
+        for i in range(20):
+            self.append(store, 100, 'com.tencent.demo', i)
+        # 写满的段延迟写入磁盘
+        self.assertEqual(store.spilled_lines, 12)
+        self.assertEqual(len(os.listdir(segment_dir)), 1)
+        self.assertEqual(len(store), 20)
+        lines = store.get_lines()
+        self.assertEqual([it.split(b': ')[-1] for it in lines], [b'line %d' % i for i in range(20)])
+        store.save(save_path)
+        with open(save_path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'\n'.join(lines))
+        # 压缩格式直接拼接导出
+        store.save(save_path + '.gz')
+        with gzip.open(save_path + '.gz', 'rb') as fp:
+            self.assertEqual(fp.read(), b'\n'.join(lines) + b'\n')
+        # 按时间范围导出
+        store.save(save_path, start_time='2021-01-01 11:00:00.000')
+        with open(save_path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'')
+        store.clear()
+        self.assertEqual(len(store), 0)
+        self.assertFalse(os.path.exists(segment_dir))
+        os.remove(save_path)
+        os.remove(save_path + '.gz')
+
+    def test_temp_segment_dir(self):
+        store = LogcatStore(max_lines=10, segment_dir=True)
+        store.segment_size = 4
+        for i in range(4):
+            self.append(store, 100, 'com.tencent.demo', i)
+        # 没有日志落盘时不创建目录
+        self.assertEqual(store.spilled_lines, 0)
+        self.assertEqual(store._writer._directory, None)
+        for i in range(4, 20):
+            self.append(store, 100, 'com.tencent.demo', i)
+        segment_dir = store._writer._directory
+        self.assertTrue(os.path.isdir(segment_dir))
+        store.clear()
+        self.assertFalse(os.path.exists(segment_dir))
+        for i in range(20):
+            self.append(store, 100, 'com.tencent.demo', i)
+        segment_dir = store._writer._directory
+        self.assertTrue(os.path.isdir(segment_dir))
+        del store
+        gc.collect()
+        self.assertFalse(os.path.exists(segment_dir))
+
+    def test_rotate(self):
+        writer = LogcatSegmentWriter(tempfile.mktemp())
+        writer.max_file_lines = 4
+        for i in range(5):
+            writer.write([b'line %d' % (i * 2), b'line %d' % (i * 2 + 1)], '2021-01-01 10:59:%02d.000' % i, '2021-01-01 10:59:%02d.999' % i)
+        self.assertEqual(len(writer.get_files()), 3)
+        self.assertEqual(len(writer.get_files('2021-01-01 10:59:02.500', '2021-01-01 10:59:03.500')), 1)
+        self.assertEqual(list(writer.iter_lines()), [b'line %d' % i for i in range(10)])
+        writer.clear()
+        self.assertEqual(writer.get_files(), [])
+
+
+class TestLogcatQuery(unittest.TestCase):
+    '''LogcatStore日志查询测试用例
+    '''
+
+    def setUp(self):
+        self._store = LogcatStore()
+        self._store.segment_size = 4
+        for i in range(20):
+            process_name = 'com.qta.qt4a' if i % 2 else 'com.qta.other'
+            tag = 'ActivityManager' if i % 3 else 'test'
+            level = 'E' if i % 5 == 0 else 'I'
+            self._store.append(100 + i % 2, process_name, '2021-01-01', '10:59:%02d.000' % i, level, tag, 1, 'line %d' % i)
+
+    def messages(self, record_list):
+        return [int(it.message.split()[-1]) for it in record_list]
+
+    def test_query(self):
+        store = self._store
+        self.assertEqual(self.messages(store.query(tag='test')), [0, 3, 6, 9, 12, 15, 18])
+        self.assertEqual(self.messages(store.query(tag='test', process_name=r'com\.qta\.qt4a$')), [3, 9, 15])
+        self.assertEqual(self.messages(store.query(tag=['test', 'ActivityManager'], level='W', pid=100)), [0, 10])
+        self.assertEqual(self.messages(store.query(pattern=r'line 1\d')), list(range(10, 20)))
+        self.assertEqual(self.messages(store.query(tag='test', reverse=True, limit=2)), [18, 15])
+        self.assertEqual(self.messages(store.query(tag='test', since=9)), [9, 12, 15, 18])
+        self.assertEqual(self.messages(store.query(tag='test', start_time='2021-01-01 10:59:10.000')), [12, 15, 18])
+        self.assertEqual(store.query(tag='none'), [])
+        store.drop_process(store.get_process(101))
+        self.assertEqual(self.messages(store.query(tag='test')), [0, 6, 12, 18])
+
+    def test_wait_for_log(self):
+        store = self._store
+        cursor = store.cursor
+        self.assertEqual(store.wait_for_log(tag='test', since=0, timeout=0).message, 'line 0')
+        self.assertEqual(store.wait_for_log(tag='test', timeout=0.1), None)
+
+        def write():
+            time.sleep(0.2)
+            store.append(100, 'com.qta.qt4a', '2021-01-01', '11:00:00.000', 'I', 'other', 1, 'skip')
+            store.append(100, 'com.qta.qt4a', '2021-01-01', '11:00:00.000', 'I', 'test', 1, 'done')
+
+        t = threading.Thread(target=write)
+        t.start()
+        time0 = time.time()
+        record = store.wait_for_log(tag='test', pattern='done', since=cursor, timeout=5)
+        t.join()
+        self.assertEqual(record.message, 'done')
+        self.assertEqual(record.seq, cursor + 2)
+        self.assertLess(time.time() - time0, 2)
+
+
+class TestLogcatSubscription(unittest.TestCase):
+    '''LogcatSubscription类测试用例
+    '''
+
+    def setUp(self):
+        self._store = LogcatStore()
+
+    def append(self, pid, level, tag, message):
+        return self._store.append(pid, 'com.qta.qt4a', '2021-01-01', '10:59:42.899', level, tag, pid, message)
+
+    def test_filter(self):
+        subscription = LogcatSubscription(tag=['ActivityManager', 'AndroidRuntime'], level='W', pid=100, pattern=r'Exception')
+        self.assertTrue(subscription.match(self.append(100, 'E', 'AndroidRuntime', 'java.lang.NullPointerException')))
+        self.assertFalse(subscription.match(self.append(100, 'I', 'AndroidRuntime', 'java.lang.NullPointerException')))
+        self.assertFalse(subscription.match(self.append(101, 'E', 'AndroidRuntime', 'java.lang.NullPointerException')))
+        self.assertFalse(subscription.match(self.append(100, 'E', 'test', 'java.lang.NullPointerException')))
+        self.assertFalse(subscription.match(self.append(100, 'E', 'AndroidRuntime', 'FATAL')))
+        subscription = LogcatSubscription(process_name='com.qta')
+        self.assertTrue(subscription.match(self.append(100, 'V', 'test', '')))
+        # 与LogcatStore.query相同，进程名使用正则匹配
+        subscription = LogcatSubscription(process_name=r'com\.qta\.qt4a(:.*)?$')
+        self.assertTrue(subscription.match(self.append(100, 'V', 'test', '')))
+        subscription = LogcatSubscription(process_name=r'com\.qta$')
+        self.assertFalse(subscription.match(self.append(100, 'V', 'test', '')))
+
+    def test_drop_policy(self):
+        for policy, expected in ((LogcatSubscription.POLICY_DROP_OLDEST, ['7', '8', '9']), (LogcatSubscription.POLICY_DROP_NEWEST, ['0', '1', '2'])):
+            subscription = LogcatSubscription(max_size=3, policy=policy)
+            for i in range(10):
+                subscription.put(self.append(100, 'I', 'test', '%d' % i))
+            self.assertEqual(subscription.get_stats(), {'received': 10, 'delivered': 0, 'dropped': 7, 'lag': 3, 'max_lag': 3})
+            subscription.close()
+            self.assertEqual([it.message for it in subscription], expected)
+            self.assertEqual(subscription.lag, 0)
+
+    def test_block_policy(self):
+        subscription = LogcatSubscription(max_size=2, policy=LogcatSubscription.POLICY_BLOCK)
+
+        def write():
+            for i in range(10):
+                subscription.put(self.append(100, 'I', 'test', '%d' % i))
+            subscription.close()
+
+        t = threading.Thread(target=write)
+        t.start()
+        result = []
+        for record in subscription:
+            self.assertTrue(subscription.lag <= 2)
+            result.append(record.message)
+        t.join()
+        self.assertEqual(result, ['%d' % i for i in range(10)])
+        self.assertEqual(subscription.dropped, 0)
+
+    def test_callback(self):
+        event = threading.Event()
+        result = []
+
+        def callback(record):
+            if record.message == 'slow':
+                event.wait(5)
+            result.append(record.message)
+
+        subscription = LogcatSubscription(callback)
+        time0 = time.time()
+        subscription.put(self.append(100, 'I', 'test', 'slow'))
+        subscription.put(self.append(100, 'I', 'test', 'fast'))
+        # 回调执行慢不影响写入
+        self.assertLess(time.time() - time0, 1)
+        event.set()
+        for _ in range(50):
+            if len(result) == 2:
+                break
+            time.sleep(0.1)
+        self.assertEqual(result, ['slow', 'fast'])
+        subscription.close()
+
+    @unittest.skipIf(six.PY2, 'asyncio is not supported')
+    def test_async_iter(self):
+        import asyncio
+        subscription = LogcatSubscription()
+        for i in range(3):
+            subscription.put(self.append(100, 'I', 'test', '%d' % i))
+        subscription.close()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        result = []
+
+        def read():
+            async_iter = subscription.__aiter__()
+            while True:
+                try:
+                    result.append(loop.run_until_complete(async_iter.__anext__()).message)
+                except StopAsyncIteration:
+                    break
+
+        try:
+            read()
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(result, ['0', '1', '2'])
+
+    @unittest.skipIf(six.PY2, 'asyncio is not supported')
+    def test_async_wait(self):
+        import asyncio
+        subscription = LogcatSubscription()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        def write():
+            for i in range(3):
+                subscription.put(self.append(100, 'I', 'test', '%d' % i))
+            subscription.close()
+
+        def read():
+            # 超时取消的读取不会取走日志
+            self.assertRaises(asyncio.TimeoutError, loop.run_until_complete, asyncio.wait_for(subscription.__anext__(), 0.1))
+            self.assertEqual(len(subscription._async_waiters), 1)
+            t = threading.Timer(0.1, write)
+            t.start()
+            result = []
+            while True:
+                try:
+                    result.append(loop.run_until_complete(subscription.__anext__()).message)
+                except StopAsyncIteration:
+                    break
+            t.join()
+            return result
+
+        try:
+            self.assertEqual(read(), ['0', '1', '2'])
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class TestLogcatBinaryParser(unittest.TestCase):
+    '''LogcatBinaryParser类测试用例
+    '''
+
+    def test_feed(self):
+        parser = LogcatBinaryParser(8 * 3600)
+        data = pack_entry(100, 101, 1609469982, 899000000, 4, b'test', '中文'.encode('utf8'), version=1)
+        data += pack_entry(100, 102, 1609469982, 900000000, 6, b'AndroidRuntime', b'line 1\nline 2\n', version=3)
+        data += pack_entry(200, 200, 1609469983, 0, 4, b'events', b'\x01\x02', version=4, lid=2)
+        data += pack_entry(200, 201, 1609469983, 1000000, 3, b'test', b'', version=4)
+        # 分片输入
+        result = []
+        for i in range(0, len(data), 7):
+            result.extend(parser.feed(data[i:i + 7]))
+        self.assertEqual(result, [
+            (2021, '01-01', '10:59:42.899', 100, 101, 'I', 'test', '中文'),
+            (2021, '01-01', '10:59:42.900', 100, 102, 'E', 'AndroidRuntime', 'line 1'),
+            (2021, '01-01', '10:59:42.900', 100, 102, 'E', 'AndroidRuntime', 'line 2'),
+            (2021, '01-01', '10:59:43.001', 200, 201, 'D', 'test', ''),
+        ])
+
+    def test_invalid_data(self):
+        parser = LogcatBinaryParser()
+        self.assertRaises(ValueError, parser.feed, b'01-01 10:59:42.899  100  101 I test: text\n')
+        self.assertEqual(parser.feed(pack_entry(100, 101, 0, 0, 4, b'test', b'ok')), [(1970, '01-01', '00:00:00.000', 100, 101, 'I', 'test', 'ok')])
+
+
+class TestLogcatParseBenchmark(unittest.TestCase):
+    '''文本与二进制格式的logcat解析速度对比
+    '''
+
+    count = 50000
+
+    def test_text_vs_binary(self):
+        message = b'ActivityManager: Start proc 1234:com.tencent.demo/u0a100 for activity ' + b'x' * 40
+        text_lines = [b'01-01 10:59:42.%03d  1000  2287 I ActivityManager: %s\n' % (i % 1000, message) for i in range(self.count)]
+        binary_data = b''.join([pack_entry(1000, 2287, 1609469982 + i // 1000, (i % 1000) * 1000000, 4, b'ActivityManager', message) for i in range(self.count)])
+
+        # 与logcat线程一致：文本格式逐行读取并用正则解析，二进制格式按块读取后解析
+        pipe = Pipe(capacity=len(binary_data) * 2)
+        pipe.write(b''.join(text_lines))
+        pipe.close()
+        time0 = time.time()
+        text_count = 0
+        while True:
+            line = pipe.readline()
+            if not line:
+                break
+            ret = threadtime_pattern.match(enforce_utf8_decode(line).strip())
+            if ret:
+                ret.group(1), ret.group(2), int(ret.group(3)), int(ret.group(4)), ret.group(5), ret.group(6).strip(), ret.group(7)
+                text_count += 1
+        text_cost = max(time.time() - time0, 1e-6)
+
+        pipe = Pipe(capacity=len(binary_data) * 2)
+        pipe.write(binary_data)
+        pipe.close()
+        time0 = time.time()
+        parser = LogcatBinaryParser()
+        binary_count = 0
+        while True:
+            data = pipe.read(65536)
+            if not data:
+                break
+            binary_count += len(parser.feed(data))
+        binary_cost = max(time.time() - time0, 1e-6)
+
+        self.assertEqual(text_count, self.count)
+        self.assertEqual(binary_count, self.count)
+        print('logcat parse: text %d lines/s, binary %d lines/s' % (self.count / text_cost, self.count / binary_cost))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+'''logcataggregator模块单元测试
+'''
+
+try:
+    from unittest import mock
+except:
+    import mock
+import os
+import tempfile
+import time
+import unittest
+
+from qt4a.androiddriver.adb import ADB, LocalADBBackend
+from qt4a.androiddriver.adbclient import Pipe
+from qt4a.androiddriver.logcataggregator import LogcatAggregator
+
+
+class MockLogcatPopen(object):
+    '''logcat进程，结束前poll返回None
+    '''
+
+    def __init__(self):
+        self._stdout = Pipe()
+        self._stderr = Pipe()
+
+    @property
+    def pid(self):
+        return 1
+
+    @property
+    def stdout(self):
+        return self._stdout
+
+    @property
+    def stderr(self):
+        return self._stderr
+
+    def poll(self):
+        return 0 if self._stdout.closed else None
+
+    def terminate(self):
+        self._stdout.close()
+
+
+def create_adb(device_name):
+    adb = ADB(LocalADBBackend('127.0.0.1', device_name))
+    adb.pipe_list = []
+
+    def run_shell_cmd(cmd_line, root=False, **kwds):
+        if kwds.get('sync') is False:
+            pipe = MockLogcatPopen()
+            adb.pipe_list.append(pipe)
+            return pipe
+        return ''
+
+    adb.run_shell_cmd = run_shell_cmd
+    return adb
+
+
+def wait_for(func, timeout=5):
+    time0 = time.time()
+    while time.time() - time0 < timeout:
+        if func():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestLogcatAggregator(unittest.TestCase):
+    '''LogcatAggregator类测试用例
+    '''
+
+    def setUp(self):
+        process_list = [{'pid': 100, 'ppid': 1, 'proc_name': 'com.qta.qt4a'}, {'pid': 200, 'ppid': 1, 'proc_name': 'com.qta.other'}]
+        patcher = mock.patch.object(ADB, '_list_process', return_value=process_list)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_aggregate(self):
+        aggregator = LogcatAggregator(workers=1)
+        adb1 = create_adb('device1')
+        adb2 = create_adb('device2')
+        subscription = aggregator.subscribe(tag='Test')
+        aggregator.add_device(adb1)
+        aggregator.add_device(adb2, ['com.qta.qt4a'])
+        self.assertEqual(sorted(it.device_name for it in aggregator.devices), ['device1', 'device2'])
+        adb1.pipe_list[0].stdout.write(b'01-01 10:59:42.100  100  100 I Test: device1 line1\n01-01 10:59:42.300  200  200 I Test: device1 line2\n')
+        adb2.pipe_list[0].stdout.write(b'01-01 10:59:42.200  100  100 I Test: device2 line1\n01-01 10:59:42.250  200  200 I Test: device2 filtered\n')
+        self.assertTrue(wait_for(lambda: subscription.lag == 3))
+        record_list = aggregator.get_records()
+        self.assertEqual([(device_name, record.message) for device_name, record in record_list], [('device1', 'device1 line1'), ('device2', 'device2 line1'), ('device1', 'device1 line2')])
+        date = record_list[0][1].date
+        self.assertEqual(len(aggregator.get_records(start_time=date + ' 10:59:42.150', end_time=date + ' 10:59:42.250')), 1)
+
+        # logcat进程退出后重启
+        adb1.pipe_list[0].terminate()
+        self.assertTrue(wait_for(lambda: len(adb1.pipe_list) == 2))
+        adb1.pipe_list[1].stdout.write(b'01-01 10:59:43.000  100  100 I Test: device1 line3\n')
+        self.assertTrue(wait_for(lambda: subscription.lag == 4))
+        self.assertEqual(adb1.get_logcat_stats()['restarts'], 1)
+
+        save_path = tempfile.mktemp('.log')
+        aggregator.save_log(save_path)
+        with open(save_path, 'rb') as fp:
+            lines = fp.read().splitlines()
+        os.remove(save_path)
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith(b'[device2] [com.qta.qt4a(100)]'))
+
+        aggregator.remove_device(adb1)
+        aggregator.remove_device(adb2)
+        self.assertEqual(aggregator.devices, [])
+        self.assertEqual(adb1._logcat_subscriptions, [])
+        aggregator.unsubscribe(subscription)
+        self.assertEqual(sorted((device_name, it.message) for device_name, it in subscription), [('device1', 'device1 line1'), ('device1', 'device1 line2'), ('device1', 'device1 line3'), ('device2', 'device2 line1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
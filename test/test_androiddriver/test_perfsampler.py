@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+#
+# Tencent is pleased to support the open source community by making QTA available.
+# Copyright (C) 2016THL A29 Limited, a Tencent company. All rights reserved.
+# Licensed under the BSD 3-Clause License (the "License"); you may not use this
+# file except in compliance with the License. You may obtain a copy of the License at
+#
+# https://opensource.org/licenses/BSD-3-Clause
+#
+# Unless required by applicable law or agreed to in writing, software distributed
+# under the License is distributed on an "AS IS" basis, WITHOUT WARRANTIES OR CONDITIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+#
+
+'''perfsampler模块单元测试
+'''
+
+try:
+    from unittest import mock
+except:
+    import mock
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from qt4a.androiddriver.adb import ADB, LocalADBBackend
+from qt4a.androiddriver.perfsampler import PerfSampler
+
+
+def make_frame(uptime, total, idle, process_time, thread_times, rss_pages=1000):
+    frame = ['%.2f 100.00' % uptime, 'cpu  %d 0 0 %d 0 0 0 0 0 0' % (total - idle, idle), '#P 100']
+    frame.append('100 (com.qta.qt4a) S 1 1 0 0 -1 0 0 0 0 0 %d 0 0 0 20 0 %d 0 0 0' % (process_time, len(thread_times)))
+    frame.append('20000 %d 500 1 0 2000 0' % rss_pages)
+    for tid, (name, cpu_time) in sorted(thread_times.items()):
+        frame.append('%d (%s) S 1 1 0 0 -1 0 0 0 0 0 %d 0 0 0 20 0 1 0 0 0' % (tid, name, cpu_time))
+    return frame
+
+
+class TestPerfSampler(unittest.TestCase):
+    '''PerfSampler类测试用例
+    '''
+
+    def get_sampler(self, **kwds):
+        adb = ADB(LocalADBBackend('127.0.0.1', ''))
+        sampler = PerfSampler(adb, ['com.qta.qt4a'], **kwds)
+        sampler._pids = {'com.qta.qt4a': 100}
+        return sampler
+
+    def test_handle_frame(self):
+        sampler = self.get_sampler()
+        sampler._handle_frame(make_frame(1, 1000, 800, 50, {100: ('main', 40), 101: ('Jit thread pool', 10)}))
+        self.assertEqual(sampler.get_latest(), None)
+        sampler._handle_frame(make_frame(2, 2000, 1300, 250, {100: ('main', 190), 101: ('Jit thread pool', 20), 102: ('(new)', 0)}))
+        sample = sampler.get_latest()
+        self.assertEqual(sample.cpu_usage, 50)
+        process = sample.processes['com.qta.qt4a']
+        self.assertEqual(process.cpu, 20)
+        self.assertEqual(process.rss, 1000 * 4096)
+        self.assertEqual(process.thread_count, 3)
+        self.assertEqual(process.main_thread.cpu, 15)
+        self.assertEqual(process.threads[101].name, 'Jit thread pool')
+        self.assertEqual(process.threads[101].cpu, 1)
+        self.assertEqual(process.threads[102].name, '(new)')
+        # 进程退出
+        frame = make_frame(3, 3000, 2000, 0, {})[:3]
+        sampler._handle_frame(frame)
+        self.assertEqual(sampler.get_latest().processes, {})
+        self.assertTrue(sampler._has_missing_process())
+        self.assertEqual(sampler.get_series('com.qta.qt4a'), [(sample.time, 20)])
+        self.assertEqual([it[1] for it in sampler.get_series()], [50, 30])
+
+    def test_wait_for(self):
+        sampler = self.get_sampler()
+        sampler._running = True
+
+        def feed():
+            process_time = 0
+            for i in range(10):
+                process_time += 500 if i < 5 else 10
+                sampler._handle_frame(make_frame(i, 1000 * (i + 1), 0, process_time, {100: ('main', process_time)}))
+
+        t = threading.Timer(0.1, feed)
+        t.start()
+        self.assertTrue(sampler.wait_for_cpu_low('com.qta.qt4a', 10, 5, timeout=10))
+        t.join()
+        self.assertEqual(len(sampler.get_samples()), 9)
+        # 只检查开始等待后的采样
+        self.assertFalse(sampler.wait_for_cpu_low('com.qta.qt4a', 10, timeout=0.1))
+        sampler._running = False
+        self.assertFalse(sampler.wait_for_system_cpu_low(100, timeout=10))
+
+    def test_export_csv(self):
+        sampler = self.get_sampler()
+        for i in range(3):
+            sampler._handle_frame(make_frame(i, 1000 * (i + 1), 500 * (i + 1), 100 * (i + 1), {100: ('main', 50 * (i + 1)), 101: ('worker', 50 * (i + 1))}))
+        temp_dir = tempfile.mkdtemp()
+        file_path = os.path.join(temp_dir, 'perf.csv')
+        sampler.export_csv(file_path)
+        with open(file_path) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows[0][3:6], ['process', 'pid', 'cpu'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][3:], ['com.qta.qt4a', '100', '10.00', '4096000', '2'])
+        sampler.export_csv(file_path, threads=True)
+        with open(file_path) as fp:
+            rows = list(csv.reader(fp))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[2][-3:], ['101', 'worker', '5.00'])
+        shutil.rmtree(temp_dir)
+
+    @unittest.skipIf(not sys.platform.startswith('linux'), '/proc is required')
+    def test_sample(self):
+        def run_shell_cmd(cmd_line, root=False, **kwds):
+            # 使用本地的sh与/proc模拟设备端
+            if kwds.get('sync', True):
+                return subprocess.check_output(['sh', '-c', cmd_line]).decode('utf8')
+            return subprocess.Popen(['sh', '-c', cmd_line], stdout=subprocess.PIPE)
+
+        with mock.patch.object(ADB, 'run_shell_cmd', side_effect=run_shell_cmd):
+            adb = ADB(LocalADBBackend('127.0.0.1', ''))
+            with mock.patch.object(adb._process_table, 'refresh'), \
+                 mock.patch.object(adb._process_table, 'get_pid', return_value=os.getpid()):
+                with PerfSampler(adb, ['python'], interval=0.1) as sampler:
+                    self.assertTrue(sampler.wait_for(lambda it: 'python' in it.processes, timeout=10))
+            sample = sampler.get_latest()
+            process = sample.processes['python']
+            self.assertEqual(process.pid, os.getpid())
+            self.assertTrue(process.rss > 0)
+            self.assertTrue(process.thread_count >= 1)
+            self.assertIn(os.getpid(), process.threads)
+            self.assertEqual(sampler._page_size, os.sysconf('SC_PAGE_SIZE'))
+            self.assertFalse(sampler.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
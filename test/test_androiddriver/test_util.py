@@ -16,7 +16,10 @@
 '''util模块单元测试
 '''
 
+import os
+import tempfile
 import unittest
+import zipfile
 
 from qt4a.androiddriver import util
 
@@ -46,6 +49,24 @@ class TestUtil(unittest.TestCase):
         result = test('中国', b=u'深圳')
         self.assertEqual(result[0], '中国')
         self.assertEqual(result[1], '深圳')
+
+
+    def test_get_zip_fingerprint(self):
+        file_path = tempfile.mktemp('.apk')
+
+        def make_zip(content):
+            with zipfile.ZipFile(file_path, 'w') as zf:
+                zf.writestr('classes.dex', content)
+            return util.get_zip_fingerprint(file_path)
+
+        fingerprint = make_zip(b'1234')
+        self.assertEqual(len(fingerprint), 32)
+        self.assertEqual(make_zip(b'1234'), fingerprint)
+        self.assertNotEqual(make_zip(b'1235'), fingerprint)
+        with open(file_path, 'wb') as fp:
+            fp.write(b'not a zip file')
+        self.assertEqual(util.get_zip_fingerprint(file_path), util.get_file_md5(file_path))
+        os.remove(file_path)
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -23,6 +23,8 @@ except:
 import unittest
 
 import os
+import shutil
+import tempfile
 from qt4a.androiddriver.adb import ADB, LocalADBBackend
 from qt4a.device import Device, LocalDeviceProvider
 from test.test_androiddriver.test_adb import (
@@ -133,6 +135,71 @@ class TestDevice(unittest.TestCase):
         self.assertEqual(
             device.read_logcat(tag="test", process_name_pattern="", pattern=""), []
         )
+        adb.insert_logcat(
+            "com.qta.qt4a(100)", 2021, "01-01", "10:59:42.900", "I", "test", 100, "value=1"
+        )
+        adb.insert_logcat(
+            "com.qta.qt4a(100)", 2021, "01-01", "10:59:42.901", "I", "test", 100, "value=2"
+        )
+        self.assertEqual(
+            device.read_logcat(
+                tag="test", process_name_pattern=r"com\.qta", pattern=r"value=\d"
+            ),
+            "value=2",
+        )
+        self.assertEqual(
+            device.read_logcat(
+                tag="test", process_name_pattern=r"com\.qta", pattern=r"value", num=0
+            ),
+            ["value=2", "value=1"],
+        )
+        self.assertEqual(
+            device.wait_for_logcat(
+                "test", r"value=1", process_name_pattern=r"com\.qta", since=0, timeout=0
+            ),
+            "value=1",
+        )
+
+    def test_sync_tree(self):
+        device = self._get_device()
+        src_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(src_path, "sub"))
+        for path, size in (("a.txt", 10), ("sub/b.txt", 20)):
+            with open(os.path.join(src_path, *path.split("/")), "wb") as fp:
+                fp.write(b"1" * size)
+        remote_files = {}
+
+        def push_files(file_list):
+            for src_file, dst_file in file_list:
+                remote_files[dst_file] = os.path.getsize(src_file)
+            return []
+
+        def stat_files(path_list):
+            return [(0o100644, remote_files.get(it, 0), 0) for it in path_list]
+
+        os.environ["QT4A_CACHE_PATH"] = tempfile.mkdtemp()
+        with mock.patch.object(
+            ADB, "push_files", side_effect=push_files
+        ), mock.patch.object(
+            ADB, "stat_files", side_effect=stat_files
+        ) as mock_stat_files, mock.patch.object(
+            ADB, "get_boot_id", return_value="boot_id"
+        ):
+            self.assertEqual(device.sync_tree(src_path, "/data/local/tmp/test"), 2)
+            self.assertEqual(
+                remote_files,
+                {"/data/local/tmp/test/a.txt": 10, "/data/local/tmp/test/sub/b.txt": 20},
+            )
+            stat_count = mock_stat_files.call_count
+            # 本地清单缓存命中，不再查询设备
+            self.assertEqual(device.sync_tree(src_path, "/data/local/tmp/test"), 0)
+            self.assertEqual(mock_stat_files.call_count, stat_count)
+            with open(os.path.join(src_path, "a.txt"), "wb") as fp:
+                fp.write(b"1" * 11)
+            self.assertEqual(device.sync_tree(src_path, "/data/local/tmp/test"), 1)
+            self.assertEqual(remote_files["/data/local/tmp/test/a.txt"], 11)
+        shutil.rmtree(src_path)
+        shutil.rmtree(os.environ.pop("QT4A_CACHE_PATH"))
 
 
 class TestLocalDeviceProvider(unittest.TestCase):
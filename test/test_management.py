@@ -16,12 +16,19 @@
 '''management模块单元测试
 '''
 
+try:
+    from unittest import mock
+except:
+    import mock
 import logging
 import os
+import threading
+import time
 import unittest
 import sys
 
-from qt4a.management import qt4a_repack_apk
+from qt4a import management
+from qt4a.management import install_qt4a_driver_to_devices, qt4a_repack_apk
 
 
 class TestManagement(unittest.TestCase):
@@ -54,6 +61,22 @@ class TestManagement(unittest.TestCase):
         outpath = qt4a_repack_apk(apk_path, max_heap_size=1)
         self.assertTrue(os.path.exists(outpath))
 
+    def test_install_driver_to_devices(self):
+        thread_set = set()
+
+        def copy_android_driver(device_id, force=False):
+            thread_set.add(threading.current_thread())
+            time.sleep(0.1)
+            if device_id == 'bad':
+                raise RuntimeError('device offline')
+
+        with mock.patch.object(management, 'copy_android_driver', side_effect=copy_android_driver):
+            result = install_qt4a_driver_to_devices(['a', 'bad', 'c'], workers=3)
+        self.assertEqual([it[0] for it in result], ['a', 'bad', 'c'])
+        self.assertEqual([it[2] for it in result], [None, 'RuntimeError: device offline', None])
+        self.assertTrue(all(it[1] >= 0.1 for it in result))
+        self.assertEqual(len(thread_set), 3)
+
 
 if __name__ == '__main__':
     unittest.main()